@@ -0,0 +1,45 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.core.attribute_filter import DST_ALL, AttributeFilter
+from newrelic.core.config import flatten_settings, global_settings
+
+NAMES = [
+    "request.method",
+    "request.headers.contentType",
+    "request.parameters.password",
+    "response.status",
+    "custom_attribute",
+]
+
+
+class TimeAttributeFilter(object):
+    def setup(self):
+        settings = flatten_settings(global_settings())
+        settings["attributes.exclude"] = ["request.parameters.password", "request.headers.*"]
+        settings["transaction_tracer.attributes.include"] = ["request.parameters.*"]
+        settings["span_events.attributes.exclude"] = ["custom_*"]
+
+        self.attribute_filter = AttributeFilter(settings)
+
+        settings["attributes.filter_cache_size"] = 0
+        self.uncached_attribute_filter = AttributeFilter(settings)
+
+    def time_apply(self):
+        for name in NAMES:
+            self.attribute_filter.apply(name, DST_ALL)
+
+    def time_apply_uncached(self):
+        for name in NAMES:
+            self.uncached_attribute_filter.apply(name, DST_ALL)
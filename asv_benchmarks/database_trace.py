@@ -0,0 +1,54 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.api.background_task import BackgroundTask
+from newrelic.api.database_trace import DatabaseTrace
+from newrelic.core.database_utils import SQLDatabase, SQLStatement, sql_statement
+
+from .util import agent_application, dbapi2_module
+
+SQL = (
+    "SELECT users.id, users.name, orders.total FROM users "
+    "JOIN orders ON orders.user_id = users.id "
+    "WHERE users.email = 'user@example.com' AND orders.total > 100.0 "
+    "ORDER BY orders.total DESC LIMIT 10"
+)
+
+
+class TimeDatabaseTrace(object):
+    def setup(self):
+        self.dbapi2_module = dbapi2_module()
+        self.transaction = BackgroundTask(agent_application(), "TimeDatabaseTrace")
+        self.transaction.__enter__()
+
+    def teardown(self):
+        self.transaction.__exit__(None, None, None)
+
+    def time_database_trace(self):
+        with DatabaseTrace(SQL, dbapi2_module=self.dbapi2_module):
+            pass
+
+
+class TimeSQLStatement(object):
+    def setup(self):
+        self.dbapi2_module = dbapi2_module()
+        self.database = SQLDatabase(self.dbapi2_module)
+
+    def time_sql_statement(self):
+        sql_statement(SQL, self.dbapi2_module)
+
+    def time_sql_statement_uncached(self):
+        statement = SQLStatement(SQL, self.database)
+        statement.obfuscated
+        statement.identifier
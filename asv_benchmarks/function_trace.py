@@ -0,0 +1,42 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.api.background_task import BackgroundTask
+from newrelic.api.function_trace import FunctionTrace
+
+from .util import agent_application
+
+
+class TimeFunctionTrace(object):
+    def setup(self):
+        self.transaction = BackgroundTask(agent_application(), "TimeFunctionTrace")
+        self.transaction.__enter__()
+
+    def teardown(self):
+        self.transaction.__exit__(None, None, None)
+
+    def time_function_trace(self):
+        with FunctionTrace("function"):
+            pass
+
+    def time_nested_function_trace(self):
+        with FunctionTrace("outer"):
+            with FunctionTrace("inner"):
+                pass
+
+
+class TimeFunctionTraceNoTransaction(object):
+    def time_function_trace(self):
+        with FunctionTrace("function"):
+            pass
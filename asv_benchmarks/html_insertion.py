@@ -0,0 +1,45 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.api.html_insertion import insert_html_snippet
+
+SNIPPET = b'<script type="text/javascript">window.NREUM||(NREUM={});</script>'
+
+HEAD = (
+    b"<!DOCTYPE html><html><head>"
+    b'<meta http-equiv="Content-Type" content="text/html; charset=utf-8">'
+    b"<title>Benchmark</title>"
+    + b'<link rel="stylesheet" href="/static/style.css">' * 20
+    + b"</head>"
+)
+
+BODY = b"<body>" + b"<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>" * 200 + b"</body></html>"
+
+HTML = HEAD + BODY
+HTML_NO_HEAD = b"<html>" + BODY
+
+
+def snippet():
+    return SNIPPET
+
+
+class TimeInsertHTMLSnippet(object):
+    def time_insert_html_snippet(self):
+        insert_html_snippet(HTML, snippet)
+
+    def time_insert_html_snippet_no_head(self):
+        insert_html_snippet(HTML_NO_HEAD, snippet)
+
+    def time_insert_html_snippet_no_body(self):
+        insert_html_snippet(HEAD, snippet)
@@ -0,0 +1,66 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.core.rules_engine import RulesEngine
+
+RULES = [
+    {
+        "match_expression": "[0-9]+",
+        "replacement": "*",
+        "ignore": False,
+        "eval_order": 0,
+        "terminate_chain": False,
+        "each_segment": True,
+        "replace_all": False,
+    },
+    {
+        "match_expression": "^(.*)/index\\.php$",
+        "replacement": "\\1",
+        "ignore": False,
+        "eval_order": 1,
+        "terminate_chain": False,
+        "each_segment": False,
+        "replace_all": False,
+    },
+    {
+        "match_expression": ".*\\.(css|gif|ico|jpe?g|js|png|swf)$",
+        "replacement": "/*.\\1",
+        "ignore": False,
+        "eval_order": 2,
+        "terminate_chain": True,
+        "each_segment": False,
+        "replace_all": False,
+    },
+]
+
+NAMES = [
+    "WebTransaction/Uri/users/1234/orders/5678",
+    "WebTransaction/Uri/blog/index.php",
+    "WebTransaction/Uri/static/images/logo.png",
+    "WebTransaction/Function/app.views:index",
+]
+
+
+class TimeRulesEngine(object):
+    def setup(self):
+        self.rules_engine = RulesEngine(RULES)
+        self.uncached_rules_engine = RulesEngine(RULES, cache_size=0)
+
+    def time_normalize(self):
+        for name in NAMES:
+            self.rules_engine.normalize(name)
+
+    def time_normalize_uncached(self):
+        for name in NAMES:
+            self.uncached_rules_engine.normalize(name)
@@ -0,0 +1,42 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.metric import TimeMetric
+from newrelic.core.stats_engine import StatsEngine
+
+
+class TimeHarvestSnapshot(object):
+    # The snapshot empties the stats engine, so it is populated again by
+    # setup() for each call.
+
+    number = 1
+    repeat = 50
+    warmup_time = 0
+
+    params = [100, 1000, 10000]
+    param_names = ["metrics"]
+
+    def setup(self, metrics):
+        self.stats_engine = StatsEngine()
+        self.stats_engine.reset_stats(finalize_application_settings())
+
+        for i in range(metrics):
+            self.stats_engine.record_time_metric(
+                TimeMetric(name="Function/function_%d" % i, scope="", duration=0.1, exclusive=0.05)
+            )
+            self.stats_engine.record_custom_metric("Custom/metric_%d" % i, 1.0)
+
+    def time_harvest_snapshot(self, metrics):
+        self.stats_engine.harvest_snapshot()
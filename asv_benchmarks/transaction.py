@@ -0,0 +1,39 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.api.background_task import BackgroundTask
+from newrelic.api.database_trace import DatabaseTrace
+from newrelic.api.function_trace import FunctionTrace
+
+from .util import agent_application, dbapi2_module
+
+
+class TimeTransaction(object):
+    def setup(self):
+        self.application = agent_application()
+        self.dbapi2_module = dbapi2_module()
+
+    def time_empty_transaction(self):
+        with BackgroundTask(self.application, "TimeTransaction"):
+            pass
+
+    def time_transaction(self):
+        # Transaction.__exit__ includes recording the transaction into the
+        # stats engine of the application via record_transaction().
+
+        with BackgroundTask(self.application, "TimeTransaction"):
+            for _ in range(10):
+                with FunctionTrace("function"):
+                    with DatabaseTrace("SELECT * FROM users WHERE id = 1", dbapi2_module=self.dbapi2_module):
+                        pass
@@ -0,0 +1,62 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers shared by the benchmarks. The agent is run in developer mode so
+that an application can be activated without any data being sent to the
+data collector.
+
+"""
+
+import os
+import types
+
+_application = None
+
+
+def agent_application():
+    """Returns the application used for the benchmarks, initializing the
+    agent and activating the application the first time it is called.
+
+    """
+
+    global _application
+
+    if _application is None:
+        os.environ.setdefault("NEW_RELIC_APP_NAME", "Python Agent Benchmarks")
+        os.environ.setdefault("NEW_RELIC_LICENSE_KEY", "0" * 40)
+        os.environ["NEW_RELIC_DEVELOPER_MODE"] = "true"
+
+        import newrelic.agent
+
+        newrelic.agent.initialize()
+
+        _application = newrelic.agent.register_application(timeout=10.0)
+
+    return _application
+
+
+def dbapi2_module():
+    """Returns a stand in for a DB-API 2.0 module, with the attributes the
+    agent's database instrumentation adds to the module it wraps.
+
+    """
+
+    module = types.ModuleType("dbapi2_module")
+
+    module._nr_database_product = "Postgres"
+    module._nr_quoting_style = "single+dollar"
+    module._nr_explain_query = "EXPLAIN"
+    module._nr_explain_stmts = ("select", "insert", "update", "delete")
+
+    return module
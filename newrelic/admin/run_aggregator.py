@@ -0,0 +1,62 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+from newrelic.admin import command, usage
+
+
+@command('run-aggregator', 'config_file',
+"""Runs the aggregator for the worker processes on this host, using the
+agent configuration in <config_file>. Worker processes with the setting
+"aggregator.enabled" hand the data they collect to the aggregator over
+the Unix socket given by "aggregator.socket_path", and the aggregator
+reports it to the data collector under a single agent session for each
+application. The workers and the aggregator must run as the same user, and
+the directory holding the socket must not be accessible to other users.
+The aggregator runs until it is interrupted.""")
+def run_aggregator(args):
+    import os
+    import sys
+
+    if len(args) == 0:
+        usage('run-aggregator')
+        sys.exit(1)
+
+    from newrelic.config import initialize
+    from newrelic.core.aggregator import AggregatorServer, default_socket_path
+    from newrelic.core.config import global_settings
+
+    config_file = args[0]
+    environment = os.environ.get('NEW_RELIC_ENVIRONMENT')
+
+    if config_file == '-':
+        config_file = os.environ.get('NEW_RELIC_CONFIG_FILE')
+
+    initialize(config_file, environment, ignore_errors=False)
+
+    settings = global_settings()
+
+    # This process is the aggregator, so connects to the data collector
+    # itself, even though the configuration is shared with the workers.
+
+    settings.aggregator.enabled = False
+
+    server = AggregatorServer(settings.aggregator.socket_path or
+            default_socket_path())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -16,7 +16,7 @@ import functools
 import sys
 
 from newrelic.api.application import application_instance
-from newrelic.api.html_insertion import insert_html_snippet, verify_body_exists
+from newrelic.api.html_insertion import HTMLInsertionScanner
 from newrelic.api.transaction import current_transaction
 from newrelic.api.web_transaction import WebTransaction
 from newrelic.common.async_proxy import CoroutineProxy, LoopContext
@@ -59,6 +59,7 @@ class ASGIBrowserMiddleware(object):
         self.more_body = True
         self.transaction = transaction
         self.search_maximum = search_maximum
+        self.scanner = HTMLInsertionScanner(search_maximum)
         self.pass_through = not (transaction and transaction.enabled)
 
     async def __call__(self, scope, receive, send):
@@ -153,8 +154,10 @@ class ASGIBrowserMiddleware(object):
             # Add this message to the current body
             self.body += body
 
-            # if there's a valid body string, attempt to insert the HTML
-            if verify_body_exists(self.body):
+            # Only the new data needs to be scanned as the scanner carries
+            # on from where it left off with the previous message. If the
+            # start of the body element has been found, insert the HTML.
+            if self.scanner.feed(body):
                 header = self.transaction.browser_timing_header()
                 if not header:
                     # If there's no header, abort browser monitoring injection
@@ -164,7 +167,7 @@ class ASGIBrowserMiddleware(object):
                 footer = self.transaction.browser_timing_footer()
                 browser_agent_data = six.b(header) + six.b(footer)
 
-                body = insert_html_snippet(self.body, lambda: browser_agent_data, self.search_maximum)
+                body = self.scanner.insert(self.body, browser_agent_data)
 
                 # If we have inserted the browser agent
                 if len(body) != len(self.body):
@@ -14,7 +14,7 @@
 
 import re
 
-_head_re = re.compile(b"<head[^>]*>", re.IGNORECASE)
+_meta_re = re.compile(b"<\\s*meta", re.IGNORECASE)
 
 _xua_meta_re = re.compile(
     b"""<\\s*meta[^>]+http-equiv\\s*=\\s*['"]""" b"""x-ua-compatible['"][^>]*>""",
@@ -33,6 +33,165 @@ _attachment_meta_re = re.compile(
 _body_re = re.compile(b"<body[^>]*>", re.IGNORECASE)
 
 
+class HTMLInsertionScanner(object):
+
+    """Scans HTML content in a single pass for the points at which the
+    browser monitoring snippet can be inserted. The content can be fed to
+    the scanner in chunks, with the scan resuming from where it left off,
+    including where a tag is split across chunks.
+
+    Each tag is taken to run from a '<' up to the first '>' following it.
+    The start of the body element must be found within the first
+    search_limit bytes of the content. Of the tags preceding the body
+    element, the first of each of the head element, and of the meta tags
+    giving X-UA-Compatible, charset and a content disposition of
+    attachment, are recorded.
+
+    """
+
+    def __init__(self, search_limit=64 * 1024):
+        self.search_limit = search_limit
+
+        self.body = None
+
+        self._head = None
+        self._xua_meta = None
+        self._charset_meta = None
+        self._attachment_meta = None
+
+        self._pending = b""
+        self._offset = 0
+        self._exhausted = False
+
+    def feed(self, data):
+        """Scans the next chunk of the content. Returns True if the start
+        of the body element has been found.
+
+        """
+
+        if self.body is not None or self._exhausted:
+            return self.body is not None
+
+        if self._pending:
+            data = self._pending + data
+
+        offset = self._offset
+        search_limit = self.search_limit
+
+        start = data.find(b"<")
+        end = -1
+
+        while start != -1:
+            if offset + start >= search_limit:
+                self._exhausted = True
+                break
+
+            # Where there are several '<' before the next '>', the tags
+            # starting at each of them all end at the same '>'.
+
+            if end < start:
+                end = data.find(b">", start)
+
+                if end == -1:
+                    # The tag is incomplete, so keep the data from the
+                    # start of the tag to scan along with the next chunk,
+                    # unless it already runs past the search limit, in
+                    # which case no body element can be found within it.
+
+                    if offset + len(data) >= search_limit:
+                        self._exhausted = True
+                        break
+
+                    self._pending = data[start:]
+                    self._offset = offset + start
+                    return False
+
+            self._scan_tag(data, start, end + 1, offset)
+
+            if self.body is not None or self._exhausted:
+                break
+
+            start = data.find(b"<", start + 1)
+
+        self._pending = b""
+        self._offset = offset + len(data)
+
+        return self.body is not None
+
+    def _scan_tag(self, data, start, end, offset):
+        name = data[start + 1 : start + 5].lower()
+
+        if name == b"body":
+            if offset + end <= self.search_limit:
+                self.body = offset + start
+            else:
+                self._exhausted = True
+
+        elif name == b"head":
+            if self._head is None:
+                self._head = offset + end
+
+        elif _meta_re.match(data, start, end):
+            if self._attachment_meta is None and _attachment_meta_re.match(data, start, end):
+                self._attachment_meta = offset + end
+            if self._xua_meta is None and _xua_meta_re.match(data, start, end):
+                self._xua_meta = offset + end
+            if self._charset_meta is None and _charset_meta_re.match(data, start, end):
+                self._charset_meta = offset + end
+
+    def _before_body(self, index):
+        # A tag can only be used if it ends before the body element
+        # starts, which is not the case if the start of the body element
+        # falls within it.
+
+        return index is not None and index <= self.body
+
+    def insertion_index(self):
+        """Returns the index in the content at which the snippet should
+        be inserted, or None if the content is being served up as an
+        attachment and nothing should be inserted. Must only be called
+        once the start of the body element has been found.
+
+        """
+
+        # A content disposition meta tag indicates that the response is
+        # actually being served up as an attachment and would be saved
+        # as a file and not interpreted by a browser.
+
+        if self._before_body(self._attachment_meta):
+            return None
+
+        # Insert after whichever of the X-UA or charset meta tags is the
+        # last to appear, else after the start of the head section, and
+        # failing that before the start of the body.
+
+        index = max(
+            self._before_body(self._xua_meta) and self._xua_meta or 0,
+            self._before_body(self._charset_meta) and self._charset_meta or 0,
+        )
+
+        if index:
+            return index
+
+        if self._before_body(self._head):
+            return self._head
+
+        return self.body
+
+    def insert(self, data, text):
+        """Returns the content with the snippet inserted. The content must
+        be all the data fed to the scanner so far, joined together.
+
+        """
+
+        index = self.insertion_index()
+
+        if index is None:
+            return data
+
+        return b"".join((data[:index], text, data[index:]))
+
+
 def insert_html_snippet(data, html_to_be_inserted, search_limit=64 * 1024):
     # First determine if we have a body tag. If we don't we
     # always give up even though strictly speaking we may not
@@ -41,9 +200,9 @@ def insert_html_snippet(data, html_to_be_inserted, search_limit=64 * 1024):
     # doing this initial search, we only do up to the specified
     # search limit.
 
-    body = _body_re.search(data[:search_limit])
+    scanner = HTMLInsertionScanner(search_limit)
 
-    if not body:
+    if not scanner.feed(data):
         return data if len(data) > search_limit else None
 
     # We are definitely doing to insert something now, so
@@ -55,49 +214,7 @@ def insert_html_snippet(data, html_to_be_inserted, search_limit=64 * 1024):
     if not text:
         return data
 
-    # We are now going to split out everything before the body
-    # to limit searches when applying the regex patterns. We
-    # could have just used up to the search limit, but the
-    # patterns which follow seem to be expensive enough that a
-    # short a string as possible helps.
-
-    start = body.start()
-    tail, data = data[start:], data[:start]
-
-    def insert_at_index(index):
-        return b"".join((data[:index], text, data[index:], tail))
-
-    # Search for instance of a content disposition meta tag
-    # indicating that the response is actually being served up
-    # as an attachment and would be saved as a file and not
-    # actually interpreted by a browser.
-
-    if _attachment_meta_re.search(data):
-        return data + tail
-
-    # Search for instances of X-UA or charset meta tags. We will
-    # use whichever is the last to appear in the data.
-
-    xua_meta = _xua_meta_re.search(data)
-    charset_meta = _charset_meta_re.search(data)
-
-    index = max(
-        xua_meta and xua_meta.end() or 0, charset_meta and charset_meta.end() or 0
-    )
-
-    if index:
-        return insert_at_index(index)
-
-    # Next try for the start of head section.
-
-    head = _head_re.search(data)
-
-    if head:
-        return insert_at_index(head.end())
-
-    # Finally if no joy, insert before the start of the body.
-
-    return insert_at_index(body.start())
+    return scanner.insert(data, text)
 
 
 def verify_body_exists(data):
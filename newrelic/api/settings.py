@@ -20,6 +20,10 @@ RECORDSQL_OFF = 'off'
 RECORDSQL_RAW = 'raw'
 RECORDSQL_OBFUSCATED = 'obfuscated'
 
+RECORD_QUEUE_OVERFLOW_DROP = 'drop'
+RECORD_QUEUE_OVERFLOW_SAMPLE = 'sample'
+RECORD_QUEUE_OVERFLOW_BLOCK = 'block'
+
 COMPRESSED_CONTENT_ENCODING_DEFLATE = 'deflate'
 COMPRESSED_CONTENT_ENCODING_GZIP = 'gzip'
 
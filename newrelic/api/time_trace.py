@@ -497,6 +497,9 @@ class TimeTrace(object):
             transaction._process_node(node)
             parent.process_child(node, self.is_async)
 
+            if transaction._fold_node(node):
+                parent.discard_child(node)
+
         # ----------------------------------------------------------------------
         # SYNC  | The parent will not have exited yet, so no node will be
         #       | created. This operation is a NOP.
@@ -562,6 +565,16 @@ class TimeTrace(object):
         else:
             self.exclusive -= node.duration
 
+    def discard_child(self, node):
+        # Called once the time metrics for a child node have been folded
+        # into the transaction. The exclusive time for this trace has
+        # already been adjusted for the child, so it only needs to be
+        # forgotten, including for the count of outstanding children.
+
+        if self.children and self.children[-1] is node:
+            self.children.pop()
+            self.child_count -= 1
+
     def increment_child_count(self):
         self.child_count += 1
 
@@ -64,7 +64,7 @@ from newrelic.core.attribute_filter import (
 from newrelic.core.config import DEFAULT_RESERVOIR_SIZE, LOG_EVENT_RESERVOIR_SIZE
 from newrelic.core.custom_event import create_custom_event
 from newrelic.core.stack_trace import exception_stack
-from newrelic.core.stats_engine import CustomMetrics, SampledDataSet
+from newrelic.core.stats_engine import CustomMetrics, FoldedTimeMetrics, SampledDataSet
 from newrelic.core.thread_utilization import utilization_tracker
 from newrelic.core.trace_cache import (
     TraceCacheActiveTraceError,
@@ -304,6 +304,7 @@ class Transaction(object):
         self.synthetics_header = None
 
         self._custom_metrics = CustomMetrics()
+        self._folded_metrics = FoldedTimeMetrics()
 
         global_settings = application.global_settings
 
@@ -573,6 +574,7 @@ class Transaction(object):
             apdex_t=self.apdex,
             suppress_apdex=self.suppress_apdex,
             custom_metrics=self._custom_metrics,
+            folded_metrics=self._folded_metrics,
             guid=self.guid,
             cpu_time=self._cpu_user_time_value,
             suppress_transaction_trace=self.suppress_transaction_trace,
@@ -1613,6 +1615,28 @@ class Transaction(object):
                 return
             self._slow_sql.append(node)
 
+    def _fold_node(self, node):
+        # Once the number of segments kept as nodes for the transaction
+        # reaches the limit, the time metrics for any further segments
+        # which have no children of their own are folded into aggregates
+        # held by the transaction and the node itself is discarded. The
+        # metrics stay exact while the memory used by a transaction with
+        # a very large number of segments is bounded. Returns True if
+        # the node was folded.
+
+        settings = self._settings
+        limit = settings and settings.agent_limits.transaction_segments_maximum
+
+        if not limit or getattr(node, "children", None):
+            return False
+
+        if self._trace_node_count - len(self._folded_metrics) <= limit:
+            return False
+
+        self._folded_metrics.record_node(node, settings, self.type)
+
+        return True
+
     def stop_recording(self):
         if not self.enabled:
             return
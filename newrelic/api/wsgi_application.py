@@ -22,7 +22,7 @@ from newrelic.api.transaction import current_transaction
 from newrelic.api.time_trace import notice_error
 from newrelic.api.web_transaction import WSGIWebTransaction
 from newrelic.api.function_trace import FunctionTrace, FunctionTraceWrapper
-from newrelic.api.html_insertion import insert_html_snippet, verify_body_exists
+from newrelic.api.html_insertion import HTMLInsertionScanner
 from newrelic.api.time_trace import notice_error
 from newrelic.api.transaction import current_transaction
 from newrelic.api.web_transaction import WSGIWebTransaction
@@ -193,6 +193,8 @@ class _WSGIApplicationMiddleware(object):
         self.response_length = 0
         self.response_data = []
 
+        self.scanner = HTMLInsertionScanner(self.search_maximum)
+
         settings = transaction.settings
 
         self.debug = settings and settings.debug.log_autorum_middleware
@@ -202,11 +204,6 @@ class _WSGIApplicationMiddleware(object):
         self.iterable = self.application(self.request_environ, self.start_response)
 
     def process_data(self, data):
-        # If this is the first data block, then immediately try
-        # for an insertion using full set of criteria. If this
-        # works then we are done, else we move to next phase of
-        # buffering up content until we find the body element.
-
         def html_to_be_inserted():
             header = self.transaction.browser_timing_header()
 
@@ -217,33 +214,19 @@ class _WSGIApplicationMiddleware(object):
 
             return six.b(header) + six.b(footer)
 
-        if not self.response_data:
-            modified = insert_html_snippet(data, html_to_be_inserted)
-
-            if modified is not None:
-                if self.debug:
-                    _logger.debug(
-                        "RUM insertion from WSGI middleware "
-                        "triggered on first yielded string from "
-                        "response. Bytes added was %r.",
-                        len(modified) - len(data),
-                    )
-
-                if self.content_length is not None:
-                    length = len(modified) - len(data)
-                    self.content_length += length
-
-                return [modified]
-
-        # Buffer up the data. If we haven't found the start of
-        # the body element, that is all we do. If we have reached
+        # Feed the data block to the scanner, which carries on from
+        # where it left off with any prior data blocks, so that only
+        # the new data is scanned. If we haven't found the start of
+        # the body element, we buffer up the data. If we have reached
         # the limit of buffering allowed, then give up and return
         # the buffered data.
 
-        if not self.response_data or not verify_body_exists(data):
-            self.response_length += len(data)
-            self.response_data.append(data)
+        first = not self.response_data
 
+        self.response_length += len(data)
+        self.response_data.append(data)
+
+        if not self.scanner.feed(data):
             if self.response_length >= self.search_maximum:
                 buffered_data = self.response_data
                 self.response_data = []
@@ -258,36 +241,35 @@ class _WSGIApplicationMiddleware(object):
         # by very large data block. Expect that the risk of this
         # occurring is very small.
 
-        if self.response_data:
-            self.response_data.append(data)
-            data = b"".join(self.response_data)
-            self.response_data = []
+        data = b"".join(self.response_data)
+        self.response_data = []
 
-        # Perform the insertion of the HTML. This should always
-        # succeed as we would only have got here if we had found
-        # the body element, which is the fallback point for
-        # insertion.
+        # Perform the insertion of the HTML at the point found by
+        # the scanner. We are definitely doing to insert something
+        # now, so generate the text to be inserted. Bail out if it
+        # is empty.
 
-        modified = insert_html_snippet(data, html_to_be_inserted)
+        text = html_to_be_inserted()
 
-        if modified is not None:
-            if self.debug:
-                _logger.debug(
-                    "RUM insertion from WSGI middleware "
-                    "triggered on subsequent string yielded from "
-                    "response. Bytes added was %r.",
-                    len(modified) - len(data),
-                )
+        if not text:
+            return [data]
 
-            if self.content_length is not None:
-                length = len(modified) - len(data)
-                self.content_length += length
+        modified = self.scanner.insert(data, text)
 
-            return [modified]
+        if self.debug:
+            _logger.debug(
+                "RUM insertion from WSGI middleware "
+                "triggered on %s string yielded from "
+                "response. Bytes added was %r.",
+                first and "first" or "subsequent",
+                len(modified) - len(data),
+            )
 
-        # Something went very wrong as we should never get here.
+        if self.content_length is not None:
+            length = len(modified) - len(data)
+            self.content_length += length
 
-        return [data]
+        return [modified]
 
     def flush_headers(self):
         # Add back in any response content length header. It will
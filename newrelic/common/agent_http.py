@@ -16,6 +16,7 @@ from __future__ import print_function
 
 import os
 import sys
+import threading
 import time
 import zlib
 from pprint import pprint
@@ -74,6 +75,7 @@ def _urllib3_ssl_recursion_workaround(wrapped, instance, args, kwargs):
 
 class BaseClient(object):
     AUDIT_LOG_ID = 0
+    STREAMING_PAYLOADS = False
 
     def __init__(
         self,
@@ -92,6 +94,7 @@ class BaseClient(object):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
     ):
         self._audit_log_fp = audit_log_fp
 
@@ -108,14 +111,23 @@ class BaseClient(object):
         pass
 
     @staticmethod
-    def _supportability_request(params, payload, body, compression_time):
+    def _supportability_request(params, payload, body, compression_time, payload_size=None):
         pass
 
     @classmethod
     def log_request(
-        cls, fp, method, url, params, payload, headers, body=None, compression_time=None
+        cls,
+        fp,
+        method,
+        url,
+        params,
+        payload,
+        headers,
+        body=None,
+        compression_time=None,
+        payload_size=None,
     ):
-        cls._supportability_request(params, payload, body, compression_time)
+        cls._supportability_request(params, payload, body, compression_time, payload_size)
 
         if not fp:
             return
@@ -222,6 +234,7 @@ class HttpClient(BaseClient):
     BASE_HEADERS = urllib3.make_headers(
         keep_alive=True, accept_encoding=True, user_agent=USER_AGENT
     )
+    STREAMING_PAYLOADS = True
 
     def __init__(
         self,
@@ -240,6 +253,7 @@ class HttpClient(BaseClient):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
     ):
         self._host = host
         port = self._port = port
@@ -252,8 +266,12 @@ class HttpClient(BaseClient):
         self._prefix = ""
 
         self._headers = dict(self.BASE_HEADERS)
+        # The connection pool keeps open as many connections as there
+        # may be requests in flight at once from separate threads.
+
         self._connection_kwargs = connection_kwargs = {
             "timeout": timeout,
+            "maxsize": max(max_connections, 1),
         }
         self._urlopen_kwargs = urlopen_kwargs = {}
 
@@ -301,6 +319,7 @@ class HttpClient(BaseClient):
         self._proxy = proxy
 
         self._connection_attr = None
+        self._connection_lock = threading.Lock()
 
     @staticmethod
     def _parse_proxy(scheme, host, port, username, password):
@@ -343,17 +362,21 @@ class HttpClient(BaseClient):
         if self._connection_attr:
             return self._connection_attr
 
-        retries = urllib3.Retry(
-            total=False, connect=None, read=None, redirect=0, status=None
-        )
-        self._connection_attr = self.CONNECTION_CLS(
-            self._host,
-            self._port,
-            strict=True,
-            retries=retries,
-            **self._connection_kwargs
-        )
-        return self._connection_attr
+        with self._connection_lock:
+            if self._connection_attr:
+                return self._connection_attr
+
+            retries = urllib3.Retry(
+                total=False, connect=None, read=None, redirect=0, status=None
+            )
+            self._connection_attr = self.CONNECTION_CLS(
+                self._host,
+                self._port,
+                strict=True,
+                retries=retries,
+                **self._connection_kwargs
+            )
+            return self._connection_attr
 
     def close_connection(self):
         if self._connection_attr:
@@ -370,12 +393,13 @@ class HttpClient(BaseClient):
         headers,
         body=None,
         compression_time=None,
+        payload_size=None,
     ):
         if not self._prefix:
             url = self.CONNECTION_CLS.scheme + "://" + self._host + url
 
         return super(HttpClient, self).log_request(
-            fp, method, url, params, payload, headers, body, compression_time
+            fp, method, url, params, payload, headers, body, compression_time, payload_size
         )
 
     @staticmethod
@@ -392,6 +416,60 @@ class HttpClient(BaseClient):
 
         return data, compression_time
 
+    @staticmethod
+    def _compress_chunks(chunks, threshold, method="gzip", level=None):
+        """Compresses a payload supplied as an iterable of byte strings
+        without first joining it into a single byte string. Chunks are
+        only buffered until the size of the payload is known to exceed
+        the threshold, after which they are fed to the compressor as
+        they are produced. Returns a tuple of the uncompressed payload,
+        the body to send, the size of the uncompressed payload and the
+        time spent compressing. The uncompressed payload is only
+        returned, and the compression time is None, when the payload
+        was not large enough to be compressed.
+
+        """
+
+        chunks = iter(chunks)
+        buffered = []
+        payload_size = 0
+
+        for chunk in chunks:
+            buffered.append(chunk)
+            payload_size += len(chunk)
+            if payload_size > threshold:
+                break
+        else:
+            payload = b"".join(buffered)
+            return payload, payload, payload_size, None
+
+        compression_time = 0.0
+        level = level or zlib.Z_DEFAULT_COMPRESSION
+        wbits = 31 if method == "gzip" else 15
+
+        compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        body = []
+
+        def _compress(chunk):
+            compression_start = time.time()
+            body.append(compressor.compress(chunk))
+            return max(time.time(), compression_start) - compression_start
+
+        for chunk in buffered:
+            compression_time += _compress(chunk)
+
+        del buffered
+
+        for chunk in chunks:
+            payload_size += len(chunk)
+            compression_time += _compress(chunk)
+
+        compression_start = time.time()
+        body.append(compressor.flush())
+        compression_time += max(time.time(), compression_start) - compression_start
+
+        return None, b"".join(body), payload_size, compression_time
+
     def send_request(
         self,
         method="POST",
@@ -411,14 +489,34 @@ class HttpClient(BaseClient):
             merged_headers.update(headers)
         path = self._prefix + path
         body = payload
+        payload_size = None
         compression_time = None
         if payload is not None:
-            if len(payload) > self._compression_threshold:
-                body, compression_time = self._compress(
+            # The payload may also be supplied as an iterable of byte
+            # strings, in which case it is compressed as it is produced.
+            # The audit log records the uncompressed payload though, so
+            # when it is enabled the payload needs to be kept whole.
+
+            if not isinstance(payload, bytes) and self._audit_log_fp:
+                payload = b"".join(payload)
+
+            if isinstance(payload, bytes):
+                payload_size = len(payload)
+                if payload_size > self._compression_threshold:
+                    body, compression_time = self._compress(
+                        payload,
+                        method=self._compression_method,
+                        level=self._compression_level,
+                    )
+            else:
+                payload, body, payload_size, compression_time = self._compress_chunks(
                     payload,
+                    self._compression_threshold,
                     method=self._compression_method,
                     level=self._compression_level,
                 )
+
+            if compression_time is not None:
                 content_encoding = self._compression_method
             else:
                 content_encoding = "Identity"
@@ -434,6 +532,7 @@ class HttpClient(BaseClient):
             merged_headers,
             body,
             compression_time,
+            payload_size,
         )
 
         if body and len(body) > self._max_payload_size_in_bytes:
@@ -489,6 +588,7 @@ class InsecureHttpClient(HttpClient):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
     ):
         proxy = self._parse_proxy(proxy_scheme, proxy_host, None, None, None)
         if proxy and proxy.scheme == "https":
@@ -515,21 +615,26 @@ class InsecureHttpClient(HttpClient):
             compression_method,
             max_payload_size_in_bytes,
             audit_log_fp,
+            max_connections,
         )
 
 
 class SupportabilityMixin(object):
     @staticmethod
-    def _supportability_request(params, payload, body, compression_time):
+    def _supportability_request(params, payload, body, compression_time, payload_size=None):
         # *********
         # Used only for supportability metrics. Do not use to drive business
         # logic!
         # payload: uncompressed
         # body: compressed
+        # payload_size: length of the uncompressed payload
         agent_method = params and params.get("method")
         # *********
 
-        if agent_method and payload:
+        if payload_size is None:
+            payload_size = payload and len(payload)
+
+        if agent_method and payload_size:
             # Compression was applied
             if compression_time is not None:
                 internal_metric(
@@ -545,11 +650,11 @@ class SupportabilityMixin(object):
                 )
             internal_metric(
                 "Supportability/Python/Collector/%s/Output/Bytes" % agent_method,
-                len(payload),
+                payload_size,
             )
             # Top level metric to aggregate overall bytes being sent
             internal_metric(
-                "Supportability/Python/Collector/Output/Bytes", len(payload)
+                "Supportability/Python/Collector/Output/Bytes", payload_size
             )
 
     @staticmethod
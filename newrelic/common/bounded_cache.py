@@ -0,0 +1,85 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a cache holding a bounded number of entries, for
+use where results are memoised against keys which may be derived from
+user data and so could otherwise grow without limit.
+
+"""
+
+
+class BoundedCache(object):
+
+    """Dictionary like cache which holds at most max_size entries.
+
+    Entries are kept in two generations, each holding at most half of
+    max_size entries. New entries go into the current generation. When it
+    fills up it becomes the previous generation, replacing and so evicting
+    what was there, and a new empty current generation is started. An
+    entry found in the previous generation is copied back into the current
+    generation on lookup. Entries which keep being used therefore survive,
+    giving behaviour close to that of an LRU cache, without needing to
+    reorder entries or take a lock on every lookup.
+
+    A max_size of 0 disables caching.
+
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max(max_size, 0)
+        self._generation_size = self.max_size // 2 or self.max_size
+        self._current = {}
+        self._previous = {}
+
+    def __len__(self):
+        # Entries promoted from the previous generation may be counted
+        # twice, so this is an upper bound on the number of unique keys.
+
+        return len(self._current) + len(self._previous)
+
+    def __contains__(self, key):
+        return key in self._current or key in self._previous
+
+    def __getitem__(self, key):
+        try:
+            return self._current[key]
+        except KeyError:
+            pass
+
+        value = self._previous[key]
+        self[key] = value
+
+        return value
+
+    def __setitem__(self, key, value):
+        if not self._generation_size:
+            return
+
+        current = self._current
+
+        if len(current) >= self._generation_size and key not in current:
+            self._previous = current
+            self._current = current = {}
+
+        current[key] = value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        self._current = {}
+        self._previous = {}
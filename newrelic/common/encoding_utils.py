@@ -48,7 +48,7 @@ BASE64_DECODE_STR = getattr(base64, 'decodestring', None)
 # be supplied as key word arguments to allow the wrappers to supply
 # defaults.
 
-def json_encode(obj, **kwargs):
+def _json_encode_kwargs(kwargs):
     _kwargs = {}
 
     # This wrapper function needs to deal with a few issues.
@@ -102,7 +102,58 @@ def json_encode(obj, **kwargs):
 
     _kwargs.update(kwargs)
 
-    return json.dumps(obj, **_kwargs)
+    return _kwargs
+
+
+def json_encode(obj, **kwargs):
+    return json.dumps(obj, **_json_encode_kwargs(kwargs))
+
+
+def json_encode_chunks(obj, chunk_size=64 * 1024, depth=2, **kwargs):
+    """Generator yielding the JSON encoding of obj as a sequence of UTF-8
+    encoded byte strings, each of roughly chunk_size bytes. Joining the
+    chunks gives the same result as json_encode(obj).encode("utf-8").
+
+    Lists, tuples and generators in the first depth levels of obj are
+    walked and their items encoded one at a time, so the encoded form of
+    a large payload never needs to be held in memory all at once. Any
+    other value is encoded in a single call to the C JSON encoder, which
+    is considerably faster than JSONEncoder.iterencode().
+
+    """
+
+    _kwargs = _json_encode_kwargs(kwargs)
+    encoder = _kwargs.pop("cls", json.JSONEncoder)(**_kwargs)
+    item_separator = encoder.item_separator
+
+    def _iterencode(o, level):
+        if level < depth and isinstance(o, (list, tuple, types.GeneratorType)):
+            yield "["
+            first = True
+            for item in o:
+                if first:
+                    first = False
+                else:
+                    yield item_separator
+                for piece in _iterencode(item, level + 1):
+                    yield piece
+            yield "]"
+        else:
+            yield encoder.encode(o)
+
+    pieces = []
+    size = 0
+
+    for piece in _iterencode(obj, 0):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(pieces).encode("utf-8")
+            pieces = []
+            size = 0
+
+    if pieces:
+        yield "".join(pieces).encode("utf-8")
 
 
 def json_decode(s, **kwargs):
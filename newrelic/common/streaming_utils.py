@@ -15,20 +15,42 @@
 import collections
 import logging
 import threading
+import time
 
 try:
-    from newrelic.core.infinite_tracing_pb2 import AttributeValue
+    from newrelic.core.infinite_tracing_pb2 import AttributeValue, SpanBatch
 except:
-    AttributeValue = None
+    AttributeValue, SpanBatch = None, None
 
 _logger = logging.getLogger(__name__)
 
 
 class StreamBuffer(object):
-    def __init__(self, maxlen):
+    """Buffer of spans waiting to be sent on the infinite tracing stream.
+
+    Producers append to the deque without taking the lock, and only take
+    it to wake the consumer when it is waiting for data. The consumer
+    likewise pops from the deque without the lock for as long as there is
+    data, so a burst of spans is drained with a single wakeup. Appending
+    to and popping from a deque are atomic, so the lock is only needed
+    to coordinate waiting.
+
+    When batching is enabled, iterating over the buffer yields SpanBatch
+    messages holding up to batch_size spans rather than single spans. If
+    fewer spans than that are available, the iterator waits up to
+    batch_linger seconds for more to arrive before sending a partial
+    batch.
+
+    """
+
+    def __init__(self, maxlen, batching=False, batch_size=100, batch_linger=0.0):
         self._queue = collections.deque(maxlen=maxlen)
+        self._batching = batching
+        self._batch_size = max(batch_size, 1)
+        self._batch_linger = max(batch_linger, 0.0)
         self._notify = self.condition()
         self._shutdown = False
+        self._waiting = 0
         self._seen = 0
         self._dropped = 0
 
@@ -42,22 +64,31 @@ class StreamBuffer(object):
             self._notify.notify_all()
 
     def put(self, item):
-        with self._notify:
-            if self._shutdown:
-                return
+        if self._shutdown:
+            return
 
-            self._seen += 1
+        # NOTE: As the counts are updated without holding the lock, they
+        # can be slightly under-counted when spans are being put from
+        # many threads at once.
+        #
+        # Dropped can also be over-counted as the queue approaches
+        # capacity while data is still being transmitted. This is because
+        # the length of the queue can be changing as it's being measured.
 
-            # NOTE: dropped can be over-counted as the queue approaches
-            # capacity while data is still being transmitted.
-            #
-            # This is because the length of the queue can be changing as it's
-            # being measured.
-            if len(self._queue) >= self._queue.maxlen:
-                self._dropped += 1
+        self._seen += 1
 
-            self._queue.append(item)
-            self._notify.notify_all()
+        if len(self._queue) >= self._queue.maxlen:
+            self._dropped += 1
+
+        self._queue.append(item)
+
+        # The consumer registers itself as waiting before checking the
+        # queue one last time, so either it will see the item appended
+        # above or this will see that it needs to be woken.
+
+        if self._waiting:
+            with self._notify:
+                self._notify.notify_all()
 
     def stats(self):
         with self._notify:
@@ -67,6 +98,8 @@ class StreamBuffer(object):
         return seen, dropped
 
     def __iter__(self):
+        if self._batching:
+            return StreamBufferBatchIterator(self)
         return StreamBufferIterator(self)
 
 
@@ -86,6 +119,17 @@ class StreamBufferIterator(object):
         return self._shutdown or self.stream_buffer._shutdown or (self._stream and self._stream.done())
 
     def __next__(self):
+        stream_buffer = self.stream_buffer
+        queue = stream_buffer._queue
+
+        # Take the next item without the lock when there is one.
+
+        if not self.stream_closed():
+            try:
+                return queue.popleft()
+            except IndexError:
+                pass
+
         with self._notify:
             while True:
                 # When a gRPC stream receives a server side disconnect (usually in the form of an OK code)
@@ -101,12 +145,16 @@ class StreamBufferIterator(object):
                     raise StopIteration
 
                 try:
-                    return self.stream_buffer._queue.popleft()
+                    return queue.popleft()
                 except IndexError:
                     pass
 
-                if not self.stream_closed() and not self.stream_buffer._queue:
-                    self._notify.wait()
+                stream_buffer._waiting += 1
+                try:
+                    if not self.stream_closed() and not queue:
+                        self._notify.wait()
+                finally:
+                    stream_buffer._waiting -= 1
 
     next = __next__
 
@@ -114,6 +162,53 @@ class StreamBufferIterator(object):
         return self
 
 
+class StreamBufferBatchIterator(StreamBufferIterator):
+    def __next__(self):
+        # Block until at least one span is available, exactly as when
+        # sending single spans, then gather up what else is queued.
+
+        spans = [StreamBufferIterator.__next__(self)]
+        self._fill(spans)
+        return SpanBatch(spans=spans)
+
+    next = __next__
+
+    def _fill(self, spans):
+        stream_buffer = self.stream_buffer
+        queue = stream_buffer._queue
+        batch_size = stream_buffer._batch_size
+
+        while len(spans) < batch_size:
+            try:
+                spans.append(queue.popleft())
+            except IndexError:
+                break
+
+        if len(spans) >= batch_size or not stream_buffer._batch_linger:
+            return
+
+        deadline = time.time() + stream_buffer._batch_linger
+
+        with self._notify:
+            while len(spans) < batch_size and not self.stream_closed():
+                try:
+                    spans.append(queue.popleft())
+                    continue
+                except IndexError:
+                    pass
+
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    break
+
+                stream_buffer._waiting += 1
+                try:
+                    if not queue:
+                        self._notify.wait(remaining)
+                finally:
+                    stream_buffer._waiting -= 1
+
+
 class SpanProtoAttrs(dict):
     def __init__(self, *args, **kwargs):
         super(SpanProtoAttrs, self).__init__()
@@ -144,6 +144,12 @@ _RECORD_SQL = {
     "obfuscated": newrelic.api.settings.RECORDSQL_OBFUSCATED,
 }
 
+_RECORD_QUEUE_OVERFLOW_POLICY = {
+    "drop": newrelic.api.settings.RECORD_QUEUE_OVERFLOW_DROP,
+    "sample": newrelic.api.settings.RECORD_QUEUE_OVERFLOW_SAMPLE,
+    "block": newrelic.api.settings.RECORD_QUEUE_OVERFLOW_BLOCK,
+}
+
 _COMPRESSED_CONTENT_ENCODING = {
     "deflate": newrelic.api.settings.COMPRESSED_CONTENT_ENCODING_DEFLATE,
     "gzip": newrelic.api.settings.COMPRESSED_CONTENT_ENCODING_GZIP,
@@ -172,6 +178,10 @@ def _map_record_sql(s):
     return _RECORD_SQL[s]
 
 
+def _map_record_queue_overflow_policy(s):
+    return _RECORD_QUEUE_OVERFLOW_POLICY[s]
+
+
 def _map_compressed_content_encoding(s):
     return _COMPRESSED_CONTENT_ENCODING[s]
 
@@ -341,6 +351,7 @@ def _process_configuration(section):
     _process_setting(section, "attributes.enabled", "getboolean", None)
     _process_setting(section, "attributes.exclude", "get", _map_inc_excl_attributes)
     _process_setting(section, "attributes.include", "get", _map_inc_excl_attributes)
+    _process_setting(section, "attributes.filter_cache_size", "getint", None)
     _process_setting(section, "transaction_name.naming_scheme", "get", None)
     _process_setting(section, "gc_runtime_metrics.enabled", "getboolean", None)
     _process_setting(section, "gc_runtime_metrics.top_object_count_limit", "getint", None)
@@ -454,10 +465,17 @@ def _process_configuration(section):
     )
     _process_setting(section, "local_daemon.socket_path", "get", None)
     _process_setting(section, "local_daemon.synchronous_startup", "getboolean", None)
+    _process_setting(section, "agent_limits.data_collector_connections", "getint", None)
     _process_setting(section, "agent_limits.transaction_traces_nodes", "getint", None)
+    _process_setting(section, "agent_limits.transaction_segments_maximum", "getint", None)
     _process_setting(section, "agent_limits.sql_query_length_maximum", "getint", None)
+    _process_setting(section, "agent_limits.sql_statement_cache_size", "getint", None)
     _process_setting(section, "agent_limits.slow_sql_stack_trace", "getint", None)
     _process_setting(section, "agent_limits.max_sql_connections", "getint", None)
+    _process_setting(section, "agent_limits.explain_plan_workers", "getint", None)
+    _process_setting(section, "agent_limits.explain_plan_timeout", "getfloat", None)
+    _process_setting(section, "agent_limits.explain_plan_cache_ttl", "getfloat", None)
+    _process_setting(section, "agent_limits.explain_plan_idle_timeout", "getfloat", None)
     _process_setting(section, "agent_limits.sql_explain_plans", "getint", None)
     _process_setting(section, "agent_limits.sql_explain_plans_per_harvest", "getint", None)
     _process_setting(section, "agent_limits.slow_sql_data", "getint", None)
@@ -470,6 +488,7 @@ def _process_configuration(section):
     _process_setting(section, "agent_limits.synthetics_transactions", "getint", None)
     _process_setting(section, "agent_limits.data_compression_threshold", "getint", None)
     _process_setting(section, "agent_limits.data_compression_level", "getint", None)
+    _process_setting(section, "agent_limits.normalization_cache_size", "getint", None)
     _process_setting(section, "console.listener_socket", "get", _map_console_listener_socket)
     _process_setting(section, "console.allow_interpreter_cmd", "getboolean", None)
     _process_setting(section, "debug.disable_api_supportability_metrics", "getboolean", None)
@@ -531,7 +550,25 @@ def _process_configuration(section):
     _process_setting(section, "infinite_tracing.trace_observer_host", "get", None)
     _process_setting(section, "infinite_tracing.trace_observer_port", "getint", None)
     _process_setting(section, "infinite_tracing.span_queue_size", "getint", None)
+    _process_setting(section, "infinite_tracing.batching", "getboolean", None)
+    _process_setting(section, "infinite_tracing.batch_size", "getint", None)
+    _process_setting(section, "infinite_tracing.batch_linger", "getfloat", None)
     _process_setting(section, "code_level_metrics.enabled", "getboolean", None)
+    _process_setting(section, "record_queue.enabled", "getboolean", None)
+    _process_setting(section, "record_queue.max_size", "getint", None)
+    _process_setting(section, "record_queue.overflow_policy", "get", _map_record_queue_overflow_policy)
+    _process_setting(section, "stats_engine.shards", "getint", None)
+    _process_setting(section, "stats_engine.columnar_metrics", "getboolean", None)
+    _process_setting(section, "trace_cache.context_variables", "getboolean", None)
+    _process_setting(section, "spool.enabled", "getboolean", None)
+    _process_setting(section, "spool.directory", "get", None)
+    _process_setting(section, "spool.max_size_in_bytes", "getint", None)
+    _process_setting(section, "spool.segment_size_in_bytes", "getint", None)
+    _process_setting(section, "spool.max_age_in_seconds", "getfloat", None)
+    _process_setting(section, "connect_cache.enabled", "getboolean", None)
+    _process_setting(section, "connect_cache.directory", "get", None)
+    _process_setting(section, "aggregator.enabled", "getboolean", None)
+    _process_setting(section, "aggregator.socket_path", "get", None)
 
     _process_setting(section, "application_logging.enabled", "getboolean", None)
     _process_setting(section, "application_logging.forwarding.max_samples_stored", "getint", None)
@@ -3091,6 +3128,16 @@ def _setup_agent_console():
         newrelic.core.agent.Agent.run_on_startup(_startup_agent_console)
 
 
+def _setup_trace_cache():
+    if _settings.trace_cache.context_variables:
+        if not trace_cache.trace_cache().enable_context_variables():
+            _logger.warning(
+                "Tracking of the current trace using context variables has "
+                "been requested but is not available. Context variables "
+                "require Python 3.7 or later."
+            )
+
+
 def initialize(
     config_file=None,
     environment=None,
@@ -3111,6 +3158,7 @@ def initialize(
 
     if _settings.monitor_mode or _settings.developer_mode:
         _settings.enabled = True
+        _setup_trace_cache()
         _setup_instrumentation()
         _setup_data_source()
         _setup_extensions()
@@ -12,12 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
 import random
-import time
 import threading
+import time
 
 
 class AdaptiveSampler(object):
+
+    """Decides which transactions are sampled, aiming for sampling_target
+    sampled transactions in each sampling period.
+
+    Deciding that a transaction is not sampled, which is the outcome for
+    nearly all transactions once there is any load, does not take a lock.
+    Transactions are counted using an itertools.count(), calling next() on
+    which is atomic, and the rest of the state is only read. The lock is
+    only taken when a transaction is chosen to be sampled, so the count of
+    sampled transactions and the adaptive target can be updated, and when
+    the sampling period rolls over.
+
+    """
+
     def __init__(self, sampling_target, sampling_period):
         self.adaptive_target = 0.0
         self.period = sampling_period
@@ -33,6 +48,15 @@ class AdaptiveSampler(object):
         self.computed_count = 0
         self.sampled_count = 0
 
+    @property
+    def computed_count(self):
+        return self._computed_count
+
+    @computed_count.setter
+    def computed_count(self, value):
+        self._counter = itertools.count(value)
+        self._computed_count = value
+
     def reset_if_required(self):
         time_since_last_reset = time.time() - self.last_reset
         cycles = time_since_last_reset // self.period
@@ -44,28 +68,50 @@ class AdaptiveSampler(object):
                 self._reset()
 
     def compute_sampled(self):
+        if time.time() - self.last_reset >= self.period:
+            with self._lock:
+                self.reset_if_required()
+
+        sampled_count = self.sampled_count
+
+        if sampled_count >= self.max_sampled:
+            return False
+
+        computed_count = next(self._counter)
+        self._computed_count = computed_count + 1
+
+        if sampled_count < self.sampling_target:
+            sampled = random.randrange(self.computed_count_last) < self.sampling_target
+
+        else:
+            # As the count of transactions and the count of those sampled
+            # are read separately without the lock, the sampling period
+            # may have rolled over in between. When read together the
+            # former could never be less than the latter.
+
+            computed_count = max(computed_count, sampled_count)
+            sampled = random.randrange(computed_count) < self.adaptive_target
+
+        if sampled:
+            sampled = self._record_sampled()
+
+        return sampled
+
+    def _record_sampled(self):
         with self._lock:
-            self.reset_if_required()
+            # Another thread may have taken the last of the samples
+            # available for this period since the decision was made.
+
             if self.sampled_count >= self.max_sampled:
                 return False
 
-            elif self.sampled_count < self.sampling_target:
-                sampled = random.randrange(
-                        self.computed_count_last) < self.sampling_target
-                if sampled:
-                    self.sampled_count += 1
-            else:
-                sampled = random.randrange(
-                        self.computed_count) < self.adaptive_target
-                if sampled:
-                    self.sampled_count += 1
-
-                    ratio = float(self.sampling_target) / self.sampled_count
-                    self.adaptive_target = (self.sampling_target ** ratio -
-                                            self.sampling_target ** 0.5)
-
-            self.computed_count += 1
-        return sampled
+            self.sampled_count += 1
+
+            if self.sampled_count > self.sampling_target:
+                ratio = float(self.sampling_target) / self.sampled_count
+                self.adaptive_target = self.sampling_target**ratio - self.sampling_target**0.5
+
+        return True
 
     def _reset(self):
         # For subsequent harvests, collect a max of twice the
@@ -75,7 +121,15 @@ class AdaptiveSampler(object):
         self.adaptive_target = (self.sampling_target -
                                 self.sampling_target ** 0.5)
 
-        self.computed_count_last = max(self.computed_count,
+        # The count of sampled transactions is cleared before the count
+        # of transactions, so that once a transaction is counted in the
+        # new period, it also sees the sampled count for the new period.
+
+        self.sampled_count = 0
+
+        # Calling next() on the counter being replaced yields the number
+        # of transactions it counted.
+
+        self.computed_count_last = max(next(self._counter),
                                        self.sampling_target)
         self.computed_count = 0
-        self.sampled_count = 0
@@ -14,6 +14,7 @@
 
 import logging
 import os
+import time
 
 from newrelic import version
 from newrelic.common import system_info
@@ -21,6 +22,7 @@ from newrelic.common.agent_http import ApplicationModeClient, ServerlessModeClie
 from newrelic.common.encoding_utils import (
     json_decode,
     json_encode,
+    json_encode_chunks,
     serverless_payload_encode,
 )
 from newrelic.common.utilization import (
@@ -37,17 +39,24 @@ from newrelic.core.config import (
     finalize_application_settings,
     global_settings_dump,
 )
+from newrelic.core.connect_cache import connect_cache
 from newrelic.core.internal_metrics import internal_count_metric
 from newrelic.network.exceptions import (
     DiscardDataForRequest,
     ForceAgentDisconnect,
     ForceAgentRestart,
     NetworkInterfaceException,
+    PayloadTooLargeForRequest,
     RetryDataForRequest,
 )
 
 _logger = logging.getLogger(__name__)
 
+# Seconds for which not finding a cloud vendor is cached, as detection
+# also fails where the metadata endpoint of the vendor is slow to respond.
+
+_UTILIZATION_VENDORS_MISS_TTL = 300.0
+
 
 class AgentProtocol(object):
     VERSION = 17
@@ -63,7 +72,7 @@ class AgentProtocol(object):
         409: ForceAgentRestart,
         410: ForceAgentDisconnect,
         411: DiscardDataForRequest,
-        413: DiscardDataForRequest,
+        413: PayloadTooLargeForRequest,
         414: DiscardDataForRequest,
         415: DiscardDataForRequest,
         417: DiscardDataForRequest,
@@ -175,6 +184,7 @@ class AgentProtocol(object):
             compression_method=settings.compressed_content_encoding,
             max_payload_size_in_bytes=settings.max_payload_size_in_bytes,
             audit_log_fp=audit_log_fp,
+            max_connections=settings.agent_limits.data_collector_connections,
         )
 
         self._params = {
@@ -258,10 +268,21 @@ class AgentProtocol(object):
         params["method"] = method
         if self._run_token:
             params["run_id"] = self._run_token
-        return params, self._headers, json_encode(payload).encode("utf-8")
+
+        # Clients which can accept the payload as a sequence of chunks are
+        # given it in that form, so that large payloads can be compressed
+        # as they are encoded rather than being held in memory in full.
+
+        if self.client.STREAMING_PAYLOADS:
+            payload = json_encode_chunks(payload)
+        else:
+            payload = json_encode(payload).encode("utf-8")
+
+        return params, self._headers, payload
 
     @staticmethod
     def _connect_payload(app_name, linked_applications, environment, settings):
+        cache = connect_cache(settings)
         settings = global_settings_dump(settings)
         app_names = [app_name] + linked_applications
 
@@ -317,12 +338,38 @@ class AgentProtocol(object):
         if settings["utilization.detect_azure"]:
             vendors.append(AzureUtilization)
 
-        utilization_vendor_settings = {}
-        for vendor in vendors:
-            metadata = vendor.detect()
-            if metadata:
-                utilization_vendor_settings[vendor.VENDOR_NAME] = metadata
-                break
+        # Detecting the cloud vendor requires requests to be made to the
+        # metadata endpoint of each vendor in turn, which time out where
+        # not running on that vendor. Where enabled, the vendor detected is
+        # cached for as long as the host is not rebooted. Not detecting a
+        # vendor is only cached for a short time, as it can also be due to
+        # the metadata endpoint being slow to respond.
+
+        cache_key = boot_id and [boot_id, [vendor.VENDOR_NAME for vendor in vendors]]
+
+        utilization_vendor_settings = None
+
+        if cache is not None and cache_key:
+            entry = cache.get("utilization_vendors", cache_key)
+
+            if isinstance(entry, dict) and (entry.get("expires") is None or entry["expires"] > time.time()):
+                utilization_vendor_settings = entry.get("vendors")
+
+        if utilization_vendor_settings is None:
+            utilization_vendor_settings = {}
+            for vendor in vendors:
+                metadata = vendor.detect()
+                if metadata:
+                    utilization_vendor_settings[vendor.VENDOR_NAME] = metadata
+                    break
+
+            if cache is not None and cache_key:
+                expires = None if utilization_vendor_settings else time.time() + _UTILIZATION_VENDORS_MISS_TTL
+                cache.set(
+                    "utilization_vendors",
+                    cache_key,
+                    {"vendors": utilization_vendor_settings, "expires": expires},
+                )
 
         if settings["utilization.detect_docker"]:
             docker = DockerUtilization.detect()
@@ -18,9 +18,9 @@ import threading
 try:
     import grpc
 
-    from newrelic.core.infinite_tracing_pb2 import RecordStatus, Span
+    from newrelic.core.infinite_tracing_pb2 import RecordStatus, Span, SpanBatch
 except Exception:
-    grpc, RecordStatus, Span = None, None, None
+    grpc, RecordStatus, Span, SpanBatch = None, None, None, None
 
 _logger = logging.getLogger(__name__)
 
@@ -31,9 +31,13 @@ class StreamingRpc(object):
     This class keeps a stream_stream RPC alive, retrying after a timeout when
     errors are encountered. If grpc.StatusCode.UNIMPLEMENTED is encountered, a
     retry will not occur.
+
+    When the stream buffer batches spans, the SpanBatch messages it yields
+    are sent using the RecordSpanBatch method instead of RecordSpan.
     """
 
     PATH = "/com.newrelic.trace.v1.IngestService/RecordSpan"
+    BATCH_PATH = "/com.newrelic.trace.v1.IngestService/RecordSpanBatch"
     RETRY_POLICY = (
         (15, False),
         (15, False),
@@ -67,7 +71,12 @@ class StreamingRpc(object):
         else:
             self.channel = grpc.insecure_channel(self._endpoint, options=self.OPTIONS)
 
-        self.rpc = self.channel.stream_stream(self.PATH, Span.SerializeToString, RecordStatus.FromString)
+        if self.stream_buffer._batching:
+            self.rpc = self.channel.stream_stream(
+                self.BATCH_PATH, SpanBatch.SerializeToString, RecordStatus.FromString
+            )
+        else:
+            self.rpc = self.channel.stream_stream(self.PATH, Span.SerializeToString, RecordStatus.FromString)
 
     def create_response_iterator(self):
         with self.stream_buffer._notify:
@@ -0,0 +1,417 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the sharing of a single agent session between
+the worker processes on a host. Rather than each worker process connecting
+to the data collector and running its own harvest, the workers hand the
+data they collect to an aggregator process over a local Unix socket. The
+aggregator merges the data from all the workers into its own stats engine
+and reports it to the data collector in a single harvest.
+
+Messages are pickled, so the workers and the aggregator must be running
+the same version of Python and of the agent, and as the same user. As
+unpickling data can run arbitrary code, the socket must be in a directory
+which is owned by that user and is not accessible to any other user, which
+both the workers and the aggregator check before using the socket. Where
+the platform supports it, each end of a connection also checks that the
+process at the other end is running as the same user, before sending or
+unpickling any data.
+
+"""
+
+import io
+import logging
+import os
+import pickle
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import types
+
+from newrelic.core.stats_engine import StatsEngine
+from newrelic.network.exceptions import (
+    DiscardDataForRequest,
+    ForceAgentRestart,
+    NetworkInterfaceException,
+    RetryDataForRequest,
+)
+from newrelic.packages.six.moves import socketserver
+
+_logger = logging.getLogger(__name__)
+
+_MESSAGE_HEADER = struct.Struct(">I")
+
+# The stats engine of a worker holds references to the application settings
+# and to database client modules, used for running explain plans. Rather
+# than being pickled, these are replaced by those of the aggregator.
+
+_SETTINGS = "settings"
+_MODULE = "module"
+
+_STATS_ENGINE_EXCLUDED = ("_span_stream", "_sampling_parent")
+
+
+def default_socket_path():
+    return os.path.join(tempfile.gettempdir(), "newrelic-aggregator-%d" % os.getuid(), "aggregator.sock")
+
+
+def _check_socket_directory(path):
+    # The directory holding the socket must not allow any other user to
+    # replace the socket with their own, or to connect to it.
+
+    directory = os.path.dirname(os.path.abspath(path))
+    info = os.lstat(directory)
+
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        _logger.warning(
+            "The aggregator socket %r cannot be used as the directory it is "
+            "in is not owned by this user, or is accessible to other users.",
+            path,
+        )
+
+        raise RuntimeError("Insecure directory %r for the aggregator socket." % directory)
+
+
+def _check_peer(sock):
+    # Where the platform doesn't report the credentials of the process at
+    # the other end of the connection, the check of the directory holding
+    # the socket is relied on instead.
+
+    so_peercred = getattr(socket, "SO_PEERCRED", None)
+    if so_peercred is None:
+        return
+
+    credentials = struct.Struct("3i")
+
+    _, uid, _ = credentials.unpack(sock.getsockopt(socket.SOL_SOCKET, so_peercred, credentials.size))
+
+    if uid != os.getuid():
+        raise RuntimeError("Aggregator socket peer is running as another user (%d)." % uid)
+
+
+def dump_stats_engine(stats):
+    """Returns the data accumulated in the stats engine pickled, to be
+    merged into the stats engine of the aggregator.
+
+    """
+
+    settings = stats.settings
+
+    def persistent_id(obj):
+        if obj is settings:
+            return _SETTINGS
+        if isinstance(obj, types.ModuleType):
+            return (_MODULE, obj.__name__)
+        return None
+
+    state = dict(vars(stats))
+
+    for name in _STATS_ENGINE_EXCLUDED:
+        state.pop(name, None)
+
+    stream = io.BytesIO()
+
+    pickler = pickle.Pickler(stream, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(state)
+
+    return stream.getvalue()
+
+
+def load_stats_engine(data, settings):
+    """Returns a stats engine holding the data from a stats engine pickled
+    by dump_stats_engine(), associated with the settings.
+
+    """
+
+    def persistent_load(pid):
+        if pid == _SETTINGS:
+            return settings
+
+        kind, name = pid
+        if kind == _MODULE:
+            return sys.modules.get(name)
+
+        raise pickle.UnpicklingError("Unsupported persistent object %r." % (pid,))
+
+    unpickler = pickle.Unpickler(io.BytesIO(data))
+    unpickler.persistent_load = persistent_load
+
+    stats = StatsEngine()
+    vars(stats).update(unpickler.load())
+
+    return stats
+
+
+def _send_message(sock, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_MESSAGE_HEADER.pack(len(data)) + data)
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+
+    while size:
+        chunk = sock.recv(min(size, 256 * 1024))
+        if not chunk:
+            raise EOFError("Connection closed part way through a message.")
+
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def _receive_message(sock):
+    (size,) = _MESSAGE_HEADER.unpack(_receive_exactly(sock, _MESSAGE_HEADER.size))
+    return pickle.loads(_receive_exactly(sock, size))
+
+
+class AggregatorClient(object):
+
+    """Client used by a worker process to make requests of the aggregator.
+    A new connection is made for each request, so that the aggregator
+    can be restarted independently of the workers.
+
+    """
+
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.timeout = timeout
+
+    def request(self, *message):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            _check_socket_directory(self.path)
+
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+
+            _check_peer(sock)
+
+            _send_message(sock, message)
+
+            return _receive_message(sock)
+
+        except Exception as exc:
+            _logger.debug("Request to the aggregator at %r failed: %r", self.path, exc)
+
+            raise RetryDataForRequest(str(exc))
+
+        finally:
+            sock.close()
+
+    def connect(self, app_name, linked_applications):
+        """Returns the settings of the application in the aggregator, once
+        the aggregator has connected it to the data collector.
+
+        """
+
+        status, settings = self.request("connect", app_name, linked_applications)
+
+        if status != "ok":
+            raise NetworkInterfaceException("The application %r is not yet active in the aggregator." % app_name)
+
+        return settings
+
+    def send_stats_engine(self, app_name, agent_run_id, stats, transaction_count):
+        try:
+            data = dump_stats_engine(stats)
+        except Exception as exc:
+            _logger.exception("Unable to serialize the data for %r to be sent to the aggregator.", app_name)
+
+            raise DiscardDataForRequest(str(exc))
+
+        status, _ = self.request("harvest", app_name, agent_run_id, data, transaction_count)
+
+        # The aggregator has started a new session since the worker was
+        # connected, so the worker must connect again to pick up the
+        # settings for the new session.
+
+        if status == "restart":
+            raise ForceAgentRestart()
+
+        if status != "ok":
+            raise RetryDataForRequest(status)
+
+
+class _AggregatorRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            _check_peer(self.request)
+        except Exception:
+            _logger.warning("Rejected connection to the aggregator.", exc_info=True)
+            return
+
+        try:
+            message = _receive_message(self.request)
+        except Exception:
+            _logger.debug("Invalid request received by the aggregator.", exc_info=True)
+            return
+
+        try:
+            response = self.server.aggregator.dispatch(*message)
+        except Exception:
+            _logger.exception("Request %r to the aggregator failed.", message[0])
+            response = ("error", None)
+
+        _send_message(self.request, response)
+
+
+class _AggregatorSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class AggregatorServer(object):
+
+    """Server run in the aggregator process, which connects applications to
+    the data collector on behalf of the workers and merges the data the
+    workers send into the stats engines of the applications.
+
+    """
+
+    def __init__(self, path, agent=None):
+        self.path = path
+        self._agent = agent
+        self._server = None
+        self._thread = None
+
+    @property
+    def agent(self):
+        if self._agent is None:
+            from newrelic.core.agent import agent_instance
+
+            self._agent = agent_instance()
+
+        return self._agent
+
+    def _bind(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+        _check_socket_directory(self.path)
+
+        # A socket left behind by an aggregator which has exited is removed,
+        # but not one which an aggregator is still listening on.
+
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                os.remove(self.path)
+            else:
+                raise RuntimeError("An aggregator is already listening on %r." % self.path)
+            finally:
+                probe.close()
+
+        server = _AggregatorSocketServer(self.path, _AggregatorRequestHandler)
+        server.aggregator = self
+
+        os.chmod(self.path, 0o600)
+
+        return server
+
+    def start(self):
+        """Starts the server in a background thread."""
+
+        self._server = self._bind()
+        self._thread = threading.Thread(target=self._server.serve_forever, name="NR-Aggregator")
+        self._thread.daemon = True
+        self._thread.start()
+
+        _logger.info("Aggregator listening on %r.", self.path)
+
+    def serve_forever(self):
+        """Runs the server in the calling thread until interrupted."""
+
+        self._server = self._bind()
+
+        _logger.info("Aggregator listening on %r.", self.path)
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._close()
+
+    def stop(self):
+        """Stops the server started in a background thread."""
+
+        if self._thread is None:
+            return
+
+        self._server.shutdown()
+        self._thread.join()
+        self._thread = None
+
+        self._close()
+
+    def _close(self):
+        server, self._server = self._server, None
+
+        if server is None:
+            return
+
+        server.server_close()
+
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def dispatch(self, method, *args):
+        """Handles a request from a worker, returning a tuple of the status
+        of the request and any value returned.
+
+        """
+
+        handler = {"connect": self._connect, "harvest": self._harvest}.get(method)
+
+        if handler is None:
+            return ("unsupported", None)
+
+        return handler(*args)
+
+    def _connect(self, app_name, linked_applications):
+        agent = self.agent
+
+        agent.activate_application(app_name, linked_applications, timeout=0)
+
+        application = agent.application(app_name)
+        configuration = application and application.configuration
+
+        if configuration is None:
+            return ("inactive", None)
+
+        return ("ok", configuration)
+
+    def _harvest(self, app_name, agent_run_id, data, transaction_count):
+        application = self.agent.application(app_name)
+        configuration = application and application.configuration
+
+        if configuration is None:
+            return ("inactive", None)
+
+        if configuration.agent_run_id != agent_run_id:
+            return ("restart", None)
+
+        application.merge_stats_engine(load_stats_engine(data, configuration), transaction_count)
+
+        return ("ok", None)
@@ -18,6 +18,7 @@
 
 from __future__ import print_function
 
+import itertools
 import logging
 import os
 import sys
@@ -32,7 +33,11 @@ from newrelic.core.adaptive_sampler import AdaptiveSampler
 from newrelic.core.config import global_settings
 from newrelic.core.custom_event import create_custom_event
 from newrelic.core.data_collector import create_session
-from newrelic.core.database_utils import SQLConnections
+from newrelic.core.database_utils import (
+    ExplainPlanExecutor,
+    SQLConnections,
+    sql_statement_cache_stats,
+)
 from newrelic.core.environment import environment_settings
 from newrelic.core.internal_metrics import (
     InternalTrace,
@@ -41,6 +46,7 @@ from newrelic.core.internal_metrics import (
     internal_metric,
 )
 from newrelic.core.profile_sessions import profile_session_manager
+from newrelic.core.record_queue import TransactionRecordQueue
 from newrelic.core.rules_engine import RulesEngine, SegmentCollapseEngine
 from newrelic.core.stats_engine import CustomMetrics, StatsEngine
 from newrelic.network.exceptions import (
@@ -49,6 +55,7 @@ from newrelic.network.exceptions import (
     ForceAgentRestart,
     NetworkInterfaceException,
     RetryDataForRequest,
+    RetryPartialDataForRequest,
 )
 from newrelic.packages import six
 from newrelic.samplers.data_sampler import DataSampler
@@ -56,6 +63,22 @@ from newrelic.samplers.data_sampler import DataSampler
 _logger = logging.getLogger(__name__)
 
 
+class StatsEngineShard(object):
+
+    """Holds a stats engine into which the transactions recorded from a
+    subset of threads are merged, along with the lock protecting it. The
+    shards are folded into the main stats engine of the application at
+    the time of a harvest.
+
+    """
+
+    def __init__(self, stats_engine):
+        self.lock = threading.Lock()
+        self.stats_engine = stats_engine
+        self.transaction_count = 0
+        self.last_transaction = 0.0
+
+
 class Application(object):
 
     """Class which maintains recorded data for a single application."""
@@ -106,6 +129,18 @@ class Application(object):
         self._stats_custom_lock = threading.RLock()
         self._stats_custom_engine = StatsEngine()
 
+        self._record_queue = None
+        self._explain_plan_executor = None
+
+        # When sharding of the stats engine is enabled, each thread is
+        # assigned one of the shards on the first transaction it records
+        # and merges all its transactions into that shard rather than
+        # directly into the main stats engine.
+
+        self._stats_shards = []
+        self._stats_shard_local = threading.local()
+        self._stats_shard_counter = itertools.count()
+
         self._agent_commands_lock = threading.Lock()
         self._data_samplers_lock = threading.Lock()
         self._data_samplers_started = False
@@ -419,9 +454,11 @@ class Application(object):
                             configuration.transaction_name_rules,
                         )
 
-                    self._rules_engine["url"] = RulesEngine(configuration.url_rules)
-                    self._rules_engine["metric"] = RulesEngine(configuration.metric_name_rules)
-                    self._rules_engine["transaction"] = RulesEngine(configuration.transaction_name_rules)
+                    cache_size = configuration.agent_limits.normalization_cache_size
+
+                    self._rules_engine["url"] = RulesEngine(configuration.url_rules, cache_size)
+                    self._rules_engine["metric"] = RulesEngine(configuration.metric_name_rules, cache_size)
+                    self._rules_engine["transaction"] = RulesEngine(configuration.transaction_name_rules, cache_size)
                     self._rules_engine["segment"] = SegmentCollapseEngine(configuration.transaction_segment_terms)
 
                 except Exception:
@@ -499,6 +536,14 @@ class Application(object):
         with self._stats_lock:
             self._stats_engine.reset_stats(configuration, reset_stream=True)
 
+            if configuration.stats_engine.shards > 1:
+                self._stats_shards = [
+                    StatsEngineShard(self._stats_engine.create_workarea())
+                    for _ in range(configuration.stats_engine.shards)
+                ]
+            else:
+                self._stats_shards = []
+
             if configuration.serverless_mode.enabled:
                 sampling_target_period = 60.0
             else:
@@ -510,6 +555,34 @@ class Application(object):
         with self._stats_custom_lock:
             self._stats_custom_engine.reset_stats(configuration)
 
+        # If enabled, start the background thread which records completed
+        # transactions taken off the record queue. This is not done in
+        # serverless mode as data is harvested as soon as the transaction
+        # has been recorded.
+
+        if configuration.record_queue.enabled and not configuration.serverless_mode.enabled:
+            self._record_queue = TransactionRecordQueue(
+                self._app_name,
+                self._record_transaction,
+                configuration.record_queue.max_size,
+                configuration.record_queue.overflow_policy,
+            )
+            self._record_queue.start()
+
+        # If enabled, explain plans are run at harvest time by a pool of
+        # background threads which keep their database connections open
+        # between harvests. Not done in serverless mode as there is no
+        # later harvest to pick up explain plans which time out.
+
+        if configuration.agent_limits.explain_plan_workers > 0 and not configuration.serverless_mode.enabled:
+            self._explain_plan_executor = ExplainPlanExecutor(
+                configuration.agent_limits.explain_plan_workers,
+                configuration.agent_limits.max_sql_connections,
+                configuration.agent_limits.explain_plan_timeout,
+                configuration.agent_limits.explain_plan_cache_ttl,
+                idle_timeout=configuration.agent_limits.explain_plan_idle_timeout,
+            )
+
         # Record an initial start time for the reporting period and
         # clear record of last transaction processed.
 
@@ -855,8 +928,24 @@ class Application(object):
                     self._global_events_account += 1
 
     def record_transaction(self, data):
-        """Record a single transaction against this application."""
+        """Record a single transaction against this application. If the
+        record queue is enabled, the transaction is only placed on the
+        queue and is recorded later from the aggregator thread.
+
+        """
 
+        if not self._active_session:
+            return
+
+        record_queue = self._record_queue
+
+        if record_queue is not None:
+            record_queue.put(data)
+            return
+
+        self._record_transaction(data)
+
+    def _record_transaction(self, data):
         if not self._active_session:
             return
 
@@ -888,15 +977,27 @@ class Application(object):
 
         internal_metrics = CustomMetrics()
 
+        # Where the stats engine is sharded, merge into the shard for this
+        # thread so only threads sharing that shard will contend on the
+        # lock.
+
+        shard = self._stats_shard()
+
         with InternalTraceContext(internal_metrics):
             with InternalTrace("Supportability/Python/RecordTransaction/Calls/record"):
                 try:
                     # We accumulate stats into a workarea and only then merge it
                     # into the main one under a thread lock. Do this to ensure
                     # that the process of generating the metrics into the stats
-                    # don't unnecessarily lock out another thread.
+                    # don't unnecessarily lock out another thread. The workarea
+                    # is created from the stats engine it will be merged into,
+                    # so events which that would discard are not created.
+
+                    if shard is not None:
+                        stats = shard.stats_engine.create_workarea()
+                    else:
+                        stats = self._stats_engine.create_workarea()
 
-                    stats = self._stats_engine.create_workarea()
                     stats.record_transaction(data)
 
                 except Exception:
@@ -911,12 +1012,18 @@ class Application(object):
                     if settings.debug.record_transaction_failure:
                         raise
 
-            with self._stats_lock:
+            with shard.lock if shard is not None else self._stats_lock:
                 try:
-                    self._transaction_count += 1
-                    self._last_transaction = data.end_time
+                    if shard is not None:
+                        shard.transaction_count += 1
+                        shard.last_transaction = data.end_time
+                        stats_engine = shard.stats_engine
+                    else:
+                        self._transaction_count += 1
+                        self._last_transaction = data.end_time
+                        stats_engine = self._stats_engine
 
-                    self._stats_engine.merge(stats)
+                    stats_engine.merge(stats)
 
                     # We merge the internal statistics here as well even
                     # though have popped out of the context where we are
@@ -924,7 +1031,7 @@ class Application(object):
                     # anything else after this point. If we do then that
                     # data will not be recorded.
 
-                    self._stats_engine.merge_custom_metrics(internal_metrics.metrics())
+                    stats_engine.merge_custom_metrics(internal_metrics.metrics())
 
                 except Exception:
                     _logger.exception(
@@ -938,6 +1045,55 @@ class Application(object):
                     if settings.debug.record_transaction_failure:
                         raise
 
+    def _stats_shard(self):
+        """Returns the stats engine shard assigned to the current thread,
+        or None if sharding of the stats engine is not enabled.
+
+        """
+
+        shards = self._stats_shards
+
+        if not shards:
+            return None
+
+        try:
+            index = self._stats_shard_local.index
+        except AttributeError:
+            index = self._stats_shard_local.index = next(self._stats_shard_counter)
+
+        return shards[index % len(shards)]
+
+    def _merge_stats_shards(self):
+        """Folds the data accumulated in each stats engine shard into the
+        main stats engine. Must be called with the stats lock held. Each
+        shard is only locked long enough to swap in an empty stats engine.
+
+        """
+
+        for shard in self._stats_shards:
+            workarea = self._stats_engine.create_workarea()
+
+            with shard.lock:
+                stats, shard.stats_engine = shard.stats_engine, workarea
+                transaction_count, shard.transaction_count = shard.transaction_count, 0
+                last_transaction = shard.last_transaction
+
+            self._stats_engine.merge_shard(stats)
+
+            self._transaction_count += transaction_count
+            self._last_transaction = max(self._last_transaction, last_transaction)
+
+    def merge_stats_engine(self, stats, transaction_count=0):
+        """Merges the data accumulated in a stats engine into that of the
+        application, such as that handed over by a worker process where
+        this process is acting as the aggregator for the host.
+
+        """
+
+        with self._stats_lock:
+            self._stats_engine.merge_shard(stats)
+            self._transaction_count += transaction_count
+
     def cmd_start_profiler(self, command_id=0, **kwargs):
         """Triggered by the start_profiler agent command to start a
         thread profiling session.
@@ -1043,6 +1199,62 @@ class Application(object):
 
         return {command_id: {}}
 
+    def _dispatch_harvest_requests(self, harvest_requests, internal_metrics):
+        """Sends the batch of harvest requests, dealing with the failure
+        of each request separately. Returns True if the data for any of the
+        requests failed to be sent but can be retried with the next harvest.
+        If the data collector indicated that the agent needs to restart or
+        disconnect, the exception for that is raised once all the requests
+        have completed.
+
+        """
+
+        retry_data = False
+        force_exception = None
+
+        for exc_info, reset, retain in harvest_requests.dispatch(internal_metrics):
+            exc_type, exc = exc_info[:2]
+
+            if isinstance(exc, (ForceAgentRestart, ForceAgentDisconnect)):
+                force_exception = force_exception or exc
+
+            else:
+                internal_metric("Supportability/Python/Harvest/Exception/%s" % callable_name(exc_type), 1)
+
+                if isinstance(exc, RetryDataForRequest):
+                    # The data is left in the snapshot to be rolled back
+                    # into the data for the next harvest. Where only part
+                    # of it was sent, only the part not sent is kept.
+
+                    if isinstance(exc, RetryPartialDataForRequest) and retain is not None:
+                        retain(exc.unsent, exc.events_seen)
+
+                    retry_data = True
+                    continue
+
+                elif isinstance(exc, DiscardDataForRequest):
+                    # If we retry with same data the same error is likely
+                    # to occur again so we just throw the data away.
+
+                    self._discard_count += 1
+
+                else:
+                    _logger.error(
+                        "Unexpected exception when attempting "
+                        "to send harvest data to the data collector. "
+                        "Please report this problem to New Relic support "
+                        "for further investigation.",
+                        exc_info=exc_info,
+                    )
+
+            if reset is not None:
+                reset()
+
+        if force_exception is not None:
+            raise force_exception
+
+        return retry_data
+
     def harvest(self, shutdown=False, flexible=False):
         """Performs a harvest, reporting aggregated data for the current
         reporting period to the data collector.
@@ -1081,9 +1293,20 @@ class Application(object):
                 _logger.debug("Snapshotting for harvest[%s] of %r.", call_metric, self._app_name)
 
                 configuration = self._active_session.configuration
-                transaction_count = self._transaction_count
+
+                # On a final harvest make sure that any transactions
+                # still waiting on the record queue are recorded first
+                # so they are not lost.
+
+                record_queue = self._record_queue
+
+                if shutdown and record_queue is not None:
+                    record_queue.flush(configuration.shutdown_timeout)
 
                 with self._stats_lock:
+                    self._merge_stats_shards()
+
+                    transaction_count = self._transaction_count
                     self._transaction_count = 0
 
                     self._last_transaction = 0.0
@@ -1156,6 +1379,27 @@ class Application(object):
 
                     stats.record_custom_metric("Instance/Reporting", 0)
 
+                    if record_queue is not None:
+                        queue_seen, queue_dropped, queue_depth = record_queue.stats()
+
+                        internal_count_metric("Supportability/Python/RecordQueue/Seen", queue_seen)
+                        internal_count_metric("Supportability/Python/RecordQueue/Dropped", queue_dropped)
+                        internal_metric("Supportability/Python/RecordQueue/Depth", queue_depth)
+
+                    sql_cache_hits, sql_cache_misses = sql_statement_cache_stats()
+
+                    if sql_cache_hits or sql_cache_misses:
+                        internal_count_metric("Supportability/Python/SQLStatementCache/Hits", sql_cache_hits)
+                        internal_count_metric("Supportability/Python/SQLStatementCache/Misses", sql_cache_misses)
+
+                    explain_plan_executor = self._explain_plan_executor
+
+                    if explain_plan_executor is not None:
+                        explain_plans_executed, explain_plans_timed_out = explain_plan_executor.stats()
+
+                        internal_count_metric("Supportability/Python/ExplainPlan/Executed", explain_plans_executed)
+                        internal_count_metric("Supportability/Python/ExplainPlan/TimedOut", explain_plans_timed_out)
+
                     # If an import order issue was detected, send a metric for
                     # each uninstrumented module
 
@@ -1185,8 +1429,25 @@ class Application(object):
                         _logger.debug("Stretching harvest duration for forced harvest on shutdown.")
                         period_end = self._period_start + 1.001
 
+                # A worker process reporting through an aggregator hands
+                # the snapshot over to the aggregator, which merges it
+                # with the data from the other workers and reports it to
+                # the data collector as part of its own harvest.
+
+                if self._active_session.FORWARD_HARVEST:
+                    return self._forward_harvest(
+                        stats, transaction_count, internal_metrics, shutdown, flexible, period_end
+                    )
+
                 try:
-                    # Send the transaction and custom metric data.
+                    # The data for each of the event types, errors and
+                    # traces is independent, so it is submitted to be sent
+                    # as a batch, with more than one request in flight at
+                    # once if the session allows it. The data held for each
+                    # is only reset once it has been sent.
+
+                    session = self._active_session
+                    harvest_requests = session.request_dispatcher()
 
                     # Send data set for analytics, which is Synthetic analytic
                     # events, and the sampled data set of regular requests sent
@@ -1197,11 +1458,14 @@ class Application(object):
                         if synthetics_events.num_samples:
                             _logger.debug("Sending synthetics event data for harvest of %r.", self._app_name)
 
-                            self._active_session.send_transaction_events(
-                                synthetics_events.sampling_info, synthetics_events
+                            harvest_requests.submit(
+                                session.send_transaction_events,
+                                (synthetics_events.sampling_info, synthetics_events),
+                                reset=stats.reset_synthetics_events,
+                                retain=synthetics_events.retain,
                             )
-
-                        stats.reset_synthetics_events()
+                        else:
+                            stats.reset_synthetics_events()
 
                     if configuration.collect_analytics_events and configuration.transaction_events.enabled:
 
@@ -1219,11 +1483,14 @@ class Application(object):
                             if transaction_events.num_samples:
                                 _logger.debug("Sending analytics event data for harvest of %r.", self._app_name)
 
-                                self._active_session.send_transaction_events(
-                                    transaction_events.sampling_info, transaction_events
+                                harvest_requests.submit(
+                                    session.send_transaction_events,
+                                    (transaction_events.sampling_info, transaction_events),
+                                    reset=stats.reset_transaction_events,
+                                    retain=transaction_events.retain,
                                 )
-
-                            stats.reset_transaction_events()
+                            else:
+                                stats.reset_transaction_events()
 
                     # Send span events
 
@@ -1244,21 +1511,25 @@ class Application(object):
                         else:
                             spans = stats.span_events
                             if spans:
-                                if spans.num_samples > 0:
-                                    span_samples = list(spans)
 
-                                    _logger.debug("Sending span event data for harvest of %r.", self._app_name)
-
-                                    self._active_session.send_span_events(spans.sampling_info, span_samples)
-                                    span_samples = None
+                                def spans_sent():
+                                    # As per spec
+                                    internal_count_metric("Supportability/SpanEvent/TotalEventsSeen", spans.num_seen)
+                                    internal_count_metric("Supportability/SpanEvent/TotalEventsSent", spans.num_samples)
 
-                                # As per spec
-                                spans_seen = spans.num_seen
-                                spans_sampled = spans.num_samples
-                                internal_count_metric("Supportability/SpanEvent/TotalEventsSeen", spans_seen)
-                                internal_count_metric("Supportability/SpanEvent/TotalEventsSent", spans_sampled)
+                                if spans.num_samples > 0:
+                                    _logger.debug("Sending span event data for harvest of %r.", self._app_name)
 
-                                stats.reset_span_events()
+                                    harvest_requests.submit(
+                                        session.send_span_events,
+                                        (spans.sampling_info, list(spans)),
+                                        completed=spans_sent,
+                                        reset=stats.reset_span_events,
+                                        retain=spans.retain,
+                                    )
+                                else:
+                                    spans_sent()
+                                    stats.reset_span_events()
 
                     # Send error events
 
@@ -1270,21 +1541,28 @@ class Application(object):
 
                         error_events = stats.error_events
                         if error_events:
-                            num_error_samples = error_events.num_samples
-                            if num_error_samples > 0:
-                                error_event_samples = list(error_events)
-
-                                _logger.debug("Sending error event data for harvest of %r.", self._app_name)
 
-                                samp_info = error_events.sampling_info
-                                self._active_session.send_error_events(samp_info, error_event_samples)
-                                error_event_samples = None
+                            def error_events_sent():
+                                # As per spec
+                                internal_count_metric(
+                                    "Supportability/Events/TransactionError/Seen", error_events.num_seen
+                                )
+                                internal_count_metric(
+                                    "Supportability/Events/TransactionError/Sent", error_events.num_samples
+                                )
 
-                            # As per spec
-                            internal_count_metric("Supportability/Events/TransactionError/Seen", error_events.num_seen)
-                            internal_count_metric("Supportability/Events/TransactionError/Sent", num_error_samples)
+                            if error_events.num_samples > 0:
+                                _logger.debug("Sending error event data for harvest of %r.", self._app_name)
 
-                            stats.reset_error_events()
+                                harvest_requests.submit(
+                                    session.send_error_events,
+                                    (error_events.sampling_info, list(error_events)),
+                                    completed=error_events_sent,
+                                    reset=stats.reset_error_events,
+                                )
+                            else:
+                                error_events_sent()
+                                stats.reset_error_events()
 
                     # Send custom events
 
@@ -1293,19 +1571,25 @@ class Application(object):
                         customs = stats.custom_events
 
                         if customs:
-                            if customs.num_samples > 0:
-                                custom_samples = list(customs)
 
-                                _logger.debug("Sending custom event data for harvest of %r.", self._app_name)
-
-                                self._active_session.send_custom_events(customs.sampling_info, custom_samples)
-                                custom_samples = None
+                            def customs_sent():
+                                # As per spec
+                                internal_count_metric("Supportability/Events/Customer/Seen", customs.num_seen)
+                                internal_count_metric("Supportability/Events/Customer/Sent", customs.num_samples)
 
-                            # As per spec
-                            internal_count_metric("Supportability/Events/Customer/Seen", customs.num_seen)
-                            internal_count_metric("Supportability/Events/Customer/Sent", customs.num_samples)
+                            if customs.num_samples > 0:
+                                _logger.debug("Sending custom event data for harvest of %r.", self._app_name)
 
-                            stats.reset_custom_events()
+                                harvest_requests.submit(
+                                    session.send_custom_events,
+                                    (customs.sampling_info, list(customs)),
+                                    completed=customs_sent,
+                                    reset=stats.reset_custom_events,
+                                    retain=customs.retain,
+                                )
+                            else:
+                                customs_sent()
+                                stats.reset_custom_events()
 
                     # Send log events
 
@@ -1314,20 +1598,26 @@ class Application(object):
                         logs = stats.log_events
 
                         if logs:
-                            if logs.num_samples > 0:
-                                log_samples = list(logs)
-
-                                _logger.debug("Sending log event data for harvest of %r.", self._app_name)
 
-                                self._active_session.send_log_events(logs.sampling_info, log_samples)
-                                log_samples = None
+                            def logs_sent():
+                                # As per spec
+                                internal_count_metric("Supportability/Logging/Forwarding/Seen", logs.num_seen)
+                                internal_count_metric("Supportability/Logging/Forwarding/Sent", logs.num_samples)
+                                internal_count_metric("Logging/Forwarding/Dropped", logs.num_seen - logs.num_samples)
 
-                            # As per spec
-                            internal_count_metric("Supportability/Logging/Forwarding/Seen", logs.num_seen)
-                            internal_count_metric("Supportability/Logging/Forwarding/Sent", logs.num_samples)
-                            internal_count_metric("Logging/Forwarding/Dropped", logs.num_seen - logs.num_samples)
+                            if logs.num_samples > 0:
+                                _logger.debug("Sending log event data for harvest of %r.", self._app_name)
 
-                            stats.reset_log_events()
+                                harvest_requests.submit(
+                                    session.send_log_events,
+                                    (logs.sampling_info, list(logs)),
+                                    completed=logs_sent,
+                                    reset=stats.reset_log_events,
+                                    retain=logs.retain,
+                                )
+                            else:
+                                logs_sent()
+                                stats.reset_log_events()
 
                     # Send the accumulated error data.
 
@@ -1337,30 +1627,45 @@ class Application(object):
                         if error_data:
                             _logger.debug("Sending error data for harvest of %r.", self._app_name)
 
-                            self._active_session.send_errors(error_data)
+                            harvest_requests.submit(session.send_errors, (error_data,))
 
-                    if not flexible:
-                        if configuration.collect_traces:
+                    if not flexible and configuration.collect_traces:
+                        # The explain plan executor keeps its database
+                        # connections open across harvests, whereas
+                        # the SQL connections are closed on exit.
+
+                        explain_plan_executor = self._explain_plan_executor
+
+                        if explain_plan_executor is not None:
+                            connections = explain_plan_executor
+                        else:
                             connections = SQLConnections(configuration.agent_limits.max_sql_connections)
 
-                            with connections:
-                                if configuration.slow_sql.enabled:
-                                    _logger.debug("Processing slow SQL data for harvest of %r.", self._app_name)
+                        try:
+                            if configuration.slow_sql.enabled:
+                                _logger.debug("Processing slow SQL data for harvest of %r.", self._app_name)
+
+                                slow_sql_data = stats.slow_sql_data(connections)
+
+                                if slow_sql_data:
+                                    _logger.debug("Sending slow SQL data for harvest of %r.", self._app_name)
 
-                                    slow_sql_data = stats.slow_sql_data(connections)
+                                    harvest_requests.submit(session.send_sql_traces, (slow_sql_data,))
 
-                                    if slow_sql_data:
-                                        _logger.debug("Sending slow SQL data for harvest of %r.", self._app_name)
+                            slow_transaction_data = stats.transaction_trace_data(connections)
 
-                                        self._active_session.send_sql_traces(slow_sql_data)
+                            if slow_transaction_data:
+                                _logger.debug("Sending slow transaction data for harvest of %r.", self._app_name)
 
-                                slow_transaction_data = stats.transaction_trace_data(connections)
+                                harvest_requests.submit(session.send_transaction_traces, (slow_transaction_data,))
 
-                                if slow_transaction_data:
-                                    _logger.debug("Sending slow transaction data for harvest of %r.", self._app_name)
+                        finally:
+                            if connections is not explain_plan_executor:
+                                connections.cleanup()
 
-                                    self._active_session.send_transaction_traces(slow_transaction_data)
+                    retry_data = self._dispatch_harvest_requests(harvest_requests, internal_metrics)
 
+                    if not flexible:
                         # Create a metric_normalizer based on normalize_name
                         # If metric rename rules are empty, set normalizer
                         # to None and the stats engine will skip steps as
@@ -1393,6 +1698,17 @@ class Application(object):
 
                         stats.reset_metric_stats()
 
+                    # Any data which failed to be sent, but which can be
+                    # retried, is still held in the snapshot, whereas the
+                    # data which was sent has been reset. Merge what is
+                    # left back in to be sent with the next harvest. This
+                    # is done after the metric data has been sent, so as
+                    # not to report the metric data twice.
+
+                    if retry_data:
+                        self._stats_engine.rollback(stats)
+
+                    if not flexible:
                         # Successful, we reset the reporting period start time.
                         # If an error occurs after this point,
                         # any remaining data for the period being reported
@@ -1403,6 +1719,13 @@ class Application(object):
 
                         self._period_start = period_end
 
+                        # Send any data held in the spool from when it
+                        # previously failed to be sent.
+
+                        _logger.debug("Replay spooled data for harvest of %r.", self._app_name)
+
+                        self._active_session.replay_spool()
+
                         # Fetch agent commands sent from the data collector
                         # and process them.
 
@@ -1524,6 +1847,58 @@ class Application(object):
         with self._stats_lock:
             self._stats_engine.merge_custom_metrics(internal_metrics.metrics())
 
+    def _forward_harvest(self, stats, transaction_count, internal_metrics, shutdown, flexible, period_end):
+        if not flexible:
+            stats.merge_custom_metrics(internal_metrics.metrics())
+            internal_metrics.reset_metric_stats()
+
+        try:
+            self._active_session.send_stats_engine(stats, transaction_count)
+
+            if not flexible:
+                self._period_start = period_end
+
+            if shutdown:
+                self.internal_agent_shutdown(restart=False)
+
+        except ForceAgentRestart:
+            # The aggregator has started a new session, so connect to it
+            # again to pick up the settings for that session.
+
+            self.internal_agent_shutdown(restart=True)
+
+        except RetryDataForRequest:
+            # The aggregator could not be reached, so merge the data back
+            # in to be handed over with the next harvest.
+
+            internal_metric("Supportability/Python/Harvest/Exception/%s" % callable_name(RetryDataForRequest), 1)
+
+            self._stats_engine.rollback(stats)
+
+        except DiscardDataForRequest:
+            # The data could not be handed over, and would fail to be
+            # again, so is thrown away.
+
+            internal_metric("Supportability/Python/Harvest/Exception/%s" % callable_name(DiscardDataForRequest), 1)
+
+            self._discard_count += 1
+
+        except Exception:
+            exc_type = sys.exc_info()[0]
+
+            internal_metric("Supportability/Python/Harvest/Exception/%s" % callable_name(exc_type), 1)
+
+            _logger.exception(
+                "Unexpected exception when attempting to hand the data for %r over to the aggregator.",
+                self._app_name,
+            )
+
+        # Merge back in statistics recorded about handing the data over,
+        # to be part of the data for the next harvest.
+
+        with self._stats_lock:
+            self._stats_engine.merge_custom_metrics(internal_metrics.metrics())
+
     def report_profile_data(self):
         """Report back any profile data."""
 
@@ -1557,6 +1932,28 @@ class Application(object):
 
         self.stop_data_samplers()
 
+        # Stop the aggregator thread for the record queue. Anything
+        # still queued is recorded before the session is discarded.
+
+        if self._record_queue is not None:
+            try:
+                self._record_queue.shutdown(self._active_session.configuration.shutdown_timeout)
+            except Exception:
+                pass
+
+            self._record_queue = None
+
+        # Stop the explain plan worker threads, closing the database
+        # connections they hold.
+
+        if self._explain_plan_executor is not None:
+            try:
+                self._explain_plan_executor.shutdown(self._active_session.configuration.shutdown_timeout)
+            except Exception:
+                pass
+
+            self._explain_plan_executor = None
+
         # Now shutdown the actual agent session.
 
         try:
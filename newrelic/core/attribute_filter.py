@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from newrelic.common.bounded_cache import BoundedCache
+
 # Attribute "destinations" represented as bitfields.
 
 DST_NONE = 0x0
@@ -57,12 +59,24 @@ class AttributeFilter(object):
     #      the bitfield.
     #
     #   4. Return the resulting bitfield after all rules have been applied.
+    #
+    # So that step 3 need not scan every rule, the sorted rules are compiled
+    # into a dictionary of exact name rules and a trie of wildcard prefix
+    # rules. The rules sharing the same name reduce to a single pair of
+    # masks, such that applying them all is equivalent to:
+    #
+    #     destinations = (destinations & and_mask) | or_mask
+    #
+    # Results are memoised in a cache holding at most
+    # attributes.filter_cache_size entries, as attribute names may come
+    # from user data and so could have unbounded cardinality.
 
     def __init__(self, flattened_settings):
 
         self.enabled_destinations = self._set_enabled_destinations(flattened_settings)
         self.rules = self._build_rules(flattened_settings)
-        self.cache = {}
+        self.exact_rules, self.wildcard_rules = self._compile_rules(self.rules)
+        self.cache = BoundedCache(flattened_settings.get('attributes.filter_cache_size', 1000))
 
     def __repr__(self):
         return "<AttributeFilter: destinations: %s, rules: %s>" % (
@@ -135,24 +149,75 @@ class AttributeFilter(object):
 
         return tuple(rules)
 
+    def _compile_rules(self, rules):
+
+        # Returns a dictionary mapping names to the masks for exact name
+        # rules, and a trie of the masks for wildcard rules. Each node of
+        # the trie is a dictionary keyed by the next character of the
+        # prefix, with the masks of rules ending at that node held under
+        # the None key.
+        #
+        # Because the rules are sorted, folding them into the masks in
+        # order preserves the order in which they would be applied.
+
+        exact_rules = {}
+        wildcard_rules = {}
+
+        for rule in rules:
+            if rule.is_wildcard:
+                node = wildcard_rules
+                for character in rule.name:
+                    node = node.setdefault(character, {})
+                masks = node
+                key = None
+            else:
+                masks = exact_rules
+                key = rule.name
+
+            and_mask, or_mask = masks.get(key, (DST_ALL, DST_NONE))
+
+            if rule.is_include:
+                or_mask |= rule.destinations & self.enabled_destinations
+            else:
+                and_mask &= ~rule.destinations
+                or_mask &= ~rule.destinations
+
+            masks[key] = (and_mask, or_mask)
+
+        return exact_rules, wildcard_rules
+
     def apply(self, name, default_destinations):
         if self.enabled_destinations == DST_NONE:
             return DST_NONE
 
         cache_index = (name, default_destinations)
 
-        if cache_index in self.cache:
-            return self.cache[cache_index]
+        destinations = self.cache.get(cache_index)
+        if destinations is not None:
+            return destinations
 
         destinations = self.enabled_destinations & default_destinations
 
-        for rule in self.rules:
-            if rule.name_match(name):
-                if rule.is_include:
-                    inc_dest = rule.destinations & self.enabled_destinations
-                    destinations |= inc_dest
-                else:
-                    destinations &= ~rule.destinations
+        # Wildcard rules sort before an exact rule of the same name, and
+        # shorter prefixes sort before longer ones, so walk the trie first
+        # and then apply any exact rule.
+
+        node = self.wildcard_rules
+        for character in name:
+            masks = node.get(None)
+            if masks is not None:
+                destinations = (destinations & masks[0]) | masks[1]
+            node = node.get(character)
+            if node is None:
+                break
+        else:
+            masks = node.get(None)
+            if masks is not None:
+                destinations = (destinations & masks[0]) | masks[1]
+
+        masks = self.exact_rules.get(name)
+        if masks is not None:
+            destinations = (destinations & masks[0]) | masks[1]
 
         self.cache[cache_index] = destinations
         return destinations
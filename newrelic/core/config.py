@@ -276,6 +276,30 @@ class ApplicationLoggingLocalDecoratingSettings(Settings):
     pass
 
 
+class RecordQueueSettings(Settings):
+    pass
+
+
+class StatsEngineSettings(Settings):
+    pass
+
+
+class TraceCacheSettings(Settings):
+    pass
+
+
+class SpoolSettings(Settings):
+    pass
+
+
+class ConnectCacheSettings(Settings):
+    pass
+
+
+class AggregatorSettings(Settings):
+    pass
+
+
 class InfiniteTracingSettings(Settings):
     _trace_observer_host = None
 
@@ -396,6 +420,12 @@ _settings.transaction_segments.attributes = TransactionSegmentAttributesSettings
 _settings.distributed_tracing = DistributedTracingSettings()
 _settings.serverless_mode = ServerlessModeSettings()
 _settings.infinite_tracing = InfiniteTracingSettings()
+_settings.record_queue = RecordQueueSettings()
+_settings.stats_engine = StatsEngineSettings()
+_settings.trace_cache = TraceCacheSettings()
+_settings.spool = SpoolSettings()
+_settings.connect_cache = ConnectCacheSettings()
+_settings.aggregator = AggregatorSettings()
 _settings.event_harvest_config = EventHarvestConfigSettings()
 _settings.event_harvest_config.harvest_limits = EventHarvestConfigHarvestLimitSettings()
 
@@ -643,6 +673,7 @@ _settings.max_payload_size_in_bytes = 1000000
 _settings.attributes.enabled = True
 _settings.attributes.exclude = []
 _settings.attributes.include = []
+_settings.attributes.filter_cache_size = _environ_as_int("NEW_RELIC_ATTRIBUTES_FILTER_CACHE_SIZE", 1000)
 
 _settings.thread_profiler.enabled = True
 _settings.cross_application_tracer.enabled = False
@@ -711,10 +742,17 @@ _settings.slow_sql.enabled = True
 _settings.synthetics.enabled = True
 
 _settings.agent_limits.data_collector_timeout = 30.0
+_settings.agent_limits.data_collector_connections = 1
 _settings.agent_limits.transaction_traces_nodes = 2000
+_settings.agent_limits.transaction_segments_maximum = 0
 _settings.agent_limits.sql_query_length_maximum = 16384
+_settings.agent_limits.sql_statement_cache_size = 1000
 _settings.agent_limits.slow_sql_stack_trace = 30
 _settings.agent_limits.max_sql_connections = 4
+_settings.agent_limits.explain_plan_workers = 0
+_settings.agent_limits.explain_plan_timeout = 5.0
+_settings.agent_limits.explain_plan_cache_ttl = 300.0
+_settings.agent_limits.explain_plan_idle_timeout = 120.0
 _settings.agent_limits.sql_explain_plans = 30
 _settings.agent_limits.sql_explain_plans_per_harvest = 60
 _settings.agent_limits.slow_sql_data = 10
@@ -727,11 +765,36 @@ _settings.agent_limits.synthetics_events = 200
 _settings.agent_limits.synthetics_transactions = 20
 _settings.agent_limits.data_compression_threshold = 64 * 1024
 _settings.agent_limits.data_compression_level = None
+_settings.agent_limits.normalization_cache_size = 1000
 
 _settings.infinite_tracing.trace_observer_host = os.environ.get("NEW_RELIC_INFINITE_TRACING_TRACE_OBSERVER_HOST", None)
 _settings.infinite_tracing.trace_observer_port = _environ_as_int("NEW_RELIC_INFINITE_TRACING_TRACE_OBSERVER_PORT", 443)
 _settings.infinite_tracing.ssl = True
 _settings.infinite_tracing.span_queue_size = _environ_as_int("NEW_RELIC_INFINITE_TRACING_SPAN_QUEUE_SIZE", 10000)
+_settings.infinite_tracing.batching = _environ_as_bool("NEW_RELIC_INFINITE_TRACING_BATCHING", False)
+_settings.infinite_tracing.batch_size = _environ_as_int("NEW_RELIC_INFINITE_TRACING_BATCH_SIZE", 100)
+_settings.infinite_tracing.batch_linger = _environ_as_float("NEW_RELIC_INFINITE_TRACING_BATCH_LINGER", 0.0)
+
+_settings.record_queue.enabled = _environ_as_bool("NEW_RELIC_RECORD_QUEUE_ENABLED", default=False)
+_settings.record_queue.max_size = _environ_as_int("NEW_RELIC_RECORD_QUEUE_MAX_SIZE", 1000)
+_settings.record_queue.overflow_policy = "drop"
+
+_settings.stats_engine.shards = _environ_as_int("NEW_RELIC_STATS_ENGINE_SHARDS", 1)
+_settings.stats_engine.columnar_metrics = _environ_as_bool("NEW_RELIC_STATS_ENGINE_COLUMNAR_METRICS", default=False)
+
+_settings.trace_cache.context_variables = _environ_as_bool("NEW_RELIC_TRACE_CACHE_CONTEXT_VARIABLES", default=False)
+
+_settings.spool.enabled = _environ_as_bool("NEW_RELIC_SPOOL_ENABLED", default=False)
+_settings.spool.directory = os.environ.get("NEW_RELIC_SPOOL_DIRECTORY", None)
+_settings.spool.max_size_in_bytes = _environ_as_int("NEW_RELIC_SPOOL_MAX_SIZE_IN_BYTES", 32 * 1024 * 1024)
+_settings.spool.segment_size_in_bytes = _environ_as_int("NEW_RELIC_SPOOL_SEGMENT_SIZE_IN_BYTES", 4 * 1024 * 1024)
+_settings.spool.max_age_in_seconds = _environ_as_float("NEW_RELIC_SPOOL_MAX_AGE_IN_SECONDS", 3600.0)
+
+_settings.connect_cache.enabled = _environ_as_bool("NEW_RELIC_CONNECT_CACHE_ENABLED", default=False)
+_settings.connect_cache.directory = os.environ.get("NEW_RELIC_CONNECT_CACHE_DIRECTORY", None)
+
+_settings.aggregator.enabled = _environ_as_bool("NEW_RELIC_AGGREGATOR_ENABLED", default=False)
+_settings.aggregator.socket_path = os.environ.get("NEW_RELIC_AGGREGATOR_SOCKET_PATH", None)
 
 _settings.event_harvest_config.harvest_limits.analytic_event_data = _environ_as_int(
     "NEW_RELIC_ANALYTICS_EVENTS_MAX_SAMPLES_STORED", DEFAULT_RESERVOIR_SIZE
@@ -0,0 +1,150 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a cache on disk of information which is expensive
+to collect when connecting to the data collector, such as the versions of
+the installed packages and the cloud vendor metadata, so that it can be
+reused by later processes rather than being collected again.
+
+"""
+
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+
+from newrelic.common.encoding_utils import json_decode, json_encode
+from newrelic.core.config import global_settings
+
+_logger = logging.getLogger(__name__)
+
+_replace = getattr(os, "replace", os.rename)
+
+
+class ConnectCache(object):
+
+    """Cache of values held as JSON files in a directory. Each value has a
+    name and is stored along with a key, which must match for the value to
+    be used, with only the value for the most recent key being kept.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, name, key):
+        digest = hashlib.sha256(json_encode(key).encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, "%s-%s.json" % (name, digest))
+
+    def get(self, name, key, default=None):
+        """Returns the value cached under the name for the key, or default
+        if there is no value cached for the key.
+
+        """
+
+        try:
+            with open(self._path(name, key), "rb") as fp:
+                entry = json_decode(fp.read().decode("utf-8"))
+
+        except (IOError, OSError):
+            return default
+
+        except ValueError:
+            _logger.debug("Ignoring invalid %r entry in the connect cache in %r.", name, self.directory)
+            return default
+
+        # The key is held in the entry as the file name only holds a digest
+        # of it.
+
+        if not isinstance(entry, dict) or entry.get("key") != json_decode(json_encode(key)):
+            return default
+
+        return entry.get("value", default)
+
+    def set(self, name, key, value):
+        """Caches the value under the name for the key, replacing any value
+        cached for another key.
+
+        """
+
+        path = self._path(name, key)
+        data = json_encode({"key": key, "value": value}).encode("utf-8")
+
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0o700)
+
+            # Write to a temporary file which is then renamed, so that a
+            # process reading the entry never sees it partly written.
+
+            fd, temporary = tempfile.mkstemp(dir=self.directory, prefix=".%s-" % name)
+
+            try:
+                with os.fdopen(fd, "wb") as fp:
+                    fp.write(data)
+
+                _replace(temporary, path)
+
+            except Exception:
+                os.remove(temporary)
+                raise
+
+            for entry in os.listdir(self.directory):
+                stale = os.path.join(self.directory, entry)
+
+                if entry.startswith(name + "-") and entry.endswith(".json") and stale != path:
+                    try:
+                        os.remove(stale)
+                    except (IOError, OSError):
+                        pass
+
+        except (IOError, OSError):
+            _logger.debug("Unable to write %r entry to the connect cache in %r.", name, self.directory, exc_info=True)
+
+
+def connect_cache(settings=None):
+    """Returns the connect cache for the settings, or None if the connect
+    cache is not enabled.
+
+    """
+
+    if settings is None:
+        settings = global_settings()
+
+    if not settings.connect_cache.enabled:
+        return None
+
+    directory = settings.connect_cache.directory or os.path.join(tempfile.gettempdir(), "newrelic-connect-cache")
+
+    return ConnectCache(directory)
+
+
+def interpreter_key():
+    """Returns a key identifying the Python interpreter and the packages
+    installed for it. Installing, upgrading or removing a package changes
+    the modification time of the directory on the module search path it
+    is installed in, so results in a different key.
+
+    """
+
+    paths = []
+
+    for path in sys.path:
+        try:
+            paths.append((path, os.stat(path or ".").st_mtime))
+        except (IOError, OSError):
+            pass
+
+    return [sys.executable, sys.version, sys.prefix, paths]
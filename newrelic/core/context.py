@@ -64,18 +64,15 @@ class ContextOf(object):
             self.should_restore = True
 
             # Set context in trace cache
-            self.trace_cache._cache[self.thread_id] = self.trace
+            self.trace_cache.set_current(self.thread_id, self.trace)
 
         return self
 
     def __exit__(self, exc, value, tb):
         if self.should_restore:
-            if self.restore is not None:
-                # Restore previous contents
-                self.trace_cache._cache[self.thread_id] = self.restore
-            else:
-                # Remove entry from cache
-                self.trace_cache._cache.pop(self.thread_id)
+            # Restore previous contents, removing the entry from the cache
+            # if there was none.
+            self.trace_cache.set_current(self.thread_id, self.restore)
 
 
 def context_wrapper(func, trace=None, request=None, trace_cache_id=None, strict=True):
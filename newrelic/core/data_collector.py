@@ -18,7 +18,14 @@
 
 from __future__ import print_function
 
+import collections
+import hashlib
 import logging
+import os
+import sys
+import tempfile
+import threading
+import time
 
 from newrelic.common.agent_http import (
     ApplicationModeClient,
@@ -26,22 +33,214 @@ from newrelic.common.agent_http import (
     ServerlessModeClient,
 )
 from newrelic.core.agent_protocol import AgentProtocol, ServerlessModeProtocol
+from newrelic.core.aggregator import AggregatorClient, default_socket_path
 from newrelic.core.agent_streaming import StreamingRpc
 from newrelic.core.config import global_settings
+from newrelic.core.harvest_spool import HarvestSpool
+from newrelic.core.internal_metrics import (
+    InternalTraceContext,
+    internal_count_metric,
+)
+from newrelic.core.stats_engine import CustomMetrics
+from newrelic.network.exceptions import (
+    DiscardDataForRequest,
+    PayloadTooLargeForRequest,
+    RetryDataForRequest,
+    RetryPartialDataForRequest,
+)
 
 _logger = logging.getLogger(__name__)
 
 
+def _split_sampling_info(sampling_info, count, total):
+    # Divides the counts in the sampling info between two parts of a set
+    # of samples, in proportion to the number of samples in each part.
+
+    first, second = {}, {}
+
+    for key, value in sampling_info.items():
+        first[key] = value * count // total
+        second[key] = value - first[key]
+
+    return first, second
+
+
+class _Request(object):
+    def __init__(self, function, args, completed, reset, retain):
+        self.function = function
+        self.args = args
+        self.completed = completed
+        self.reset = reset
+        self.retain = retain
+        self.metrics = CustomMetrics()
+        self.exc_info = None
+
+    def send(self):
+        with InternalTraceContext(self.metrics):
+            try:
+                self.function(*self.args)
+            except Exception:
+                self.exc_info = sys.exc_info()
+
+
+class RequestDispatcher(object):
+
+    """Sends a batch of requests to the data collector, with up to
+    max_workers of them in flight at once, each from its own thread. The
+    threads only exist for as long as it takes to send the batch.
+
+    Each request is sent in its own internal trace context, so metrics
+    recorded while it is being sent are kept apart from those for other
+    requests, and are merged into the caller's internal metrics when the
+    batch has been sent. A request failing does not stop the remainder of
+    the batch from being sent.
+
+    With max_workers of 1, the requests are sent one after the other from
+    the calling thread.
+
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max(max_workers, 1)
+        self._requests = []
+
+    def __len__(self):
+        return len(self._requests)
+
+    def submit(self, function, args=(), completed=None, reset=None, retain=None):
+        """Queues up a call of function with args to be made when the
+        batch is sent. Once the batch has been sent, completed is called
+        if the request succeeded, followed by reset. Reset is also called
+        if the request failed in a way that the data should be discarded.
+        Where only part of the data could be sent, retain is called to
+        keep just the data which is to be retried.
+
+        """
+
+        self._requests.append(_Request(function, args, completed, reset, retain))
+
+    def dispatch(self, internal_metrics):
+        """Sends the batch of requests and waits for them to complete.
+        Returns the exception details for each request which failed, in
+        the order the requests were submitted, along with the reset and
+        retain callbacks for the request. Completion callbacks are
+        called from the calling thread.
+
+        """
+
+        requests, self._requests = self._requests, []
+
+        workers = min(self.max_workers, len(requests))
+
+        if workers <= 1:
+            for request in requests:
+                request.send()
+
+        else:
+            pending = collections.deque(requests)
+
+            def worker():
+                while True:
+                    try:
+                        request = pending.popleft()
+                    except IndexError:
+                        return
+
+                    request.send()
+
+            threads = []
+
+            for index in range(workers):
+                thread = threading.Thread(target=worker, name="NR-Harvest-Request/%d" % index)
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+            for thread in threads:
+                thread.join()
+
+        failures = []
+
+        for request in requests:
+            internal_metrics.merge_metrics(request.metrics.metrics())
+
+            if request.exc_info is None:
+                if request.completed is not None:
+                    request.completed()
+                if request.reset is not None:
+                    request.reset()
+            else:
+                failures.append((request.exc_info, request.reset, request.retain))
+
+        return failures
+
+
 class Session(object):
     PROTOCOL = AgentProtocol
     CLIENT = ApplicationModeClient
 
+    # Whether the snapshot of the stats engine taken at harvest time is
+    # handed over as is with send_stats_engine(), rather than the data it
+    # holds being sent to the data collector.
+
+    FORWARD_HARVEST = False
+
+    # Requests which fail to be sent, but which could be retried, are
+    # written to the spool when enabled. Of these, all but the SQL traces
+    # and log events carry the agent run ID as the first item of their
+    # payload, which is updated for the current session on replay.
+
+    SPOOLED_METHODS = frozenset(
+        (
+            "analytic_event_data",
+            "custom_event_data",
+            "error_data",
+            "error_event_data",
+            "log_event_data",
+            "metric_data",
+            "span_event_data",
+            "sql_trace_data",
+            "transaction_sample_data",
+        )
+    )
+
+    SPOOLED_WITHOUT_RUN_ID = frozenset(("log_event_data", "sql_trace_data"))
+
+    SPOOL_REPLAY_LIMIT = 100
+    SPOOL_BACKOFF_MINIMUM = 15.0
+    SPOOL_BACKOFF_MAXIMUM = 600.0
+
     def __init__(self, app_name, linked_applications, environment, settings):
         self._protocol = self.PROTOCOL.connect(
             app_name, linked_applications, environment, settings, client_cls=self.CLIENT
         )
         self._rpc = None
 
+        self._spool = self._create_spool(app_name)
+        self._spool_backoff = 0.0
+        self._spool_replay_time = 0.0
+
+    def _create_spool(self, app_name):
+        settings = self.configuration
+
+        if not settings.spool.enabled:
+            return None
+
+        directory = settings.spool.directory or os.path.join(tempfile.gettempdir(), "newrelic-spool")
+
+        # The requests can only be replayed on behalf of the application
+        # they were for, so each application has its own spool.
+
+        key = "%s/%s" % (settings.license_key, app_name)
+        directory = os.path.join(directory, hashlib.sha256(key.encode("utf-8")).hexdigest()[:32])
+
+        return HarvestSpool(
+            directory,
+            settings.spool.max_size_in_bytes,
+            settings.spool.segment_size_in_bytes,
+            settings.spool.max_age_in_seconds,
+        )
+
     @property
     def configuration(self):
         return self._protocol.configuration
@@ -53,6 +252,85 @@ class Session(object):
     def close_connection(self):
         self._protocol.close_connection()
 
+        # Requests spooled during a harvest are made available to be
+        # replayed at the end of it.
+
+        if self._spool is not None:
+            self._spool.flush()
+
+    def _send(self, method, payload=()):
+        try:
+            return self._protocol.send(method, payload)
+        except RetryDataForRequest:
+            spool = self._spool
+
+            if spool is None or method not in self.SPOOLED_METHODS or not spool.write(method, payload):
+                raise
+
+        internal_count_metric("Supportability/Python/Spool/Written/%s" % method, 1)
+
+        # The data collector cannot presently be reached, so there is no
+        # point trying to replay the spool straight away.
+
+        self._spool_replay_time = max(
+            self._spool_replay_time, time.time() + max(self._spool_backoff, self.SPOOL_BACKOFF_MINIMUM)
+        )
+
+    def _replay(self, method, payload):
+        if method not in self.SPOOLED_WITHOUT_RUN_ID:
+            payload[0] = self.agent_run_id
+
+        try:
+            self._protocol.send(method, payload)
+        except DiscardDataForRequest:
+            internal_count_metric("Supportability/Python/Spool/Discarded/%s" % method, 1)
+        else:
+            internal_count_metric("Supportability/Python/Spool/Replayed/%s" % method, 1)
+
+    def replay_spool(self):
+        """Sends requests held in the spool from when they failed to be
+        sent earlier. Where they fail to be sent again, further attempts
+        are backed off, up to SPOOL_BACKOFF_MAXIMUM seconds apart. Returns
+        the number of requests sent.
+
+        """
+
+        if self._spool is None or time.time() < self._spool_replay_time:
+            return 0
+
+        try:
+            sent = self._spool.replay(self._replay, self.SPOOL_REPLAY_LIMIT)
+        except RetryDataForRequest:
+            self._spool_backoff = min(
+                max(2 * self._spool_backoff, self.SPOOL_BACKOFF_MINIMUM), self.SPOOL_BACKOFF_MAXIMUM
+            )
+            self._spool_replay_time = time.time() + self._spool_backoff
+
+            _logger.debug("Replay of the harvest spool failed, next attempt in %.0f seconds.", self._spool_backoff)
+
+            return 0
+
+        self._spool_backoff = 0.0
+
+        return sent
+
+    def request_dispatcher(self):
+        """Returns a dispatcher for sending a batch of requests through
+        the session, with as many requests in flight at once as there are
+        connections available to the data collector.
+
+        """
+
+        settings = self.configuration
+
+        # The audit log is not safe to write to from multiple threads, so
+        # requests are sent one at a time when it is enabled.
+
+        if settings.audit_log_file:
+            return RequestDispatcher()
+
+        return RequestDispatcher(settings.agent_limits.data_collector_connections)
+
     def connect_span_stream(self, span_iterator, record_metric):
         if not self._rpc:
             host = self.configuration.infinite_tracing.trace_observer_host
@@ -98,25 +376,97 @@ class Session(object):
             return
 
         payload = (self.agent_run_id, transaction_traces)
-        return self._protocol.send("transaction_sample_data", payload)
+        return self._send("transaction_sample_data", payload)
+
+    def _send_sample_set(self, method, sampling_info, samples, payload):
+        """Sends a set of sampled events. If the payload is too large to
+        be accepted, the set is split in two, with each half being sent as
+        a separate request, and so on until each request fits. The counts
+        in the sampling info are divided between the parts in proportion
+        to the number of events in each, so they still add up to those for
+        the whole set. An event too large to be sent on its own is dropped.
+
+        If some of the parts are sent, but others fail in a way that they
+        can be retried, RetryPartialDataForRequest is raised identifying
+        the events which were not sent, so only those are retried.
+
+        """
+
+        unsent = []
+
+        handled = self._send_sample_parts(method, sampling_info, samples, payload, 0, unsent)
+
+        if not unsent:
+            return
+
+        if not handled:
+            raise unsent[0][-1]
+
+        raise RetryPartialDataForRequest(
+            [(start, end) for start, end, _, _ in unsent], sum(info["events_seen"] for _, _, info, _ in unsent)
+        )
+
+    def _send_sample_parts(self, method, sampling_info, samples, payload, offset, unsent, split=False):
+        # Returns the number of parts which were sent, or dropped as too
+        # large, with the parts which can be retried added to unsent.
+
+        try:
+            self._send(method, payload(sampling_info, samples))
+            return 1
+
+        except PayloadTooLargeForRequest:
+            samples = list(samples)
+
+            if len(samples) < 2:
+                if not split:
+                    raise
+
+                _logger.debug("Dropping event for %r as it is too large to be sent on its own.", method)
+
+                return 1
+
+        except RetryDataForRequest as exc:
+            if not split:
+                raise
+
+            unsent.append((offset, offset + len(samples), sampling_info, exc))
+
+            return 0
+
+        internal_count_metric("Supportability/Python/Collector/PayloadSplit/%s" % method, 1)
+
+        count = len(samples) // 2
+
+        first_info, second_info = _split_sampling_info(sampling_info, count, len(samples))
+
+        first = self._send_sample_parts(method, first_info, samples[:count], payload, offset, unsent, split=True)
+        second = self._send_sample_parts(
+            method, second_info, samples[count:], payload, offset + count, unsent, split=True
+        )
+
+        return first + second
+
+    def _sample_set_payload(self, sampling_info, samples):
+        return (self.agent_run_id, sampling_info, samples)
+
+    @staticmethod
+    def _log_events_payload(sampling_info, samples):
+        return ({"logs": tuple(log._asdict() for log in samples)},)
 
     def send_transaction_events(self, sampling_info, sample_set):
         """Called to submit sample set for analytics."""
 
-        payload = (self.agent_run_id, sampling_info, sample_set)
-        return self._protocol.send("analytic_event_data", payload)
+        return self._send_sample_set("analytic_event_data", sampling_info, sample_set, self._sample_set_payload)
 
     def send_custom_events(self, sampling_info, custom_event_data):
         """Called to submit sample set for custom events."""
 
-        payload = (self.agent_run_id, sampling_info, custom_event_data)
-        return self._protocol.send("custom_event_data", payload)
+        return self._send_sample_set("custom_event_data", sampling_info, custom_event_data, self._sample_set_payload)
 
     def send_span_events(self, sampling_info, span_event_data):
         """Called to submit sample set for span events."""
 
-        payload = (self.agent_run_id, sampling_info, span_event_data)
-        return self._protocol.send("span_event_data", payload)
+        return self._send_sample_set("span_event_data", sampling_info, span_event_data, self._sample_set_payload)
 
     def send_metric_data(self, start_time, end_time, metric_data):
         """Called to submit metric data for specified period of time.
@@ -126,13 +476,12 @@ class Session(object):
         """
 
         payload = (self.agent_run_id, start_time, end_time, metric_data)
-        return self._protocol.send("metric_data", payload)
+        return self._send("metric_data", payload)
 
     def send_log_events(self, sampling_info, log_event_data):
         """Called to submit sample set for log events."""
 
-        payload = ({"logs": tuple(log._asdict() for log in log_event_data)},)
-        return self._protocol.send("log_event_data", payload)
+        return self._send_sample_set("log_event_data", sampling_info, log_event_data, self._log_events_payload)
 
     def get_agent_commands(self):
         """Receive agent commands from the data collector.
@@ -152,13 +501,13 @@ class Session(object):
 
         """
         payload = (self.agent_run_id, errors)
-        return self._protocol.send("error_data", payload)
+        return self._send("error_data", payload)
 
     def send_error_events(self, sampling_info, error_data):
         """Called to submit sample set for error events."""
 
         payload = (self.agent_run_id, sampling_info, error_data)
-        return self._protocol.send("error_event_data", payload)
+        return self._send("error_event_data", payload)
 
     def send_sql_traces(self, sql_traces):
         """Called to sub SQL traces. The SQL traces should be an
@@ -170,7 +519,7 @@ class Session(object):
         """
 
         payload = (sql_traces,)
-        return self._protocol.send("sql_trace_data", payload)
+        return self._send("sql_trace_data", payload)
 
     def send_agent_command_results(self, cmd_results):
         """Acknowledge the receipt of an agent command."""
@@ -223,14 +572,84 @@ class ServerlessModeSession(Session):
     def get_agent_commands(*args, **kwargs):
         return ()
 
+    @staticmethod
+    def _create_spool(app_name):
+        return None
+
+    @staticmethod
+    def request_dispatcher():
+        # Payloads are accumulated by the client to be output together
+        # at the end of the invocation, so are always added one at a time.
+
+        return RequestDispatcher()
+
+    @staticmethod
+    def shutdown_session():
+        pass
+
+
+class AggregatorSession(Session):
+
+    """Session for a worker process which hands the data it collects to
+    an aggregator process on the same host, rather than connecting to the
+    data collector itself. The settings are those of the application in
+    the aggregator, including the agent run ID of its session.
+
+    """
+
+    FORWARD_HARVEST = True
+
+    def __init__(self, app_name, linked_applications, environment, settings):
+        self._app_name = app_name
+        self._client = AggregatorClient(
+            settings.aggregator.socket_path or default_socket_path(),
+            settings.agent_limits.data_collector_timeout,
+        )
+        self._configuration = self._client.connect(app_name, linked_applications)
+        self._rpc = None
+        self._spool = None
+
+    @property
+    def configuration(self):
+        return self._configuration
+
+    @property
+    def agent_run_id(self):
+        return self._configuration.agent_run_id
+
+    def send_stats_engine(self, stats, transaction_count):
+        """Called to hand the snapshot of the stats engine taken at harvest
+        time over to the aggregator, along with the number of transactions
+        recorded in it.
+
+        """
+
+        self._client.send_stats_engine(self._app_name, self.agent_run_id, stats, transaction_count)
+
+    @staticmethod
+    def close_connection():
+        pass
+
+    @staticmethod
+    def get_agent_commands(*args, **kwargs):
+        return ()
+
     @staticmethod
     def shutdown_session():
         pass
 
+    @staticmethod
+    def finalize():
+        pass
+
 
 def create_session(license_key, app_name, linked_applications, environment):
     settings = global_settings()
-    if settings.serverless_mode.enabled:
+    if settings.aggregator.enabled:
+        return AggregatorSession(
+            app_name, linked_applications, environment, settings
+        )
+    elif settings.serverless_mode.enabled:
         return ServerlessModeSession(
             app_name, linked_applications, environment, settings
         )
@@ -17,12 +17,15 @@ explain plans for SQL etc.
 
 """
 
+import collections
 import logging
 import re
-import weakref
+import threading
+import time
 
 import newrelic.packages.six as six
 
+from newrelic.common.bounded_cache import BoundedCache
 from newrelic.core.internal_metrics import internal_metric
 from newrelic.core.config import global_settings
 
@@ -33,6 +36,11 @@ _logger = logging.getLogger(__name__)
 # Obfuscation consists of replacing any quoted strings, integer or float
 # literals with a '?'. For quoted strings which types of quoted strings
 # should be collapsed depend on the database in use.
+#
+# All the patterns for quoted strings and literals are fused into a single
+# regular expression per quoting style, so that the SQL is scanned just
+# once. As quoted strings and literals can't overlap, this gives the same
+# result as first substituting quoted strings and then literals.
 
 # See http://stackoverflow.com/questions/6718874.
 #
@@ -42,17 +50,9 @@ _logger = logging.getLogger(__name__)
 
 _single_quotes_p = r"'(?:[^']|'')*?(?:\\'.*|'(?!'))"
 _double_quotes_p = r'"(?:[^"]|"")*?(?:\\".*|"(?!"))'
-_dollar_quotes_p = r'(\$(?!\d)[^$]*?\$).*?(?:\1|$)'
+_dollar_quotes_p = r'(?P<dollar>\$(?!\d)[^$]*?\$).*?(?:(?P=dollar)|$)'
 _oracle_quotes_p = (r"q'\[.*?(?:\]'|$)|q'\{.*?(?:\}'|$)|"
         r"q'\<.*?(?:\>'|$)|q'\(.*?(?:\)'|$)")
-_any_quotes_p = _single_quotes_p + '|' + _double_quotes_p
-_single_dollar_p = _single_quotes_p + '|' + _dollar_quotes_p
-_single_oracle_p = _single_quotes_p + '|' + _oracle_quotes_p
-
-_single_quotes_re = re.compile(_single_quotes_p)
-_any_quotes_re = re.compile(_any_quotes_p)
-_single_dollar_re = re.compile(_single_dollar_p)
-_single_oracle_re = re.compile(_single_oracle_p)
 
 # Cleanup regexes. Presence of a quote will indicate that the now obfuscated
 # sql was actually malformed.
@@ -76,18 +76,46 @@ _single_dollar_cleanup_re = re.compile(_single_dollar_cleanup_p)
 # We add one variation here in that don't want to replace a number that
 # follows on from a ':'. This is because ':1' can be used as positional
 # parameter with database adapters where 'paramstyle' is 'numeric'.
-
-_uuid_p = r'\{?(?:[0-9a-f]\-?){32}\}?'
-_int_p = r'(?<!:)-?\b(?:[0-9]+\.)?[0-9]+(e[+-]?[0-9]+)?'
-_hex_p = r'0x[0-9a-f]+'
-_bool_p = r'\b(?:true|false|null)\b'
+#
+# Each alternative starts by matching a definite character, with any
+# checks on the preceding characters done as a look behind after it, so
+# the regular expression engine can skip quickly over characters which
+# can't start a literal. Case is spelt out in character classes rather
+# than by compiling with IGNORECASE as the quoting patterns are case
+# sensitive.
+
+_hex_digit_p = r'[0-9a-fA-F]'
+_uuid_p = (r'\{(?:%(h)s\-?){32}\}?|%(h)s\-?(?:%(h)s\-?){31}\}?' %
+        {'h': _hex_digit_p})
+_hex_p = r'0[xX]%s+' % _hex_digit_p
+_int_p = (r'-(?<!:-)(?:[0-9]+\.)?[0-9]+(?:[eE][+-]?[0-9]+)?|'
+        r'[0-9](?<![\w:][0-9])(?:[0-9]*\.[0-9]+|[0-9]*)'
+        r'(?:[eE][+-]?[0-9]+)?')
+_bool_p = (r'(?:[tT](?<!\w[tT])[rR][uU][eE]|[fF](?<!\w[fF])[aA][lL][sS][eE]|'
+        r'[nN](?<!\w[nN])[uU][lL][lL])')
+
+# A boolean must be followed by a word boundary. An Oracle quoted string
+# starts with a word character, but as it would have been replaced by a
+# '?' it also counts as a boundary.
+
+_bool_end_p = r'\b'
+_bool_end_oracle_p = r'(?:\b|(?=%s))' % _oracle_quotes_p
 
 # Join all literals into one compiled regular expression. Longest expressions
 # first to avoid the situation of partial matches on shorter expressions. UUIDs
 # might be an example.
 
-_all_literals_p = '(' + ')|('.join([_uuid_p, _hex_p, _int_p, _bool_p]) + ')'
-_all_literals_re = re.compile(_all_literals_p, re.IGNORECASE)
+
+def _obfuscate_re(quotes_p, bool_end_p=_bool_end_p):
+    return re.compile('|'.join([quotes_p, _uuid_p, _hex_p, _int_p,
+            _bool_p + bool_end_p]))
+
+
+_single_quotes_re = _obfuscate_re(_single_quotes_p)
+_any_quotes_re = _obfuscate_re(_single_quotes_p + '|' + _double_quotes_p)
+_single_dollar_re = _obfuscate_re(_single_quotes_p + '|' + _dollar_quotes_p)
+_single_oracle_re = _obfuscate_re(_single_quotes_p + '|' + _oracle_quotes_p,
+        _bool_end_oracle_p)
 
 _quotes_table = {
     'single': (_single_quotes_re, _single_quotes_cleanup_re),
@@ -98,16 +126,13 @@ _quotes_table = {
 
 
 def _obfuscate_sql(sql, database):
-    quotes_re, quotes_cleanup_re = _quotes_table.get(database.quoting_style,
+    obfuscate_re, quotes_cleanup_re = _quotes_table.get(
+            database.quoting_style,
             (_single_quotes_re, _single_quotes_cleanup_re))
 
-    # Substitute quoted strings first.
-
-    sql = quotes_re.sub('?', sql)
-
-    # Replace all other sensitive fields
+    # Substitute quoted strings and all other sensitive fields.
 
-    sql = _all_literals_re.sub('?', sql)
+    sql = obfuscate_re.sub('?', sql)
 
     # Determine if the obfuscated query was malformed by searching for
     # remaining quote characters
@@ -528,6 +553,8 @@ class SQLConnection(object):
         self.database = database
         self.connection = connection
         self.cursors = {}
+        self.last_used = time.time()
+        self.active = False
 
     def cursor(self, args=(), kwargs={}):
         key = (args, frozenset(kwargs.items()))
@@ -546,6 +573,14 @@ class SQLConnection(object):
 
         return cursor
 
+    def rollback(self):
+        self.active = False
+
+        try:
+            self.connection.rollback()
+        except (AttributeError, self.database.NotSupportedError):
+            pass
+
     def cleanup(self):
         settings = global_settings()
 
@@ -553,11 +588,7 @@ class SQLConnection(object):
             _logger.debug('Cleanup database connection for %r.',
                     self.database)
 
-        try:
-            self.connection.rollback()
-            pass
-        except (AttributeError, self.database.NotSupportedError):
-            pass
+        self.rollback()
 
         self.connection.close()
 
@@ -619,8 +650,65 @@ class SQLConnections(object):
                 _logger.debug('Created database connection for %r.',
                         database.client)
 
+        connection.last_used = time.time()
+        connection.active = True
+
         return connection
 
+    def discard(self, connection):
+        """Removes the connection from the cache and closes it, for use
+        where an error occurred when using it, as the connection may no
+        longer be usable.
+
+        """
+
+        self.connections = [item for item in self.connections
+                if item[1] is not connection]
+
+        try:
+            connection.cleanup()
+        except Exception:
+            _logger.debug('Error closing database connection for %r.',
+                    connection.database.client, exc_info=True)
+
+    def rollback(self):
+        """Rolls back the transaction on each connection used since the
+        last rollback, so that a connection kept open between explain
+        plans isn't left idle within a transaction. A connection which
+        can't be rolled back is discarded.
+
+        """
+
+        for key, connection in list(self.connections):
+            if connection.active:
+                try:
+                    connection.rollback()
+                except Exception:
+                    _logger.debug('Error rolling back database connection '
+                            'for %r.', connection.database.client,
+                            exc_info=True)
+
+                    self.discard(connection)
+
+    def close_idle(self, idle_timeout):
+        """Closes the connections which haven't been used in the last
+        idle_timeout seconds.
+
+        """
+
+        settings = global_settings()
+
+        cutoff = time.time() - idle_timeout
+
+        for key, connection in list(self.connections):
+            if connection.last_used <= cutoff:
+                if settings.debug.log_explain_plan_queries:
+                    _logger.debug('Close database connection for %r as '
+                            'idle for more than %r seconds.',
+                            connection.database.client, idle_timeout)
+
+                self.discard(connection)
+
     def cleanup(self):
         settings = global_settings()
 
@@ -662,6 +750,8 @@ def _explain_plan(connections, sql, database, connect_params, cursor_params,
 
     settings = global_settings()
 
+    connection = None
+
     if _could_be_multi_query(sql):
         if settings.debug.log_explain_plan_queries:
             _logger.debug('Skipping explain plan for %r on %r due to '
@@ -736,26 +826,34 @@ def _explain_plan(connections, sql, database, connect_params, cursor_params,
                     'execute_params=%r.', query, database.client,
                     cursor_params, execute_params)
 
+        # The connection may be left unusable by the error, for example
+        # in an aborted transaction, so isn't used for later plans.
+
+        if connection is not None:
+            connections.discard(connection)
+
     return None
 
 
-def explain_plan(connections, sql_statement, connect_params, cursor_params,
-        sql_parameters, execute_params, sql_format):
+def _can_explain(sql_statement, connect_params):
 
     # If no parameters supplied for creating database connection
     # then mustn't have been a candidate for explain plans in the
     # first place, so skip it.
 
     if connect_params is None:
-        return
+        return False
 
     # Determine if we even know how to perform explain plans for
     # this particular database.
 
-    database = sql_statement.database
+    return sql_statement.operation in sql_statement.database.explain_stmts
 
-    if sql_statement.operation not in database.explain_stmts:
-        return
+
+def _run_explain_plan(connections, sql_statement, connect_params,
+        cursor_params, sql_parameters, execute_params, sql_format):
+
+    database = sql_statement.database
 
     details = _explain_plan(connections, sql_statement.sql, database,
             connect_params, cursor_params, sql_parameters, execute_params)
@@ -765,6 +863,277 @@ def explain_plan(connections, sql_statement, connect_params, cursor_params,
 
     return details
 
+
+def explain_plan(connections, sql_statement, connect_params, cursor_params,
+        sql_parameters, execute_params, sql_format):
+
+    if not _can_explain(sql_statement, connect_params):
+        return
+
+    if isinstance(connections, ExplainPlanExecutor):
+        return connections.explain_plan(sql_statement, connect_params,
+                cursor_params, sql_parameters, execute_params, sql_format)
+
+    return _run_explain_plan(connections, sql_statement, connect_params,
+            cursor_params, sql_parameters, execute_params, sql_format)
+
+
+def _hashable(value):
+    # Connect parameters are an (args, kwargs) tuple which can hold
+    # dictionaries and lists, so convert them into something which can
+    # be used as part of a dictionary key.
+
+    if isinstance(value, dict):
+        return tuple(sorted(((repr(k), _hashable(v)) for k, v in
+                value.items()), key=lambda item: item[0]))
+
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+
+    return value
+
+
+class _ExplainPlanRequest(object):
+
+    def __init__(self, key, args, deadline):
+        self.key = key
+        self.args = args
+        self.deadline = deadline
+        self.done = False
+        self.plan = None
+
+
+class ExplainPlanExecutor(object):
+
+    """Runs explain plans on a pool of background threads so that a slow
+    database doesn't hold up the harvest.
+
+    Each worker thread keeps its own set of database connections open
+    across harvests, as DBAPI2 connections can't be shared between
+    threads. The transaction on a connection is rolled back after each
+    explain plan, a connection is closed if an explain plan on it fails,
+    and connections unused for idle_timeout seconds are closed. The
+    result of each explain plan is cached against the database, connect
+    parameters and normalized SQL of the statement for cache_ttl
+    seconds. Repeated slow queries are thus not explained again on every
+    harvest.
+
+    A caller waits at most timeout seconds, from when the explain plan
+    was first requested, for it to complete. An explain plan which takes
+    longer is left to finish in the background, and its result is cached
+    for use on a later harvest.
+
+    """
+
+    def __init__(self, workers, max_connections=4, timeout=5.0,
+            cache_ttl=300.0, cache_size=1000, idle_timeout=120.0):
+        self._workers = max(workers, 1)
+        self._max_connections = max_connections
+        self._idle_timeout = idle_timeout
+        self._timeout = timeout
+        self._cache_ttl = cache_ttl
+        self._cache = BoundedCache(cache_size)
+        self._pending = {}
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._done = threading.Condition(self._lock)
+        self._threads = []
+        self._shutdown = False
+
+        self._executed = 0
+        self._timeouts = 0
+
+    def submit(self, sql_statement, connect_params, cursor_params,
+            sql_parameters, execute_params, sql_format):
+        """Starts running an explain plan in the background, unless its
+        result is already cached or it is already running. Returns the
+        request for the explain plan, or None if no explain plan can be
+        run for the statement.
+
+        """
+
+        if not _can_explain(sql_statement, connect_params):
+            return None
+
+        key = (sql_statement.database.client, _hashable(connect_params),
+                sql_statement.identifier, sql_format)
+
+        now = time.time()
+
+        with self._lock:
+            if self._shutdown:
+                return None
+
+            entry = self._cache.get(key)
+
+            if entry is not None and entry[0] > now:
+                request = _ExplainPlanRequest(key, None, now)
+                request.done = True
+                request.plan = entry[1]
+
+                return request
+
+            request = self._pending.get(key)
+
+            if request is not None:
+                return request
+
+            self._executed += 1
+
+            args = (sql_statement, connect_params, cursor_params,
+                    sql_parameters, execute_params, sql_format)
+
+            request = _ExplainPlanRequest(key, args, now + self._timeout)
+
+            self._pending[key] = request
+            self._queue.append(request)
+
+            if not self._threads:
+                self._start_workers()
+
+            self._not_empty.notify()
+
+        return request
+
+    def prefetch(self, nodes):
+        """Starts running explain plans for the database nodes in the
+        background, so that they run in parallel with each other.
+
+        """
+
+        for node in nodes:
+            self.submit(node.statement, node.connect_params,
+                    node.cursor_params, node.sql_parameters,
+                    node.execute_params, node.sql_format)
+
+    def explain_plan(self, sql_statement, connect_params, cursor_params,
+            sql_parameters, execute_params, sql_format):
+        """Returns the explain plan for the statement, waiting for it to
+        be run if necessary. Returns None if no explain plan could be
+        generated before the timeout expired.
+
+        """
+
+        request = self.submit(sql_statement, connect_params, cursor_params,
+                sql_parameters, execute_params, sql_format)
+
+        if request is None:
+            return None
+
+        with self._lock:
+            while not request.done:
+                remaining = request.deadline - time.time()
+
+                if remaining <= 0.0:
+                    self._timeouts += 1
+
+                    _logger.debug('Timed out waiting for explain plan '
+                            'on %r.', sql_statement.database.client)
+
+                    return None
+
+                self._done.wait(remaining)
+
+        return request.plan
+
+    def stats(self):
+        """Returns the number of explain plans started and the number
+        which timed out since the last call. The counts are reset on each
+        call.
+
+        """
+
+        with self._lock:
+            result = (self._executed, self._timeouts)
+            self._executed, self._timeouts = 0, 0
+
+        return result
+
+    def shutdown(self, timeout=None):
+        """Stops the worker threads, discarding any explain plans not yet
+        started, and closes their database connections.
+
+        """
+
+        with self._lock:
+            self._shutdown = True
+            self._queue.clear()
+            self._not_empty.notify_all()
+            threads = self._threads
+
+        for thread in threads:
+            if thread.is_alive() and thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def _start_workers(self):
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._run,
+                    name='NR-Explain-Plan/%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        connections = SQLConnections(self._max_connections)
+
+        try:
+            while True:
+                with self._lock:
+                    # While connections are open, wake up to close them
+                    # once idle even if no more explain plans are run.
+
+                    if not self._queue and not self._shutdown:
+                        if connections.connections:
+                            self._not_empty.wait(self._idle_timeout)
+                        else:
+                            self._not_empty.wait()
+
+                    if self._shutdown:
+                        return
+
+                    request = self._queue.popleft() if self._queue else None
+
+                if request is None:
+                    connections.close_idle(self._idle_timeout)
+                    continue
+
+                plan = None
+
+                try:
+                    plan = _run_explain_plan(connections, *request.args)
+                except Exception:
+                    _logger.exception('Running an explain plan in the '
+                            'background has failed. This would indicate '
+                            'some sort of internal implementation issue with '
+                            'the agent. Please report this problem to New '
+                            'Relic support for further investigation.')
+
+                connections.rollback()
+                connections.close_idle(self._idle_timeout)
+
+                with self._lock:
+                    self._cache[request.key] = (
+                            time.time() + self._cache_ttl, plan)
+
+                    request.plan = plan
+                    request.done = True
+
+                    self._pending.pop(request.key, None)
+                    self._done.notify_all()
+
+        finally:
+            try:
+                connections.cleanup()
+            except Exception:
+                _logger.debug('Error closing explain plan database '
+                        'connections.', exc_info=True)
+
 # Wrapper for information about a specific database.
 
 
@@ -774,6 +1143,12 @@ class SQLDatabase(object):
         self.dbapi2_module = dbapi2_module
 
     def __getattr__(self, name):
+        # The module isn't yet set when the object is being unpickled, and
+        # looking it up would otherwise recurse.
+
+        if name == 'dbapi2_module':
+            raise AttributeError(name)
+
         return getattr(self.dbapi2_module, name)
 
     @property
@@ -888,20 +1263,83 @@ class SQLStatement(object):
             return self.obfuscated
 
 
-_sql_statements = weakref.WeakValueDictionary()
+class SQLStatementCache(object):
 
+    """Process wide cache of SQLStatement objects keyed by the SQL and the
+    database module. Holding on to the statements means the obfuscated and
+    normalized forms of a query, which are expensive to compute, are worked
+    out once rather than on every request which makes the same query.
 
-def sql_statement(sql, dbapi2_module):
-    key = (sql, dbapi2_module)
+    The cache is bounded to max_size entries, and SQL longer than
+    max_sql_length is not cached at all, so that queries with inlined
+    values can't grow it without limit. Counts of hits and misses are
+    kept for reporting as supportability metrics. They are updated
+    without a lock, so are approximate when there are concurrent threads.
+
+    """
+
+    def __init__(self, max_size, max_sql_length):
+        self._cache = BoundedCache(max_size)
+        self._max_sql_length = max_sql_length
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, sql, dbapi2_module):
+        key = (sql, dbapi2_module)
 
-    result = _sql_statements.get(key, None)
+        result = self._cache.get(key)
+
+        if result is not None:
+            self._hits += 1
+            return result
+
+        self._misses += 1
+
+        database = SQLDatabase(dbapi2_module)
+        result = SQLStatement(sql, database)
+
+        if len(sql) <= self._max_sql_length:
+            self._cache[key] = result
 
-    if result is not None:
         return result
 
-    database = SQLDatabase(dbapi2_module)
-    result = SQLStatement(sql, database)
+    def stats(self):
+        """Returns the number of hits and misses since the last call. The
+        counts are reset on each call.
+
+        """
+
+        hits, misses = self._hits, self._misses
+        self._hits, self._misses = 0, 0
+
+        return hits, misses
+
+
+_sql_statements = None
+
+
+def _sql_statement_cache():
+    global _sql_statements
+
+    # The cache is created on first use so that the size limits are
+    # taken from the agent configuration once it has been loaded.
+
+    if _sql_statements is None:
+        settings = global_settings()
+        _sql_statements = SQLStatementCache(
+            settings.agent_limits.sql_statement_cache_size,
+            settings.agent_limits.sql_query_length_maximum,
+        )
+
+    return _sql_statements
+
+
+def sql_statement(sql, dbapi2_module):
+    return _sql_statement_cache().get(sql, dbapi2_module)
 
-    _sql_statements[key] = result
 
-    return result
+def sql_statement_cache_stats():
+    return _sql_statement_cache().stats()
@@ -28,6 +28,7 @@ from newrelic.common.system_info import (
     physical_processor_count,
     total_physical_memory,
 )
+from newrelic.core.connect_cache import connect_cache, interpreter_key
 
 # try:
 #     import pkg_resources
@@ -216,6 +217,21 @@ def environment_settings():
 
     plugins = []
 
+    # Looking up the versions of the packages is slow, so where enabled,
+    # the versions found are cached for the same interpreter and set of
+    # installed packages. Packages for which no version could be found
+    # are cached as None.
+
+    cache = connect_cache()
+
+    if cache is not None:
+        cache_key = interpreter_key()
+        versions = cache.get("plugin_versions", cache_key, {})
+    else:
+        versions = {}
+
+    versions_found = len(versions)
+
     # Using any iterable to create a snapshot of sys.modules can occassionally
     # fail in a rare case when modules are imported in parallel by different
     # threads.
@@ -241,11 +257,19 @@ def environment_settings():
         ):
             continue
 
-        try:
-            version = get_version(name)
+        if name not in versions:
+            try:
+                versions[name] = str(get_version(name))
+            except Exception:
+                versions[name] = None
+
+        version = versions[name]
+
+        if version is not None:
             plugins.append("%s (%s)" % (name, version))
-        except Exception:
-            pass
+
+    if cache is not None and len(versions) != versions_found:
+        cache.set("plugin_versions", cache_key, versions)
 
     env.append(("Plugin List", plugins))
 
@@ -0,0 +1,322 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a bounded on disk spool for requests to the data
+collector which failed to be sent, so that they can be sent once the data
+collector can be reached again, including by a later process.
+
+"""
+
+import itertools
+import logging
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+
+from newrelic.common.encoding_utils import json_decode, json_encode
+
+_logger = logging.getLogger(__name__)
+
+_RECORD_HEADER = struct.Struct(">I")
+
+_OPEN_SUFFIX = ".tmp"
+_SEGMENT_SUFFIX = ".seg"
+_CLAIMED_SUFFIX = ".replay"
+
+_segment_ids = itertools.count()
+
+
+class HarvestSpool(object):
+
+    """Spool of requests held in a directory of append only segment files.
+
+    Requests are appended to a segment file private to the spool object,
+    which only becomes visible to replay once it is closed, either on
+    reaching segment_size bytes, or when flush() is called. When a segment
+    is closed, the oldest segments are removed until the spool is no more
+    than max_size bytes, as are any segments older than max_age seconds.
+
+    Segments are replayed oldest first. A segment is claimed for replay by
+    renaming it, so where several processes share the directory, each
+    segment is only replayed by one of them. Segments are read using mmap,
+    with only the request being sent needing to be decoded at any time.
+    Requests in a segment which were not sent are returned to the spool
+    under the original name and modification time of the segment, so that
+    they keep their place in the replay order and still expire.
+
+    Each record in a segment is the JSON encoding of the method and the
+    payload of the request, prefixed by its length as a 4 byte big endian
+    unsigned integer.
+
+    """
+
+    def __init__(self, directory, max_size, segment_size, max_age):
+        self.directory = directory
+        self.max_size = max_size
+        self.segment_size = segment_size
+        self.max_age = max_age
+
+        self._segment = None
+        self._segment_bytes = 0
+
+        self._lock = threading.RLock()
+
+    def write(self, method, payload):
+        """Appends a request to the spool. Returns False if the request
+        could not be written to the spool.
+
+        """
+
+        with self._lock:
+            return self._write(method, payload)
+
+    def _write(self, method, payload):
+        record = json_encode((method, payload)).encode("utf-8")
+        size = _RECORD_HEADER.size + len(record)
+
+        if size > self.max_size:
+            return False
+
+        try:
+            if self._segment is not None and self._segment_bytes + size > self.segment_size:
+                self._flush()
+
+            if self._segment is None:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory, 0o700)
+
+                # Naming segments after the time they were created means
+                # they sort oldest first.
+
+                name = "%016d-%d-%09d" % (int(time.time() * 1000), os.getpid(), next(_segment_ids))
+
+                self._segment = os.path.join(self.directory, name)
+                self._segment_bytes = 0
+
+            with open(self._segment + _OPEN_SUFFIX, "ab") as fp:
+                fp.write(_RECORD_HEADER.pack(len(record)))
+                fp.write(record)
+
+            self._segment_bytes += size
+
+        except (IOError, OSError):
+            _logger.exception("Unable to write a request for %r to the harvest spool in %r.", method, self.directory)
+
+            return False
+
+        return True
+
+    def flush(self):
+        """Closes the segment being written to, making it available to be
+        replayed, and removes segments to bring the spool within bounds.
+
+        """
+
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        segment, self._segment = self._segment, None
+
+        if segment is not None:
+            try:
+                os.rename(segment + _OPEN_SUFFIX, segment + _SEGMENT_SUFFIX)
+            except (IOError, OSError):
+                _logger.exception("Unable to close the harvest spool segment %r.", segment)
+
+        # Segments returned to the spool by replay keep their original
+        # age, so expired ones are removed even if nothing new was added.
+
+        self._prune()
+
+    def _prune(self):
+        try:
+            names = sorted(os.listdir(self.directory))
+        except (IOError, OSError):
+            return
+
+        expires = time.time() - self.max_age
+
+        segments = []
+
+        for name in names:
+            path = os.path.join(self.directory, name)
+
+            try:
+                stat = os.stat(path)
+            except (IOError, OSError):
+                continue
+
+            # Segments left open or claimed by a process which has since
+            # exited are only removed once they have expired.
+
+            if name.endswith(_SEGMENT_SUFFIX) and stat.st_mtime >= expires:
+                segments.append((path, stat.st_size))
+
+            elif stat.st_mtime < expires and name.endswith((_SEGMENT_SUFFIX, _OPEN_SUFFIX, _CLAIMED_SUFFIX)):
+                self._remove(path)
+
+        total = sum(size for _, size in segments)
+
+        for path, size in segments:
+            if total <= self.max_size:
+                break
+
+            _logger.debug("Removing harvest spool segment %r as the spool is full.", path)
+
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except (IOError, OSError):
+            pass
+
+    def segments(self):
+        """Returns the paths of the segments waiting to be replayed, oldest
+        first.
+
+        """
+
+        try:
+            names = sorted(os.listdir(self.directory))
+        except (IOError, OSError):
+            return []
+
+        return [os.path.join(self.directory, name) for name in names if name.endswith(_SEGMENT_SUFFIX)]
+
+    @staticmethod
+    def _read_segment(path):
+        with open(path, "rb") as fp:
+            size = os.fstat(fp.fileno()).st_size
+
+            if not size:
+                return
+
+            view = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                offset = 0
+
+                while offset + _RECORD_HEADER.size <= size:
+                    start = offset
+
+                    (length,) = _RECORD_HEADER.unpack_from(view, offset)
+                    offset += _RECORD_HEADER.size
+
+                    # A record which was only partly written, such as
+                    # when the process was killed, ends the segment.
+
+                    if offset + length > size:
+                        break
+
+                    record = view[offset : offset + length]
+                    offset += length
+
+                    try:
+                        method, payload = json_decode(record.decode("utf-8"))
+                    except ValueError:
+                        continue
+
+                    yield start, method, payload
+
+            finally:
+                view.close()
+
+    def _restore(self, claimed, path, offset):
+        """Returns the records from offset onwards in a claimed segment to
+        the spool as the segment at path, keeping the modification time of
+        the claimed segment.
+
+        """
+
+        try:
+            if offset:
+                stat = os.stat(claimed)
+                remaining = claimed + _OPEN_SUFFIX
+
+                with open(claimed, "rb") as source, open(remaining, "wb") as target:
+                    source.seek(offset)
+                    shutil.copyfileobj(source, target)
+
+                os.utime(remaining, (stat.st_atime, stat.st_mtime))
+                os.rename(remaining, path)
+                os.remove(claimed)
+
+            else:
+                os.rename(claimed, path)
+
+        except (IOError, OSError):
+            _logger.exception("Unable to return the harvest spool segment %r to the spool.", path)
+
+    def replay(self, send, limit=None):
+        """Replays the requests held in the spool, oldest first, by calling
+        send(method, payload) for each, with up to limit requests being
+        sent. If sending a request fails, the request and any remaining
+        from the same segment are returned to the spool and the exception
+        is raised. Returns the number of requests sent.
+
+        """
+
+        # Make the requests spooled by this process available to be
+        # replayed along with all the others.
+
+        self.flush()
+
+        sent = 0
+
+        for path in self.segments():
+            if limit is not None and sent >= limit:
+                break
+
+            claimed = "%s.%d%s" % (path[: -len(_SEGMENT_SUFFIX)], os.getpid(), _CLAIMED_SUFFIX)
+
+            try:
+                os.rename(path, claimed)
+            except (IOError, OSError):
+                # Another process has claimed the segment.
+
+                continue
+
+            records = self._read_segment(claimed)
+            unsent = None
+
+            try:
+                for offset, method, payload in records:
+                    if limit is not None and sent >= limit:
+                        unsent = offset
+                        break
+
+                    try:
+                        send(method, payload)
+                    except Exception:
+                        unsent = offset
+                        raise
+
+                    sent += 1
+
+            finally:
+                records.close()
+
+                if unsent is None:
+                    self._remove(claimed)
+                else:
+                    self._restore(claimed, path, unsent)
+
+        return sent
@@ -97,6 +97,17 @@ class GenericNodeMixin(object):
                     attr_class=attr_class):
                 yield event
 
+    def span_count(self):
+        """Returns the number of span events span_events() would yield,
+        without creating them.
+
+        """
+
+        count = 1
+        for child in self.children:
+            count += child.span_count()
+        return count
+
 
 class DatastoreNodeMixin(GenericNodeMixin):
 
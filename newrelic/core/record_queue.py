@@ -0,0 +1,233 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a bounded queue of completed transactions. When
+enabled, the transaction node generated at the end of a transaction is
+placed on the queue and a background aggregator thread takes care of
+distilling it into metrics and merging it into the stats engine of the
+application. This moves that work off the thread which handled the
+request.
+
+"""
+
+import collections
+import logging
+import random
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP = "drop"
+OVERFLOW_SAMPLE = "sample"
+OVERFLOW_BLOCK = "block"
+
+OVERFLOW_POLICIES = (OVERFLOW_DROP, OVERFLOW_SAMPLE, OVERFLOW_BLOCK)
+
+
+class TransactionRecordQueue(object):
+
+    """Queue of transaction nodes waiting to be recorded. The supplied
+    record function is called from the aggregator thread for each node
+    taken off the queue.
+
+    When the queue is full, what happens to a new node is dictated by the
+    overflow policy:
+
+        drop   - The new node is discarded.
+        sample - The new node replaces the lowest priority node on the
+                 queue if it has a higher priority, otherwise it is
+                 discarded. This favours keeping transactions which were
+                 sampled. Nodes without a priority are given a random one.
+        block  - The caller waits until there is space on the queue.
+
+    """
+
+    def __init__(self, name, record, maxlen, overflow_policy=OVERFLOW_DROP):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError("Invalid overflow policy %r." % overflow_policy)
+
+        self._record = record
+        self._maxlen = max(maxlen, 1)
+        self._overflow_policy = overflow_policy
+        # Entries on the queue are (priority, node) pairs. The priority
+        # is only filled in when the sample overflow policy is in use.
+
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._drained = threading.Condition(self._lock)
+        self._in_progress = 0
+        self._shutdown = False
+
+        self._seen = 0
+        self._dropped = 0
+        self._max_depth = 0
+
+        self._thread = threading.Thread(target=self._run, name="NR-Record-Queue/%s" % name)
+        self._thread.daemon = True
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def overflow_policy(self):
+        return self._overflow_policy
+
+    def start(self):
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def put(self, node):
+        """Adds a transaction node to the queue. Returns True if the node
+        was queued and False if it was discarded.
+
+        """
+
+        with self._lock:
+            if self._shutdown:
+                return False
+
+            self._seen += 1
+
+            priority = None
+
+            if self._overflow_policy == OVERFLOW_SAMPLE:
+                priority = node.priority
+                if priority is None:
+                    priority = random.random()  # nosec
+
+            if len(self._queue) >= self._maxlen:
+                if self._overflow_policy == OVERFLOW_BLOCK:
+                    while len(self._queue) >= self._maxlen and not self._shutdown:
+                        self._not_full.wait()
+
+                    if self._shutdown:
+                        self._dropped += 1
+                        return False
+
+                elif self._overflow_policy == OVERFLOW_SAMPLE:
+                    self._dropped += 1
+
+                    index, lowest = min(enumerate(self._queue), key=lambda item: item[1][0])
+
+                    if priority <= lowest[0]:
+                        return False
+
+                    del self._queue[index]
+
+                else:
+                    self._dropped += 1
+                    return False
+
+            self._queue.append((priority, node))
+
+            depth = len(self._queue)
+            if depth > self._max_depth:
+                self._max_depth = depth
+
+            # Only wake the aggregator thread if it is waiting for work.
+            # If it is busy recording it will pick up the new node when
+            # it next checks the queue.
+
+            if depth == 1:
+                self._not_empty.notify()
+
+            return True
+
+    def stats(self):
+        """Returns the number of nodes seen, the number dropped and the
+        greatest depth the queue reached since the last call. The counts
+        are reset on each call.
+
+        """
+
+        with self._lock:
+            seen, dropped, max_depth = self._seen, self._dropped, self._max_depth
+            self._seen, self._dropped, self._max_depth = 0, 0, len(self._queue)
+
+        return seen, dropped, max_depth
+
+    def flush(self, timeout=None):
+        """Waits until all nodes placed on the queue so far have been
+        recorded. Returns False if the timeout expired first.
+
+        """
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with self._lock:
+            while (self._queue or self._in_progress) and self._thread.is_alive():
+                if timeout is None:
+                    self._drained.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0.0:
+                        return False
+                    self._drained.wait(remaining)
+
+        return not self._queue
+
+    def shutdown(self, timeout=None):
+        """Records any nodes still on the queue and stops the aggregator
+        thread. Nodes added after this point are discarded.
+
+        """
+
+        self.flush(timeout)
+
+        with self._lock:
+            self._shutdown = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._shutdown:
+                    self._not_empty.wait()
+
+                if not self._queue:
+                    return
+
+                # Take everything queued so far as a single batch so
+                # that the lock is only acquired once for the lot.
+
+                batch, self._queue = self._queue, collections.deque()
+                self._in_progress = len(batch)
+                self._not_full.notify_all()
+
+            for _, node in batch:
+                try:
+                    self._record(node)
+                except Exception:
+                    _logger.exception(
+                        "The recording of transaction data from the "
+                        "record queue has failed. This would indicate some "
+                        "sort of internal implementation issue with the "
+                        "agent. Please report this problem to New Relic "
+                        "support for further investigation."
+                    )
+
+            with self._lock:
+                self._in_progress = 0
+                if not self._queue:
+                    self._drained.notify_all()
@@ -15,11 +15,18 @@
 import re
 from collections import namedtuple
 
+from newrelic.common.bounded_cache import BoundedCache
+
 _NormalizationRule = namedtuple(
     "_NormalizationRule",
     ["match_expression", "replacement", "ignore", "eval_order", "terminate_chain", "each_segment", "replace_all"],
 )
 
+# Matches a back reference to a numbered group, such as \1, or a conditional
+# on one, such as (?(1)...).
+
+_NUMBERED_GROUP_REFERENCE_RE = re.compile(r"\\[1-9]|\(\?\(\d")
+
 
 class NormalizationRule(_NormalizationRule):
     def __init__(self, *args, **kwargs):
@@ -34,7 +41,17 @@ class NormalizationRule(_NormalizationRule):
 
 
 class RulesEngine(object):
-    def __init__(self, rules):
+    """Applies the normalization rules supplied by the data collector to
+    a name. The rules are compiled into a tuple of plain values so they
+    can be applied without repeated attribute lookups, and when none of
+    the rules apply to individual segments they are also fused into a
+    single regular expression used to detect, in one search, names which
+    no rule will match. Results are memoised in a cache holding at most
+    cache_size entries.
+
+    """
+
+    def __init__(self, rules, cache_size=1000):
         self.__rules = []
 
         for rule in rules:
@@ -46,11 +63,61 @@ class RulesEngine(object):
 
         self.__rules = sorted(self.__rules, key=lambda rule: rule.eval_order)
 
+        self.__compiled = tuple(
+            (
+                rule.match_expression_re.subn,
+                rule.replacement,
+                0 if rule.replace_all else 1,
+                bool(rule.each_segment),
+                bool(rule.ignore),
+                bool(rule.terminate_chain),
+            )
+            for rule in self.__rules
+        )
+
+        self.__prefilter = self._compile_prefilter(self.__rules)
+        self.__cache = BoundedCache(cache_size)
+
     @property
     def rules(self):
         return self.__rules
 
+    @staticmethod
+    def _compile_prefilter(rules):
+        # A rule applied to each segment may match a segment without its
+        # expression matching anywhere in the full name, for example if
+        # it is anchored, so a prefilter is only possible when there are
+        # no such rules. If none of the expressions match the original
+        # name then no rule can change it, and so neither can a later
+        # rule match. Combining the expressions renumbers their groups,
+        # so a back reference to a numbered group, or a conditional on
+        # one, would refer to a group of another expression. Such rules,
+        # and expressions which otherwise can't be combined, disable the
+        # prefilter.
+
+        if not rules or any(rule.each_segment for rule in rules):
+            return None
+
+        if any(_NUMBERED_GROUP_REFERENCE_RE.search(rule.match_expression) for rule in rules):
+            return None
+
+        pattern = "|".join("(?:%s)" % rule.match_expression for rule in rules)
+
+        try:
+            return re.compile(pattern, re.IGNORECASE).search
+        except Exception:
+            return None
+
     def normalize(self, string):
+        result = self.__cache.get(string)
+
+        if result is None:
+            result = self._normalize(string)
+            self.__cache[string] = result
+
+        return result
+
+    def _normalize(self, string):
         # URLs are supposed to be ASCII but can get a
         # URL with illegal non ASCII characters. As the
         # rule patterns and replacements are Unicode
@@ -63,13 +130,27 @@ class RulesEngine(object):
         if isinstance(string, bytes):
             string = string.decode("Latin-1")
 
+        if not self.__compiled:
+            return (string, False)
+
+        if self.__prefilter is not None and not self.__prefilter(string):
+            return (string, False)
+
         final_string = string
         ignore = False
-        for rule in self.__rules:
-            if rule.each_segment:
+
+        # The segments of the name are only split out again once a rule
+        # which isn't applied to each segment has changed the name, so
+        # consecutive segment rules share the one split.
+
+        segments = None
+
+        for subn, replacement, count, each_segment, rule_ignore, terminate_chain in self.__compiled:
+            if each_segment:
                 matched = False
 
-                segments = final_string.split("/")
+                if segments is None:
+                    segments = final_string.split("/")
 
                 # FIXME This fiddle is to skip leading segment
                 # when splitting on '/' where it is empty.
@@ -78,28 +159,30 @@ class RulesEngine(object):
                 # but not matched. Wouldn't then have to treat
                 # this as special.
 
-                if segments and not segments[0]:
-                    rule_segments = [""]
-                    segments = segments[1:]
-                else:
-                    rule_segments = []
+                start = 1 if not segments[0] else 0
+                resplit = False
 
-                for segment in segments:
-                    rule_segment, match_count = rule.apply(segment)
-                    matched = matched or (match_count > 0)
-                    rule_segments.append(rule_segment)
+                for index in range(start, len(segments)):
+                    segment, match_count = subn(replacement, segments[index], count)
+                    if match_count > 0:
+                        matched = True
+                        segments[index] = segment
+                        resplit = resplit or "/" in segment
 
                 if matched:
-                    final_string = "/".join(rule_segments)
+                    final_string = "/".join(segments)
+                    if resplit:
+                        segments = None
             else:
-                rule_string, match_count = rule.apply(final_string)
+                final_string, match_count = subn(replacement, final_string, count)
                 matched = match_count > 0
-                final_string = rule_string
+                if matched:
+                    segments = None
 
             if matched:
-                ignore = ignore or rule.ignore
+                ignore = ignore or rule_ignore
 
-            if matched and rule.terminate_chain:
+            if matched and terminate_chain:
                 break
 
         return (final_string, ignore)
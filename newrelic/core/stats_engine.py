@@ -28,19 +28,21 @@ import sys
 import time
 import warnings
 import zlib
+from array import array
+from collections import namedtuple
 from heapq import heapify, heapreplace
 
 import newrelic.packages.six as six
 from newrelic.api.settings import STRIP_EXCEPTION_MESSAGE
 from newrelic.api.time_trace import get_linking_metadata
-from newrelic.common.encoding_utils import json_encode
+from newrelic.common.encoding_utils import json_encode, json_encode_chunks
 from newrelic.common.object_names import parse_exc_info
 from newrelic.common.streaming_utils import StreamBuffer
 from newrelic.core.attribute import create_user_attributes, process_user_attribute, truncate, MAX_LOG_MESSAGE_LENGTH
 from newrelic.core.attribute_filter import DST_ERROR_COLLECTOR
 from newrelic.core.code_level_metrics import extract_code_from_traceback
 from newrelic.core.config import is_expected_error, should_ignore_error
-from newrelic.core.database_utils import explain_plan
+from newrelic.core.database_utils import ExplainPlanExecutor, explain_plan
 from newrelic.core.error_collector import TracedError
 from newrelic.core.metric import TimeMetric
 from newrelic.core.stack_trace import exception_stack
@@ -64,6 +66,35 @@ def c2t(count=0, total=0.0, min=0.0, max=0.0, sum_of_squares=0.0):
     return (count, total, total, min, max, sum_of_squares)
 
 
+# The depth to which the transaction trace payload is walked when it is
+# encoded, which is that of the top level segments of the trace in
+# [RootNode(root=TraceNode(children=[TraceNode(children=[...])])), strings].
+# Each top level segment, including its children, is encoded in one go.
+
+TRACE_ENCODE_DEPTH = 6
+
+
+def _pack_trace_data(data, level, depth=TRACE_ENCODE_DEPTH):
+    """Returns data JSON encoded, compressed and then base64 encoded. The
+    JSON is fed to the compressor in chunks as it is produced, so the
+    JSON for a large transaction trace is never held in memory all at
+    once.
+
+    """
+
+    compressor = zlib.compressobj(level)
+
+    zlib_data = [compressor.compress(chunk) for chunk in json_encode_chunks(data, depth=depth)]
+    zlib_data.append(compressor.flush())
+
+    pack_data = base64.standard_b64encode(b"".join(zlib_data))
+
+    if six.PY3:
+        pack_data = pack_data.decode("Latin-1")
+
+    return pack_data
+
+
 class ApdexStats(list):
 
     """Bucket for accumulating apdex metrics."""
@@ -182,6 +213,361 @@ class CountStats(TimeStats):
         pass
 
 
+# Kinds of stats held in a row of a MetricTable. These determine how the
+# values for a row are merged, mirroring the merge_stats() methods of the
+# TimeStats, ApdexStats and CountStats classes.
+
+_KIND_TIME = 0
+_KIND_APDEX = 1
+_KIND_COUNT = 2
+
+# Minimum number of rows which need to be merged between two metric tables
+# before NumPy, if it is available, is used to merge the rows in bulk.
+
+NUMPY_MERGE_THRESHOLD = 64
+
+_numpy = None
+
+
+def _import_numpy():
+    # NumPy is imported lazily so there is no cost in importing it unless
+    # a columnar metric table is actually in use.
+
+    global _numpy
+
+    if _numpy is None:
+        try:
+            import numpy
+
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+
+    return _numpy
+
+
+def _stats_kind(stats):
+    if isinstance(stats, MetricTableRow):
+        return stats.kind
+    if isinstance(stats, ApdexStats):
+        return _KIND_APDEX
+    if isinstance(stats, CountStats):
+        return _KIND_COUNT
+    return _KIND_TIME
+
+
+class MetricTableRow(object):
+
+    """View of a single row of a metric table. Provides the same accessors
+    and merge methods as the stats object held for the metric so that it
+    can be used in place of one. Any merge is applied directly to the
+    columns of the table.
+
+    """
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __len__(self):
+        return 6
+
+    def __getitem__(self, index):
+        return self._table._row_values(self._row)[index]
+
+    def __iter__(self):
+        return iter(self._table._row_values(self._row))
+
+    def __repr__(self):
+        return repr(self._table._stats(self._row))
+
+    @property
+    def kind(self):
+        return self._table._kind[self._row]
+
+    call_count = satisfying = property(operator.itemgetter(0))
+    total_call_time = tolerating = property(operator.itemgetter(1))
+    total_exclusive_call_time = frustrating = property(operator.itemgetter(2))
+    min_call_time = property(operator.itemgetter(3))
+    max_call_time = property(operator.itemgetter(4))
+    sum_of_squares = property(operator.itemgetter(5))
+
+    def merge_stats(self, other):
+        self._table._merge_row(self._row, other)
+
+    def merge_raw_time_metric(self, duration, exclusive=None):
+        self._table._merge_raw_time_metric(self._row, duration, exclusive)
+
+    def merge_time_metric(self, metric):
+        self._table._merge_raw_time_metric(self._row, metric.duration, metric.exclusive)
+
+    def merge_custom_metric(self, value):
+        self._table._merge_raw_time_metric(self._row, value)
+
+    def merge_apdex_metric(self, metric):
+        self._table._merge_row(
+            self._row, (metric.satisfying, metric.tolerating, metric.frustrating, metric.apdex_t, metric.apdex_t, 0)
+        )
+
+
+class MetricTable(object):
+
+    """Columnar alternative to the dictionary used as the metric stats table
+    of the stats engine. Each (name, scope) key is interned to an integer
+    row index and the six values for the metric are held in contiguous
+    array('d') buffers, one per value, rather than as a list of Python
+    floats per metric. This substantially reduces the memory used where
+    there are many unique metrics, and allows two tables to be merged a
+    column at a time.
+
+    The table supports the subset of the dictionary interface used by the
+    stats engine. Looking up a key returns a MetricTableRow view which can
+    be merged into, while iterating over items returns copies of the stats
+    as TimeStats, ApdexStats or CountStats objects.
+
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._keys = []
+        self._kind = array("b")
+        self._columns = tuple(array("d") for _ in range(6))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __getitem__(self, key):
+        return MetricTableRow(self, self._index[key])
+
+    def __setitem__(self, key, stats):
+        row = self._index.get(key)
+
+        if row is None:
+            self._append_row(key, _stats_kind(stats), stats)
+        else:
+            self._kind[row] = _stats_kind(stats)
+            for column, value in zip(self._columns, stats):
+                column[row] = value
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        row = self._index.get(key)
+        if row is None:
+            return default
+        return MetricTableRow(self, row)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [self._stats(row) for row in range(len(self._keys))]
+
+    def items(self):
+        return [(key, self._stats(row)) for row, key in enumerate(self._keys)]
+
+    def iterkeys(self):
+        return iter(self._keys)
+
+    def itervalues(self):
+        return (self._stats(row) for row in range(len(self._keys)))
+
+    def iteritems(self):
+        return ((key, self._stats(row)) for row, key in enumerate(self._keys))
+
+    def merge_stats(self, key, stats):
+        """Merges a stats object into the row for the key, creating the
+        row if it does not already exist.
+
+        """
+
+        row = self._index.get(key)
+
+        if row is None:
+            self._append_row(key, _stats_kind(stats), stats)
+        else:
+            self._merge_row(row, stats)
+
+    def merge_table(self, other):
+        """Merges all rows from another metric table into this one."""
+
+        index = self._index
+
+        new_rows = []
+        merge_rows = []
+        merge_other_rows = []
+
+        for other_row, key in enumerate(other._keys):
+            row = index.get(key)
+            if row is None:
+                new_rows.append(other_row)
+            else:
+                merge_rows.append(row)
+                merge_other_rows.append(other_row)
+
+        if merge_rows:
+            numpy = len(merge_rows) >= NUMPY_MERGE_THRESHOLD and _import_numpy()
+
+            if numpy:
+                self._merge_rows_numpy(numpy, other, merge_rows, merge_other_rows)
+            else:
+                columns = other._columns
+                for row, other_row in zip(merge_rows, merge_other_rows):
+                    self._merge_row(row, [column[other_row] for column in columns])
+
+        if new_rows:
+            start = len(self._keys)
+
+            for offset, other_row in enumerate(new_rows):
+                key = other._keys[other_row]
+                index[key] = start + offset
+                self._keys.append(key)
+
+            self._kind.extend(other._kind[other_row] for other_row in new_rows)
+
+            for column, other_column in zip(self._columns, other._columns):
+                column.extend(other_column[other_row] for other_row in new_rows)
+
+    def metric_data(self):
+        """Returns a list of the metric data in the form it is sent to the
+        data collector, built from the columns without creating stats
+        objects for each row.
+
+        """
+
+        return [
+            (dict(name=key[0], scope=key[1]), self._values(kind, values))
+            for key, kind, values in zip(self._keys, self._kind, zip(*(column.tolist() for column in self._columns)))
+        ]
+
+    def _append_row(self, key, kind, stats):
+        self._index[key] = len(self._keys)
+        self._keys.append(key)
+        self._kind.append(kind)
+        for column, value in zip(self._columns, stats):
+            column.append(value)
+
+    @staticmethod
+    def _values(kind, values):
+        values = list(values)
+
+        # The counts are held as floats in the columns so convert them
+        # back to integers as they would be in the stats objects.
+
+        if kind == _KIND_APDEX:
+            values[0:3] = [int(value) for value in values[0:3]]
+        else:
+            values[0] = int(values[0])
+
+        return values
+
+    def _row_values(self, row):
+        return self._values(self._kind[row], [column[row] for column in self._columns])
+
+    def _stats(self, row):
+        kind = self._kind[row]
+
+        if kind == _KIND_APDEX:
+            stats = ApdexStats()
+        elif kind == _KIND_COUNT:
+            stats = CountStats()
+        else:
+            stats = TimeStats()
+
+        stats[:] = self._values(kind, [column[row] for column in self._columns])
+
+        return stats
+
+    def _merge_row(self, row, other):
+        c0, c1, c2, c3, c4, c5 = self._columns
+        kind = self._kind[row]
+
+        if kind == _KIND_TIME:
+            c1[row] += other[1]
+            c2[row] += other[2]
+            c3[row] = c0[row] and min(c3[row], other[3]) or other[3]
+            c4[row] = max(c4[row], other[4])
+            c5[row] += other[5]
+            c0[row] += other[0]
+
+        elif kind == _KIND_APDEX:
+            c0[row] += other[0]
+            c1[row] += other[1]
+            c2[row] += other[2]
+            c3[row] = (c0[row] or c1[row] or c2[row]) and min(c3[row], other[3]) or other[3]
+            c4[row] = max(c4[row], other[3])
+
+        else:
+            c0[row] += other[0]
+
+    def _merge_raw_time_metric(self, row, duration, exclusive=None):
+        if self._kind[row] != _KIND_TIME:
+            return
+
+        if exclusive is None:
+            exclusive = duration
+
+        c0, c1, c2, c3, c4, c5 = self._columns
+
+        c1[row] += duration
+        c2[row] += exclusive
+        c3[row] = c0[row] and min(c3[row], duration) or duration
+        c4[row] = max(c4[row], duration)
+        c5[row] += duration**2
+        c0[row] += 1
+
+    def _merge_rows_numpy(self, numpy, other, rows, other_rows):
+        # The arrays are wrapped rather than copied so the updates are
+        # made directly to the underlying buffers. The wrappers must not
+        # outlive this call else the arrays can no longer be extended.
+
+        rows = numpy.array(rows, dtype=numpy.intp)
+        other_rows = numpy.array(other_rows, dtype=numpy.intp)
+
+        kinds = numpy.frombuffer(self._kind, dtype=numpy.int8)[rows]
+        columns = [numpy.frombuffer(column, dtype=numpy.float64) for column in self._columns]
+        others = [numpy.frombuffer(column, dtype=numpy.float64)[other_rows] for column in other._columns]
+
+        c0, c1, c2, c3, c4, c5 = columns
+
+        mask = kinds == _KIND_TIME
+        if mask.any():
+            r = rows[mask]
+            o0, o1, o2, o3, o4, o5 = [values[mask] for values in others]
+            c1[r] += o1
+            c2[r] += o2
+            minimum = numpy.minimum(c3[r], o3)
+            c3[r] = numpy.where((c0[r] != 0) & (minimum != 0), minimum, o3)
+            c4[r] = numpy.maximum(c4[r], o4)
+            c5[r] += o5
+            c0[r] += o0
+
+        mask = kinds == _KIND_APDEX
+        if mask.any():
+            r = rows[mask]
+            o0, o1, o2, o3 = [values[mask] for values in others[:4]]
+            c0[r] += o0
+            c1[r] += o1
+            c2[r] += o2
+            minimum = numpy.minimum(c3[r], o3)
+            seen = (c0[r] != 0) | (c1[r] != 0) | (c2[r] != 0)
+            c3[r] = numpy.where(seen & (minimum != 0), minimum, o3)
+            c4[r] = numpy.maximum(c4[r], o3)
+
+        mask = kinds == _KIND_COUNT
+        if mask.any():
+            c0[rows[mask]] += others[0][mask]
+
+
 class CustomMetrics(object):
 
     """Table for collection a set of value metrics."""
@@ -220,6 +606,19 @@ class CustomMetrics(object):
 
         return six.iteritems(self.__stats_table)
 
+    def merge_metrics(self, metrics):
+        """Merges in the set of value metrics from an iterable of tuples
+        of the metric name and accumulated stats, as returned by metrics().
+
+        """
+
+        for name, other in metrics:
+            stats = self.__stats_table.get(name)
+            if stats is None:
+                self.__stats_table[name] = copy.copy(other)
+            else:
+                stats.merge_stats(other)
+
     def reset_metric_stats(self):
         """Resets the accumulated statistics back to initial state for
         metric data.
@@ -228,6 +627,75 @@ class CustomMetrics(object):
         self.__stats_table = {}
 
 
+# Stand ins for the stats engine and transaction node passed to the
+# time_metrics() method of a node which is being folded while the
+# transaction is still running. The final name of the transaction is not
+# known at that point, so metrics scoped to the transaction are recorded
+# against a placeholder scope which is replaced when the metrics are merged
+# into the stats engine.
+
+_FoldedStats = namedtuple("_FoldedStats", ["settings"])
+_FoldedRoot = namedtuple("_FoldedRoot", ["path", "type"])
+
+_TRANSACTION_SCOPE = object()
+
+
+class FoldedTimeMetrics(object):
+
+    """Table for collecting the time metrics of segments of a transaction
+    which were not kept as nodes, so as to bound the memory used by
+    transactions with very large numbers of segments.
+
+    """
+
+    def __init__(self):
+        self.__stats_table = {}
+        self.__node_count = 0
+
+    def __len__(self):
+        return self.__node_count
+
+    def record_node(self, node, settings, transaction_type):
+        """Record the time metrics of a node, merging the data with any
+        data from prior time metrics with the same name and scope. The
+        transaction type is needed for the rollup metrics of the node.
+
+        """
+
+        stats = _FoldedStats(settings=settings)
+        root = _FoldedRoot(path=_TRANSACTION_SCOPE, type=transaction_type)
+
+        for metric in node.time_metrics(stats, root, None):
+            key = (metric.name, metric.scope or "")
+            stats = self.__stats_table.get(key)
+            if stats is None:
+                self.__stats_table[key] = TimeStats(
+                    call_count=1,
+                    total_call_time=metric.duration,
+                    total_exclusive_call_time=metric.exclusive,
+                    min_call_time=metric.duration,
+                    max_call_time=metric.duration,
+                    sum_of_squares=metric.duration**2,
+                )
+            else:
+                stats.merge_time_metric(metric)
+
+        self.__node_count += 1
+
+    def metrics(self, scope):
+        """Returns an iterator over the set of time metrics. The items
+        returned are a tuple consisting of the metric key and accumulated
+        stats for the metric. Metrics scoped to the transaction are given
+        the supplied scope.
+
+        """
+
+        for (name, metric_scope), stats in six.iteritems(self.__stats_table):
+            if metric_scope is _TRANSACTION_SCOPE:
+                metric_scope = scope
+            yield (name, metric_scope), stats
+
+
 class SlowSqlStats(list):
     def __init__(self):
         super(SlowSqlStats, self).__init__([0, 0, 0, 0, None])
@@ -271,6 +739,50 @@ class SlowSqlStats(list):
         self[0] += 1
 
 
+class SlowSqlTable(dict):
+
+    """Dictionary of SlowSqlStats keyed by SQL identifier, holding at most
+    maximum entries. Once full, a new SQL statement is only added if it is
+    slower than the fastest of those held, which is then evicted. The
+    table thus always holds the slowest distinct SQL statements seen so
+    far, whatever order they are seen in.
+
+    """
+
+    def __init__(self, maximum):
+        super(SlowSqlTable, self).__init__()
+        self.maximum = maximum
+
+        # A lower bound on the smallest max_call_time of any entry. As
+        # the max_call_time of an entry can only increase, a statement
+        # no slower than this can be rejected without scanning.
+
+        self._threshold = 0.0
+
+    def admit(self, max_call_time):
+        """Returns whether a new entry with the given max_call_time should
+        be added to the table, first evicting the fastest entry if the
+        table is full.
+
+        """
+
+        if len(self) < self.maximum:
+            return True
+
+        if max_call_time <= self._threshold or not self:
+            return False
+
+        fastest = min(self, key=lambda key: self[key].max_call_time)
+        self._threshold = self[fastest].max_call_time
+
+        if max_call_time <= self._threshold:
+            return False
+
+        del self[fastest]
+
+        return True
+
+
 class SampledDataSet(object):
     def __init__(self, capacity=100):
         self.pq = []
@@ -346,6 +858,18 @@ class SampledDataSet(object):
         # call above will add one to self.num_seen each time
         self.num_seen += other_data_set.num_seen - other_data_set.num_samples
 
+    def retain(self, ranges, num_seen):
+        """Keeps only the samples at the positions, in the order they are
+        iterated over, in the (start, end) ranges, along with the number of
+        events seen which they account for. Used where only some of the
+        samples could be sent, so that only those not sent are retried.
+
+        """
+
+        self.pq = [self.pq[index] for start, end in ranges for index in range(start, end)]
+        self.heap = False
+        self.num_seen = num_seen
+
 
 class LimitedDataSet(list):
     def __init__(self, capacity=200):
@@ -394,6 +918,10 @@ class LimitedDataSet(list):
         # call above will add one to self.num_seen each time
         self.num_seen += other_data_set.num_seen - other_data_set.num_samples
 
+    def retain(self, ranges, num_seen):
+        self[:] = [self[index] for start, end in ranges for index in range(start, end)]
+        self.num_seen = num_seen
+
 
 class StatsEngine(object):
 
@@ -432,7 +960,7 @@ class StatsEngine(object):
         self._span_events = SampledDataSet()
         self._log_events = SampledDataSet()
         self._span_stream = None
-        self.__sql_stats_table = {}
+        self.__sql_stats_table = SlowSqlTable(0)
         self.__slow_transaction = None
         self.__slow_transaction_map = {}
         self.__slow_transaction_old_duration = None
@@ -440,6 +968,7 @@ class StatsEngine(object):
         self.__transaction_errors = []
         self._synthetics_events = LimitedDataSet()
         self.__synthetics_transactions = []
+        self._sampling_parent = None
 
     @property
     def settings(self):
@@ -449,6 +978,10 @@ class StatsEngine(object):
     def stats_table(self):
         return self.__stats_table
 
+    @property
+    def sql_stats_table(self):
+        return self.__sql_stats_table
+
     @property
     def transaction_events(self):
         return self._transaction_events
@@ -481,6 +1014,32 @@ class StatsEngine(object):
     def error_events(self):
         return self._error_events
 
+    def _create_stats_table(self):
+        """Returns a new empty metric stats table. This will be a columnar
+        MetricTable if enabled in the settings, otherwise a dictionary.
+
+        """
+
+        settings = self.__settings
+
+        if settings is not None and settings.stats_engine.columnar_metrics:
+            return MetricTable()
+
+        return {}
+
+    def _create_sql_stats_table(self):
+        """Returns a new empty table for slow SQL stats, bounded by the
+        number of slow SQL statements reported per harvest.
+
+        """
+
+        settings = self.__settings
+
+        if settings is None:
+            return SlowSqlTable(0)
+
+        return SlowSqlTable(settings.agent_limits.slow_sql_data)
+
     def metrics_count(self):
         """Returns a count of the number of unique metrics currently
         recorded for apdex, time and value metrics.
@@ -508,8 +1067,10 @@ class StatsEngine(object):
         stats = self.__stats_table.get(key)
         if stats is None:
             stats = ApdexStats(apdex_t=metric.apdex_t)
+            stats.merge_apdex_metric(metric)
             self.__stats_table[key] = stats
-        stats.merge_apdex_metric(metric)
+        else:
+            stats.merge_apdex_metric(metric)
 
         return key
 
@@ -829,12 +1390,11 @@ class StatsEngine(object):
         key = node.identifier
         stats = self.__sql_stats_table.get(key)
         if stats is None:
-            # Only record slow SQL if not already over the limit on
-            # how many can be collected in the harvest period.
+            # Only record slow SQL if it is among the slowest distinct
+            # SQL statements seen in the harvest period, up to the limit
+            # on how many can be collected.
 
-            settings = self.__settings
-            maximum = settings.agent_limits.slow_sql_data
-            if len(self.__sql_stats_table) < maximum:
+            if self.__sql_stats_table.admit(node.duration):
                 stats = SlowSqlStats()
                 self.__sql_stats_table[key] = stats
 
@@ -929,6 +1489,8 @@ class StatsEngine(object):
 
         self.record_time_metrics(transaction.time_metrics(self))
 
+        self.merge_time_metrics(transaction.folded_time_metrics())
+
         # Capture any errors if error collection is enabled.
         # Only retain maximum number allowed per harvest.
 
@@ -988,8 +1550,15 @@ class StatsEngine(object):
 
         elif settings.collect_analytics_events and settings.transaction_events.enabled:
 
-            event = transaction.transaction_event(self.__stats_table)
-            self._transaction_events.add(event, priority=transaction.priority)
+            # Once the reservoir is full, a transaction whose priority is
+            # too low to displace any sample would be discarded by add(),
+            # so only count it as seen rather than creating the event.
+
+            if self._should_sample("transaction_events", transaction.priority):
+                event = transaction.transaction_event(self.__stats_table)
+                self._transaction_events.add(event, priority=transaction.priority)
+            else:
+                self._transaction_events.num_seen += 1
 
         # Merge in custom events
 
@@ -1003,8 +1572,14 @@ class StatsEngine(object):
                 for event in transaction.span_protos(settings):
                     self._span_stream.put(event)
             elif transaction.sampled:
-                for event in transaction.span_events(self.__settings):
-                    self._span_events.add(event, priority=transaction.priority)
+                # All spans of a transaction share its priority, so if
+                # the first would be discarded so would all the rest.
+
+                if self._should_sample("span_events", transaction.priority):
+                    for event in transaction.span_events(self.__settings):
+                        self._span_events.add(event, priority=transaction.priority)
+                else:
+                    self._span_events.num_seen += transaction.span_count()
 
         # Merge in log events
 
@@ -1012,6 +1587,33 @@ class StatsEngine(object):
             self._log_events.merge(transaction.log_events, priority=transaction.priority)
 
 
+    def _should_sample(self, name, priority):
+        """Returns False if events with the given priority would be
+        discarded by the named reservoir, either of this stats engine or
+        of the one this work area will be merged into, as it is already
+        full of events with a higher priority.
+
+        """
+
+        if priority is None:
+            return True
+
+        for stats_engine in (self, self._sampling_parent):
+            if stats_engine is None:
+                continue
+
+            # The reservoir of the parent is looked at without holding
+            # its lock, so a harvest may reset it as we do so. Err on
+            # the side of creating the events if that happens.
+
+            try:
+                if not getattr(stats_engine, name).should_sample(priority):
+                    return False
+            except (AttributeError, IndexError):
+                pass
+
+        return True
+
     def record_log_event(self, message, level=None, timestamp=None, priority=None):
         settings = self.__settings
         if not (settings and settings.application_logging and settings.application_logging.enabled and settings.application_logging.forwarding and settings.application_logging.forwarding.enabled):
@@ -1072,6 +1674,9 @@ class StatsEngine(object):
             )
 
         if normalizer is not None:
+            if isinstance(self.__stats_table, MetricTable):
+                normalized_stats = MetricTable()
+
             for key, value in six.iteritems(self.__stats_table):
                 key = (normalizer(key[0])[0], key[1])
                 stats = normalized_stats.get(key)
@@ -1089,6 +1694,9 @@ class StatsEngine(object):
                 list(six.iteritems(normalized_stats)),
             )
 
+        if isinstance(normalized_stats, MetricTable):
+            return normalized_stats.metric_data()
+
         for key, value in six.iteritems(normalized_stats):
             key = dict(name=key[0], scope=key[1])
             result.append((key, value))
@@ -1131,6 +1739,12 @@ class StatsEngine(object):
 
         slow_sql_nodes = sorted(six.itervalues(self.__sql_stats_table), key=lambda x: x.max_call_time)[-maximum:]
 
+        # Where explain plans are run in the background, start them all
+        # up front so they run in parallel rather than one at a time.
+
+        if isinstance(connections, ExplainPlanExecutor):
+            connections.prefetch(stats_node.slow_sql_node for stats_node in slow_sql_nodes)
+
         result = []
 
         for stats_node in slow_sql_nodes:
@@ -1267,6 +1881,9 @@ class StatsEngine(object):
                     node.generate_explain_plan = True
                     database_nodes.append(node)
 
+        if isinstance(connections, ExplainPlanExecutor):
+            connections.prefetch(database_nodes)
+
         # Now generate the transaction traces. We need to cap the
         # number of nodes capture to the specified limit.
 
@@ -1280,17 +1897,10 @@ class StatsEngine(object):
             if self.__settings.debug.log_transaction_trace_payload:
                 _logger.debug("Encoding slow transaction data where payload=%r.", data)
 
-            json_data = json_encode(data)
-
             level = self.__settings.agent_limits.data_compression_level
             level = level or zlib.Z_DEFAULT_COMPRESSION
 
-            zlib_data = zlib.compress(six.b(json_data), level)
-
-            pack_data = base64.standard_b64encode(zlib_data)
-
-            if six.PY3:
-                pack_data = pack_data.decode("Latin-1")
+            pack_data = _pack_trace_data(data, level)
 
             root = transaction_trace.root
 
@@ -1382,8 +1992,8 @@ class StatsEngine(object):
         """
 
         self.__settings = settings
-        self.__stats_table = {}
-        self.__sql_stats_table = {}
+        self.__stats_table = self._create_stats_table()
+        self.__sql_stats_table = self._create_sql_stats_table()
         self.__slow_transaction = None
         self.__slow_transaction_map = {}
         self.__slow_transaction_old_duration = None
@@ -1398,7 +2008,12 @@ class StatsEngine(object):
         self.reset_synthetics_events()
         # streams are never reset after instantiation
         if reset_stream:
-            self._span_stream = StreamBuffer(settings.infinite_tracing.span_queue_size)
+            self._span_stream = StreamBuffer(
+                settings.infinite_tracing.span_queue_size,
+                batching=settings.infinite_tracing.batching,
+                batch_size=settings.infinite_tracing.batch_size,
+                batch_linger=settings.infinite_tracing.batch_linger,
+            )
 
     def reset_metric_stats(self):
         """Resets the accumulated statistics back to initial state for
@@ -1406,7 +2021,7 @@ class StatsEngine(object):
 
         """
 
-        self.__stats_table = {}
+        self.__stats_table = self._create_stats_table()
 
     def reset_transaction_events(self):
         """Resets the accumulated statistics back to initial state for
@@ -1490,8 +2105,8 @@ class StatsEngine(object):
 
         self.__slow_transaction = None
         self.__synthetics_transactions = []
-        self.__sql_stats_table = {}
-        self.__stats_table = {}
+        self.__sql_stats_table = self._create_sql_stats_table()
+        self.__stats_table = self._create_stats_table()
         self.__transaction_errors = []
 
     def harvest_snapshot(self, flexible=False):
@@ -1550,6 +2165,12 @@ class StatsEngine(object):
         stats = copy.copy(self)
         stats.reset_stats(self.__settings)
 
+        # Remember where the work area came from so that events which
+        # would only be discarded when merged back in need not be
+        # created in the first place.
+
+        stats._sampling_parent = self
+
         return stats
 
     def merge(self, snapshot):
@@ -1594,6 +2215,27 @@ class StatsEngine(object):
         self._merge_span_events(snapshot, rollback=True)
         self._merge_log_events(snapshot, rollback=True)
 
+    def merge_shard(self, shard):
+        """Merges all data from a stats engine shard. Unlike merge(), which
+        expects the data for a single transaction, a shard will have
+        accumulated data from many transactions, so events are merged
+        using reservoir sampling in the same way as is done for a rollback.
+        """
+
+        if not self.__settings:
+            return
+
+        self.merge_metric_stats(shard)
+        self._merge_transaction_events(shard, rollback=True)
+        self._merge_synthetics_events(shard, rollback=True)
+        self._merge_error_events(shard)
+        self._merge_error_traces(shard)
+        self._merge_custom_events(shard, rollback=True)
+        self._merge_span_events(shard, rollback=True)
+        self._merge_log_events(shard, rollback=True)
+        self._merge_sql(shard)
+        self._merge_traces(shard)
+
     def merge_metric_stats(self, snapshot):
         """Merges metric data from a snapshot. This is used both when merging
         data from a single transaction into the main stats engine, and for
@@ -1604,6 +2246,10 @@ class StatsEngine(object):
         if not self.__settings:
             return
 
+        if isinstance(self.__stats_table, MetricTable) and isinstance(snapshot.__stats_table, MetricTable):
+            self.__stats_table.merge_table(snapshot.__stats_table)
+            return
+
         for key, other in six.iteritems(snapshot.__stats_table):
             stats = self.__stats_table.get(key)
             if not stats:
@@ -1627,7 +2273,10 @@ class StatsEngine(object):
         if rollback:
             self._transaction_events.merge(events)
         else:
-            if events.num_samples == 1:
+            # A transaction whose event was not created as it would not
+            # have been sampled still needs to be counted as seen.
+
+            if events.num_samples <= 1:
                 self._transaction_events.merge(events)
 
     def _merge_synthetics_events(self, snapshot, rollback=False):
@@ -1688,14 +2337,13 @@ class StatsEngine(object):
     def _merge_sql(self, snapshot):
 
         # Add sql traces to the set of existing entries. If over
-        # the limit of how many to collect, only merge in if already
-        # seen the specific SQL.
+        # the limit of how many to collect, a SQL statement not already
+        # seen only replaces the fastest one held if it is slower.
 
         for key, slow_sql_stats in six.iteritems(snapshot.__sql_stats_table):
             stats = self.__sql_stats_table.get(key)
             if not stats:
-                maximum = self.__settings.agent_limits.slow_sql_data
-                if len(self.__sql_stats_table) < maximum:
+                if self.__sql_stats_table.admit(slow_sql_stats.max_call_time):
                     self.__sql_stats_table[key] = copy.copy(slow_sql_stats)
             else:
                 stats.merge_stats(slow_sql_stats)
@@ -1735,6 +2383,23 @@ class StatsEngine(object):
             else:
                 stats.merge_stats(other)
 
+    def merge_time_metrics(self, metrics):
+        """Merges in a set of time metrics. The metrics should be provided
+        as an iterable where each item is a tuple of the metric key and the
+        accumulated stats for the metric.
+
+        """
+
+        if not self.__settings:
+            return
+
+        for key, other in metrics:
+            stats = self.__stats_table.get(key)
+            if stats is None:
+                self.__stats_table[key] = other
+            else:
+                stats.merge_stats(other)
+
     def _snapshot(self):
         copy = object.__new__(StatsEngineSnapshot)
         copy.__dict__.update(self.__dict__)
@@ -19,11 +19,12 @@ class StringTable(object):
         self.__mapping = {}
 
     def cache(self, value):
-        if not value in self.__mapping:
+        token = self.__mapping.get(value)
+        if token is None:
             token = '`%d' % len(self.__values)
             self.__mapping[value] = token
             self.__values.append(value)
-        return self.__mapping[value]
+        return token
 
     def values(self):
         return self.__values
@@ -28,6 +28,11 @@ try:
 except ImportError:
     import _thread as thread
 
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
 from newrelic.core.config import global_settings
 from newrelic.core.loop_node import LoopNode
 
@@ -99,6 +104,21 @@ class TraceCache(object):
     def __init__(self):
         self._cache = weakref.WeakValueDictionary()
 
+        # Context variable holding the thread ID, a weak reference to the
+        # current trace and the ID of the operating system thread it was
+        # set from, for the executing context, if tracking of the current
+        # trace using context variables has been enabled.
+
+        self._current = None
+
+        # Index of the traces running in asyncio tasks, keyed by the id()
+        # of the event loop of the task, so that the traces affected by
+        # the event loop being blocked can be found without needing to
+        # check every trace in the cache. Event loops are keyed by id()
+        # as not all event loop implementations support weak references.
+
+        self._loop_traces = {}
+
     def __repr__(self):
         return "<%s object at 0x%x %s>" % (self.__class__.__name__, id(self), str(dict(self._cache.items())))
 
@@ -132,6 +152,94 @@ class TraceCache(object):
 
         return thread.get_ident()
 
+    def enable_context_variables(self):
+        """Enables tracking of the current trace for the executing thread,
+        greenlet or asyncio task in a context variable, in addition to the
+        cache keyed by thread ID. Looking up the current trace is then a
+        single lookup of the context variable, rather than needing to work
+        out the thread ID for the executing context first.
+
+        Asyncio tasks inherit the current trace from the context in which
+        they were created, as do greenlets for versions of greenlet which
+        support context variables. Returns True if context variables are
+        in use, which requires Python 3.7 or later.
+
+        """
+
+        if self._current is not None:
+            return True
+
+        if contextvars is None:
+            return False
+
+        if self._cache:
+            _logger.warning(
+                "Unable to track the current trace using context variables "
+                "as traces are already active. Ensure the agent is "
+                "initialized before any transactions are started."
+            )
+
+            return False
+
+        self._current = contextvars.ContextVar("newrelic_current_trace", default=None)
+
+        return True
+
+    def _context_trace(self):
+        current = self._current.get()
+        if current is None:
+            return None
+
+        # The context is copied when running a function in another thread,
+        # as asyncio.to_thread() does, but the trace belongs to the thread
+        # which set it, so fall back to looking up the trace for the thread
+        # ID of the executing context.
+
+        if current[2] != thread.get_ident():
+            return self._cache.get(self.current_thread_id())
+
+        if current[1] is None:
+            return None
+
+        # A trace completed from another context, as when a transaction
+        # ends while traces in other tasks are still running, can't be
+        # replaced by its parent in the context variable of its own
+        # context, so is ignored.
+
+        trace = current[1]()
+        if trace is not None and not trace.exited:
+            return trace
+
+    def _set_context_trace(self, thread_id, trace, executing=True):
+        # Records the trace cached under the thread ID as the current trace
+        # for the executing context. Where the thread ID may not be that of
+        # the executing context, as when an async trace is completed by a
+        # child running in another task, the context variable is only
+        # updated if it was last set for the same thread ID.
+
+        if self._current is None:
+            return
+
+        if not executing:
+            current = self._current.get()
+            if current is None or current[0] != thread_id:
+                return
+
+        self._current.set((thread_id, trace is not None and weakref.ref(trace) or None, thread.get_ident()))
+
+    def set_current(self, thread_id, trace):
+        """Caches the trace under the thread ID of the executing context,
+        or removes any trace cached for it if trace is None.
+
+        """
+
+        if trace is not None:
+            self._cache[thread_id] = trace
+        else:
+            self._cache.pop(thread_id, None)
+
+        self._set_context_trace(thread_id, trace)
+
     def task_start(self, task):
         trace = self.current_trace()
         if trace:
@@ -146,10 +254,13 @@ class TraceCache(object):
 
         """
 
-        trace = self._cache.get(self.current_thread_id())
+        trace = self.current_trace()
         return trace and trace.transaction
 
     def current_trace(self):
+        if self._current is not None:
+            return self._context_trace()
+
         return self._cache.get(self.current_thread_id())
 
     def active_threads(self):
@@ -219,13 +330,19 @@ class TraceCache(object):
         if not hasattr(trace, "_task"):
             return trace
 
+        # The trace may have been copied in from the parent task when this
+        # task was created, in which case it is still running in the parent
+        # task, so is only dropped from the cache for this task. It is left
+        # in the index of traces until it exits.
+
         task = current_task(self.asyncio)
         if task is not None and id(trace._task) != id(task):
-            self._cache.pop(thread_id, None)
+            self.set_current(thread_id, None)
             return None
 
         if trace.root and trace.root.exited:
-            self._cache.pop(thread_id, None)
+            self.set_current(thread_id, None)
+            self._unindex_trace(trace)
             return None
 
         return trace
@@ -254,6 +371,7 @@ class TraceCache(object):
                 raise TraceCacheActiveTraceError("transaction already active")
 
         self._cache[thread_id] = trace
+        self._set_context_trace(thread_id, trace)
 
         # We judge whether we are actually running in a coroutine by
         # seeing if the current thread ID is actually listed in the set
@@ -274,17 +392,20 @@ class TraceCache(object):
                 if self.asyncio and not hasattr(trace, "_task"):
                     task = current_task(self.asyncio)
                     trace._task = task
+                    self._index_trace(trace)
 
     def pop_current(self, trace):
         """Restore the trace's parent under the thread ID of the current
         executing thread."""
 
         if hasattr(trace, "_task"):
+            self._unindex_trace(trace)
             delattr(trace, "_task")
 
         thread_id = trace.thread_id
         parent = trace.parent
         self._cache[thread_id] = parent
+        self._set_context_trace(thread_id, parent, executing=False)
 
     def complete_root(self, root):
         """Completes a trace specified by the given root
@@ -312,6 +433,7 @@ class TraceCache(object):
                         to_complete.append(entry.parent)
                     entry.__exit__(None, None, None)
 
+            self._unindex_trace(root)
             root._task = None
 
         thread_id = root.thread_id
@@ -334,8 +456,30 @@ class TraceCache(object):
             raise RuntimeError("not the current trace")
 
         del self._cache[thread_id]
+        self._set_context_trace(thread_id, None, executing=False)
         root._greenlet = None
 
+    def _index_trace(self, trace):
+        loop = get_event_loop(trace._task)
+        if loop is None:
+            return
+
+        traces = self._loop_traces.get(id(loop))
+        if traces is None:
+            traces = self._loop_traces[id(loop)] = weakref.WeakSet()
+        traces.add(trace)
+
+    def _unindex_trace(self, trace):
+        loop = get_event_loop(getattr(trace, "_task", None))
+        if loop is None:
+            return
+
+        traces = self._loop_traces.get(id(loop))
+        if traces is not None:
+            traces.discard(trace)
+            if not traces:
+                self._loop_traces.pop(id(loop), None)
+
     def record_event_loop_wait(self, start_time, end_time):
         transaction = self.current_transaction()
         if not transaction or not transaction.settings:
@@ -354,27 +498,21 @@ class TraceCache(object):
 
         fetch_name = transaction._cached_path.path
         roots = set()
-        seen = set()
 
         task = getattr(transaction.root_span, "_task", None)
         loop = get_event_loop(task)
 
-        for trace in self._cache.values():
-            if trace in seen:
-                continue
+        traces = self._loop_traces.get(id(loop)) if loop is not None else None
 
+        for trace in list(traces or ()):
             # If the trace is on a different transaction and it's asyncio
             if (
                 trace.transaction is not transaction
                 and getattr(trace, "_task", None) is not None
-                and get_event_loop(trace._task) is loop
                 and trace._is_leaf()
             ):
                 trace.exclusive -= duration
                 roots.add(trace.root)
-                seen.add(trace)
-
-        seen = None
 
         for root in roots:
             guid = "%016x" % random.getrandbits(64)
@@ -42,6 +42,7 @@ _TransactionNode = namedtuple('_TransactionNode',
         'end_time', 'last_byte_time', 'response_time', 'total_time',
         'duration', 'exclusive', 'root', 'errors', 'slow_sql',
         'custom_events', 'log_events', 'apdex_t', 'suppress_apdex', 'custom_metrics',
+        'folded_metrics',
         'guid', 'cpu_time', 'suppress_transaction_trace', 'client_cross_process_id',
         'referring_transaction_guid', 'record_tt', 'synthetics_resource_id',
         'synthetics_job_id', 'synthetics_monitor_id', 'synthetics_header',
@@ -242,6 +243,18 @@ class TransactionNode(_TransactionNode):
             for metric in child.time_metrics(stats, self, self):
                 yield metric
 
+    def folded_time_metrics(self):
+        """Return an iterator over the accumulated time metrics for the
+        segments which were folded while the transaction was running
+        rather than being kept as child nodes.
+
+        """
+
+        if not self.base_name or not self.folded_metrics:
+            return ()
+
+        return self.folded_metrics.metrics(self.path)
+
     def apdex_metrics(self, stats):
         """Return a generator yielding the apdex metrics for this node.
 
@@ -617,3 +630,6 @@ class TransactionNode(_TransactionNode):
             attr_class=attr_class,
         ):
             yield event
+
+    def span_count(self):
+        return self.root.span_count()
@@ -24,3 +24,19 @@ class ForceAgentRestart(NetworkInterfaceException): pass
 class ForceAgentDisconnect(NetworkInterfaceException): pass
 class DiscardDataForRequest(NetworkInterfaceException): pass
 class RetryDataForRequest(NetworkInterfaceException): pass
+class PayloadTooLargeForRequest(DiscardDataForRequest): pass
+
+
+class RetryPartialDataForRequest(RetryDataForRequest):
+
+    """Raised where the data for a request was sent in parts, and only some
+    of the parts failed to be sent. The unsent attribute holds the (start,
+    end) ranges of the positions of the items which were not sent, and
+    events_seen the number of events seen which they account for.
+
+    """
+
+    def __init__(self, unsent, events_seen):
+        super(RetryPartialDataForRequest, self).__init__(unsent, events_seen)
+        self.unsent = unsent
+        self.events_seen = events_seen
@@ -200,3 +200,25 @@ def test_record_event_loop_wait_on_different_task(event_loop):
         await task
 
     event_loop.run_until_complete(transaction())
+
+
+@validate_transaction_metrics(
+    "parent",
+    background_task=True,
+    scoped_metrics=(("EventLoop/Wait/OtherTransaction/Function/child", 1),),
+    rollup_metrics=(("EventLoop/Wait/all", 1),),
+)
+def test_record_event_loop_wait_child_task_transaction(event_loop):
+    # The child task starts out with the trace of the parent, copied in
+    # when the task is created, which must remain indexed against the
+    # event loop once the child starts its own transaction.
+
+    @background_task(name="child")
+    async def child():
+        time.sleep(0.1)
+
+    @background_task(name="parent")
+    async def parent():
+        await event_loop.create_task(child())
+
+    event_loop.run_until_complete(parent())
@@ -14,11 +14,16 @@
 
 import logging
 
-from testing_support.fixtures import validate_transaction_metrics
+from testing_support.fixtures import (
+    override_application_settings,
+    validate_transaction_metrics,
+)
 
 from newrelic.api.background_task import background_task
+from newrelic.api.datastore_trace import DatastoreTrace
 from newrelic.api.function_trace import FunctionTrace
 from newrelic.api.transaction import end_of_transaction
+from newrelic.common.object_wrapper import transient_function_wrapper
 
 
 @validate_transaction_metrics(
@@ -34,3 +39,69 @@ def test_trace_after_end_of_transaction(caplog):
 
     error_messages = [record for record in caplog.records if record.levelno >= logging.ERROR]
     assert not error_messages
+
+
+def validate_segment_count(count, folded):
+    @transient_function_wrapper("newrelic.core.stats_engine", "StatsEngine.record_transaction")
+    def _validate_segment_count(wrapped, instance, args, kwargs):
+        def _bind_params(transaction, *args, **kwargs):
+            return transaction
+
+        transaction = _bind_params(*args, **kwargs)
+
+        def _count(node):
+            return 1 + sum(_count(child) for child in node.children)
+
+        assert sum(_count(child) for child in transaction.root.children) == count
+        assert len(transaction.folded_metrics) == folded
+
+        return wrapped(*args, **kwargs)
+
+    return _validate_segment_count
+
+
+@override_application_settings({"agent_limits.transaction_segments_maximum": 5})
+@validate_segment_count(count=5, folded=22)
+@validate_transaction_metrics(
+    "test_segments_folded_past_maximum",
+    background_task=True,
+    scoped_metrics=[
+        ("Function/outer", 1),
+        ("Function/inner", 3),
+        ("Datastore/statement/Redis/cache/get", 20),
+        ("Datastore/operation/Redis/set", 3),
+    ],
+    rollup_metrics=[
+        ("Function/outer", 1),
+        ("Function/inner", 3),
+        ("Datastore/all", 23),
+        ("Datastore/allOther", 23),
+        ("Datastore/Redis/all", 23),
+        ("Datastore/statement/Redis/cache/get", 20),
+        ("Datastore/operation/Redis/get", 20),
+        ("Datastore/operation/Redis/set", 3),
+    ],
+)
+@background_task(name="test_segments_folded_past_maximum")
+def test_segments_folded_past_maximum():
+    for _ in range(20):
+        with DatastoreTrace("Redis", "cache", "get"):
+            pass
+
+    with FunctionTrace("outer"):
+        for _ in range(3):
+            # Once their only child has been folded the inner function
+            # traces have no children of their own and are folded too.
+
+            with FunctionTrace("inner"):
+                with DatastoreTrace("Redis", None, "set"):
+                    pass
+
+
+@override_application_settings({"agent_limits.transaction_segments_maximum": 0})
+@validate_segment_count(count=20, folded=0)
+@background_task(name="test_segments_not_folded_by_default")
+def test_segments_not_folded_by_default():
+    for _ in range(20):
+        with DatastoreTrace("Redis", "cache", "get"):
+            pass
@@ -15,7 +15,16 @@
 from concurrent import futures
 
 import grpc
-from newrelic.core.infinite_tracing_pb2 import RecordStatus, Span
+from newrelic.core.infinite_tracing_pb2 import RecordStatus, Span, SpanBatch
+
+# Sizes of the span batches received by record_span_batch, in order.
+RECEIVED_BATCH_SIZES = []
+
+
+def span_status_code(span):
+    status_code = span.intrinsics.get('status_code', None)
+    return status_code and getattr(
+        grpc.StatusCode, status_code.string_value)
 
 
 def record_span(request, context):
@@ -24,9 +33,7 @@ def record_span(request, context):
     assert 'license_key' in metadata
 
     for span in request:
-        status_code = span.intrinsics.get('status_code', None)
-        status_code = status_code and getattr(
-            grpc.StatusCode, status_code.string_value)
+        status_code = span_status_code(span)
         if status_code is grpc.StatusCode.OK:
             break
         elif status_code:
@@ -35,13 +42,34 @@ def record_span(request, context):
         yield RecordStatus(messages_seen=1)
 
 
+def record_span_batch(request, context):
+    metadata = dict(context.invocation_metadata())
+    assert 'agent_run_token' in metadata
+    assert 'license_key' in metadata
+
+    for span_batch in request:
+        RECEIVED_BATCH_SIZES.append(len(span_batch.spans))
+
+        for span in span_batch.spans:
+            status_code = span_status_code(span)
+            if status_code is grpc.StatusCode.OK:
+                return
+            elif status_code:
+                context.abort(status_code, "Abort triggered by client")
+
+        yield RecordStatus(messages_seen=len(span_batch.spans))
+
+
 HANDLERS = (
     grpc.method_handlers_generic_handler(
         "com.newrelic.trace.v1.IngestService",
         {
             "RecordSpan": grpc.stream_stream_rpc_method_handler(
                 record_span, Span.FromString, RecordStatus.SerializeToString
-            )
+            ),
+            "RecordSpanBatch": grpc.stream_stream_rpc_method_handler(
+                record_span_batch, SpanBatch.FromString, RecordStatus.SerializeToString
+            ),
         },
     ),
 )
@@ -0,0 +1,151 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+
+from newrelic.common.streaming_utils import StreamBuffer
+from newrelic.core.infinite_tracing_pb2 import Span, SpanBatch
+
+
+def test_stream_buffer_concurrent_producers():
+    stream_buffer = StreamBuffer(100000)
+    iterator = iter(stream_buffer)
+    received = []
+
+    def consume():
+        for item in iterator:
+            received.append(item)
+
+    def produce(offset):
+        for i in range(1000):
+            stream_buffer.put(offset + i)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+
+    producers = [threading.Thread(target=produce, args=(n * 1000,)) for n in range(8)]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+
+    # Wait for the consumer to drain the buffer before shutting it down.
+    for _ in range(500):
+        if not stream_buffer._queue and stream_buffer._waiting:
+            break
+        threading.Event().wait(0.01)
+
+    stream_buffer.shutdown()
+    consumer.join(timeout=5)
+
+    assert not consumer.is_alive()
+    assert sorted(received) == list(range(8000))
+
+
+def test_stream_buffer_put_does_not_notify_busy_consumer():
+    stream_buffer = StreamBuffer(10)
+    notify_count = [0]
+
+    notify_all = stream_buffer._notify.notify_all
+
+    def counting_notify_all():
+        notify_count[0] += 1
+        notify_all()
+
+    stream_buffer._notify.notify_all = counting_notify_all
+
+    for i in range(5):
+        stream_buffer.put(i)
+
+    assert notify_count[0] == 0
+    assert next(iter(stream_buffer)) == 0
+    assert stream_buffer.stats() == (5, 0)
+
+
+def test_stream_buffer_dropped():
+    stream_buffer = StreamBuffer(2)
+
+    for i in range(5):
+        stream_buffer.put(i)
+
+    assert list(stream_buffer._queue) == [3, 4]
+    assert stream_buffer.stats() == (5, 3)
+
+    stream_buffer.shutdown()
+    stream_buffer.put(5)
+    assert stream_buffer.stats() == (0, 0)
+
+
+def test_stream_buffer_batches_queued_spans():
+    stream_buffer = StreamBuffer(100, batching=True, batch_size=4)
+
+    for i in range(10):
+        stream_buffer.put(Span(trace_id=str(i)))
+
+    iterator = iter(stream_buffer)
+    batches = [next(iterator) for _ in range(3)]
+
+    assert all(isinstance(batch, SpanBatch) for batch in batches)
+    assert [[span.trace_id for span in batch.spans] for batch in batches] == [
+        ["0", "1", "2", "3"],
+        ["4", "5", "6", "7"],
+        ["8", "9"],
+    ]
+
+
+def test_stream_buffer_batch_linger():
+    stream_buffer = StreamBuffer(100, batching=True, batch_size=3, batch_linger=5.0)
+    iterator = iter(stream_buffer)
+
+    def produce():
+        for i in range(2):
+            stream_buffer.put(Span(trace_id=str(i)))
+
+    stream_buffer.put(Span(trace_id="first"))
+    producer = threading.Thread(target=produce)
+    producer.start()
+
+    # The batch is only sent once it is full, well before the linger
+    # time expires.
+    batch = next(iterator)
+    producer.join()
+
+    assert [span.trace_id for span in batch.spans] == ["first", "0", "1"]
+
+
+def test_stream_buffer_batch_linger_expires():
+    stream_buffer = StreamBuffer(100, batching=True, batch_size=3, batch_linger=0.01)
+    stream_buffer.put(Span(trace_id="only"))
+
+    batch = next(iter(stream_buffer))
+
+    assert [span.trace_id for span in batch.spans] == ["only"]
+
+
+def test_stream_buffer_batch_shutdown_during_linger():
+    stream_buffer = StreamBuffer(100, batching=True, batch_size=3, batch_linger=30.0)
+    iterator = iter(stream_buffer)
+    stream_buffer.put(Span(trace_id="only"))
+
+    timer = threading.Timer(0.1, stream_buffer.shutdown)
+    timer.start()
+
+    batch = next(iterator)
+    timer.join()
+
+    assert [span.trace_id for span in batch.spans] == ["only"]
+    with pytest.raises(StopIteration):
+        next(iterator)
@@ -104,3 +104,31 @@ def test_close_while_awaiting_reconnect(mock_grpc_server, monkeypatch):
     rpc.close()
     # Make sure the processing_thread is closed
     assert not rpc.response_processing_thread.is_alive()
+
+
+def test_batched_spans_sent(mock_grpc_server):
+    from _test_handler import RECEIVED_BATCH_SIZES
+
+    del RECEIVED_BATCH_SIZES[:]
+
+    endpoint = "localhost:%s" % mock_grpc_server
+    stream_buffer = StreamBuffer(1000, batching=True, batch_size=100)
+
+    for _ in range(250):
+        stream_buffer.put(Span(intrinsics={}, agent_attributes={}, user_attributes={}))
+
+    rpc = StreamingRpc(
+        endpoint, stream_buffer, DEFAULT_METADATA, record_metric, ssl=False
+    )
+
+    rpc.connect()
+    try:
+        for _ in range(500):
+            if sum(RECEIVED_BATCH_SIZES) >= 250:
+                break
+            threading.Event().wait(0.01)
+    finally:
+        rpc.close()
+
+    assert RECEIVED_BATCH_SIZES == [100, 100, 50]
+    assert not rpc.response_processing_thread.is_alive()
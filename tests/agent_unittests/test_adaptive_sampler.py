@@ -0,0 +1,169 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+from newrelic.core.adaptive_sampler import AdaptiveSampler
+
+SAMPLING_TARGET = 10
+PERIODS = 20
+THREADS = 8
+TRANSACTIONS_PER_THREAD = 500
+
+
+class ReferenceSampler(object):
+
+    """The sampling algorithm applied one transaction at a time, against
+    which the results of the sampler are compared.
+
+    """
+
+    def __init__(self, sampling_target):
+        self.sampling_target = sampling_target
+        self.max_sampled = sampling_target
+        self.computed_count_last = sampling_target
+        self.adaptive_target = 0.0
+        self.computed_count = 0
+        self.sampled_count = 0
+
+    def compute_sampled(self):
+        if self.sampled_count >= self.max_sampled:
+            return False
+
+        elif self.sampled_count < self.sampling_target:
+            sampled = random.randrange(self.computed_count_last) < self.sampling_target
+            if sampled:
+                self.sampled_count += 1
+        else:
+            sampled = random.randrange(self.computed_count) < self.adaptive_target
+            if sampled:
+                self.sampled_count += 1
+
+                ratio = float(self.sampling_target) / self.sampled_count
+                self.adaptive_target = self.sampling_target**ratio - self.sampling_target**0.5
+
+        self.computed_count += 1
+        return sampled
+
+    def reset(self):
+        self.max_sampled = 2 * self.sampling_target
+        self.adaptive_target = self.sampling_target - self.sampling_target**0.5
+        self.computed_count_last = max(self.computed_count, self.sampling_target)
+        self.computed_count = 0
+        self.sampled_count = 0
+
+
+def start_next_period(sampler):
+    sampler.last_reset = time.time() - sampler.period
+
+
+def test_adaptive_sampler_matches_reference():
+    sampler = AdaptiveSampler(SAMPLING_TARGET, 60.0)
+    reference = ReferenceSampler(SAMPLING_TARGET)
+
+    random.seed(1234)
+    expected = []
+    for _ in range(PERIODS):
+        expected.append([reference.compute_sampled() for _ in range(1000)])
+        reference.reset()
+
+    random.seed(1234)
+    actual = []
+    for _ in range(PERIODS):
+        actual.append([sampler.compute_sampled() for _ in range(1000)])
+        start_next_period(sampler)
+
+    assert actual == expected
+
+
+@pytest.fixture
+def frequent_thread_switches():
+    # Switch between threads as often as possible, so that the calls made
+    # to the sampler from each thread are interleaved.
+
+    if not hasattr(sys, "setswitchinterval"):
+        yield
+        return
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        yield
+    finally:
+        sys.setswitchinterval(interval)
+
+
+def test_adaptive_sampler_concurrent_distribution(frequent_thread_switches):
+    sampler = AdaptiveSampler(SAMPLING_TARGET, 60.0)
+    barrier = threading.Condition()
+    state = {"period": 0, "waiting": 0}
+    results = [[0] * PERIODS for _ in range(THREADS)]
+
+    def wait_for_period(period):
+        with barrier:
+            state["waiting"] += 1
+            if state["waiting"] == THREADS:
+                state["waiting"] = 0
+                state["period"] += 1
+                start_next_period(sampler)
+                barrier.notify_all()
+            else:
+                while state["period"] == period:
+                    barrier.wait()
+
+    def worker(index):
+        for period in range(PERIODS):
+            for _ in range(TRANSACTIONS_PER_THREAD):
+                if sampler.compute_sampled():
+                    results[index][period] += 1
+
+            wait_for_period(period)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30.0)
+
+    sampled = [sum(counts) for counts in zip(*results)]
+
+    # The first period samples at most the target, and subsequent periods
+    # at most twice the target.
+
+    assert sampled[0] <= SAMPLING_TARGET
+    assert all(count <= 2 * SAMPLING_TARGET for count in sampled[1:])
+
+    # Transactions are counted up until no more can be sampled in the
+    # period, including when counted concurrently.
+
+    assert sampler.computed_count_last <= THREADS * TRANSACTIONS_PER_THREAD
+
+    # Compare the average number sampled in a period with that from the
+    # reference sampler seeing the same number of transactions.
+
+    reference = ReferenceSampler(SAMPLING_TARGET)
+    expected = []
+    for _ in range(PERIODS * 5):
+        reference.reset()
+        expected.append(sum(reference.compute_sampled() for _ in range(THREADS * TRANSACTIONS_PER_THREAD)))
+
+    average = float(sum(sampled[1:])) / (PERIODS - 1)
+    expected_average = float(sum(expected)) / len(expected)
+
+    assert abs(average - expected_average) <= 0.2 * expected_average
@@ -23,7 +23,14 @@ import pytest
 from newrelic.common import certs, system_info
 from newrelic.common.agent_http import DeveloperModeClient
 from newrelic.common.encoding_utils import json_decode, serverless_payload_decode
-from newrelic.common.utilization import CommonUtilization
+from newrelic.common.utilization import (
+    AWSUtilization,
+    AzureUtilization,
+    CommonUtilization,
+    GCPUtilization,
+    PCFUtilization,
+)
+from newrelic.core import agent_protocol
 from newrelic.core.agent_protocol import AgentProtocol, ServerlessModeProtocol
 from newrelic.core.config import finalize_application_settings, global_settings
 from newrelic.core.internal_metrics import InternalTraceContext
@@ -501,6 +508,97 @@ def test_connect_metadata(monkeypatch):
     assert connect_payload["metadata"] == {"NEW_RELIC_METADATA_FOOBAR": "foobar"}
 
 
+def test_connect_utilization_vendors_cached(monkeypatch, tmpdir):
+    global BOOT_ID
+    detected = []
+
+    @classmethod
+    def detect(cls):
+        detected.append(cls.VENDOR_NAME)
+        return AWS if cls.VENDOR_NAME == "aws" else None
+
+    for vendor in (AWSUtilization, AzureUtilization, GCPUtilization, PCFUtilization):
+        monkeypatch.setattr(vendor, "detect", detect)
+
+    settings = finalize_application_settings(
+        {
+            "connect_cache.enabled": True,
+            "connect_cache.directory": str(tmpdir),
+            "utilization.detect_docker": False,
+            "utilization.detect_kubernetes": False,
+        }
+    )
+
+    def connect_payload_vendors():
+        payload = AgentProtocol._connect_payload(APP_NAME, LINKED_APPS, ENVIRONMENT, settings)
+        return payload[0]["utilization"]["vendors"]
+
+    assert connect_payload_vendors() == {"aws": AWS}
+    assert detected == ["aws"]
+
+    # Until the host is rebooted, the vendor is not detected again.
+
+    assert connect_payload_vendors() == {"aws": AWS}
+    assert detected == ["aws"]
+
+    BOOT_ID = "fd3e4a1e-8b8a-4e55-9a5d-b8dcbd3fc4c1"
+
+    assert connect_payload_vendors() == {"aws": AWS}
+    assert detected == ["aws", "aws"]
+
+
+def test_connect_utilization_vendor_miss_expires(monkeypatch, tmpdir):
+    now = [1000.0]
+
+    class FakeTime(object):
+        @staticmethod
+        def time():
+            return now[0]
+
+    monkeypatch.setattr(agent_protocol, "time", FakeTime)
+
+    detected = []
+    metadata = {}
+
+    @classmethod
+    def detect(cls):
+        detected.append(cls.VENDOR_NAME)
+        return metadata.get(cls.VENDOR_NAME)
+
+    for vendor in (AWSUtilization, AzureUtilization, GCPUtilization, PCFUtilization):
+        monkeypatch.setattr(vendor, "detect", detect)
+
+    settings = finalize_application_settings(
+        {
+            "connect_cache.enabled": True,
+            "connect_cache.directory": str(tmpdir),
+            "utilization.detect_aws": True,
+            "utilization.detect_azure": False,
+            "utilization.detect_gcp": False,
+            "utilization.detect_pcf": False,
+            "utilization.detect_docker": False,
+            "utilization.detect_kubernetes": False,
+        }
+    )
+
+    def connect_payload_vendors():
+        payload = AgentProtocol._connect_payload(APP_NAME, LINKED_APPS, ENVIRONMENT, settings)
+        return payload[0]["utilization"].get("vendors")
+
+    # The metadata endpoint timing out is not distinguished from not
+    # running on the vendor, so a miss is only cached for a short time.
+
+    assert connect_payload_vendors() is None
+    assert connect_payload_vendors() is None
+    assert detected == ["aws"]
+
+    metadata["aws"] = AWS
+    now[0] += agent_protocol._UTILIZATION_VENDORS_MISS_TTL + 1
+
+    assert connect_payload_vendors() == {"aws": AWS}
+    assert detected == ["aws", "aws"]
+
+
 def test_serverless_protocol_connect():
     settings = global_settings()
     protocol = ServerlessModeProtocol.connect(
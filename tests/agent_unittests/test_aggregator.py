@@ -0,0 +1,295 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import socket
+import stat
+import sys
+import types
+
+import pytest
+from testing_support.fixtures import override_generic_settings
+
+from newrelic.api.application import Application as ApiApplication
+from newrelic.api.background_task import BackgroundTask
+from newrelic.api.database_trace import DatabaseTrace
+from newrelic.common.object_wrapper import transient_function_wrapper
+from newrelic.core.aggregator import (
+    AggregatorClient,
+    AggregatorServer,
+    _check_peer,
+    dump_stats_engine,
+    load_stats_engine,
+)
+from newrelic.core.application import Application
+from newrelic.core.config import finalize_application_settings, global_settings
+from newrelic.core.custom_event import create_custom_event
+from newrelic.core.data_collector import AggregatorSession
+from newrelic.core.stats_engine import StatsEngine
+from newrelic.network.exceptions import ForceAgentRestart, RetryDataForRequest
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Unix sockets are not supported")
+
+settings = global_settings()
+
+APP_NAME = "Python Agent Test (Aggregator)"
+
+
+class ExplainPlanNode(object):
+    def __init__(self, module):
+        self.dbapi2_module = module
+
+
+def test_stats_engine_round_trip():
+    worker_settings = finalize_application_settings()
+    aggregator_settings = finalize_application_settings()
+
+    stats = StatsEngine()
+    stats.reset_stats(worker_settings)
+    stats.record_custom_metric("Custom/Metric", 2.0)
+    stats.custom_events.add(create_custom_event("Custom", {"a": 1}))
+    stats.error_data().append(ExplainPlanNode(sys))
+
+    loaded = load_stats_engine(dump_stats_engine(stats), aggregator_settings)
+
+    # The settings and modules are not sent, but replaced by those of the
+    # aggregator.
+
+    assert loaded.settings is aggregator_settings
+    assert loaded.error_data()[0].dbapi2_module is sys
+
+    assert loaded.stats_table[("Custom/Metric", "")][1] == 2.0
+    assert list(loaded.custom_events) == list(stats.custom_events)
+    assert loaded.span_stream is None
+
+
+class FakeAgent(object):
+    def __init__(self, application):
+        self._application = application
+        self.activated = []
+
+    def activate_application(self, app_name, linked_applications=None, timeout=None):
+        self.activated.append(app_name)
+
+    def application(self, app_name):
+        if app_name == self._application.name:
+            return self._application
+
+    def global_settings(self):
+        return settings
+
+    def application_settings(self, app_name):
+        return self._application.configuration
+
+    def record_transaction(self, app_name, data):
+        self._application.record_transaction(data)
+
+    def normalize_name(self, app_name, name, rule_type="url"):
+        return self._application.normalize_name(name, rule_type)
+
+    def compute_sampled(self, app_name):
+        return self._application.compute_sampled()
+
+
+@pytest.fixture
+def aggregator():
+    with_developer_mode = override_generic_settings(
+        settings, {"developer_mode": True, "license_key": "**NOT A LICENSE KEY**"}
+    )
+
+    application = Application(APP_NAME)
+    with_developer_mode(application.connect_to_data_collector)(None)
+
+    return application
+
+
+@pytest.fixture
+def dbapi2_module(monkeypatch):
+    module = types.ModuleType("fake_dbapi2")
+    module._nr_database_product = "Fake"
+    module._nr_explain_query = "EXPLAIN"
+    module._nr_explain_stmts = ("select",)
+
+    # Modules are looked up by name by the aggregator, so must be imported.
+
+    monkeypatch.setitem(sys.modules, module.__name__, module)
+
+    return module
+
+
+def test_stats_engine_round_trip_slow_sql(aggregator, dbapi2_module):
+    configuration = aggregator.configuration
+
+    override_thresholds = override_generic_settings(
+        configuration,
+        {
+            "transaction_tracer.explain_threshold": 0.0,
+            "transaction_tracer.transaction_threshold": 0.0,
+        },
+    )
+
+    @override_generic_settings(settings, {"enabled": True})
+    @override_thresholds
+    def record_transaction():
+        with BackgroundTask(ApiApplication(APP_NAME, FakeAgent(aggregator)), "slow"):
+            with DatabaseTrace("SELECT * FROM users WHERE id = 1", dbapi2_module=dbapi2_module):
+                pass
+
+    record_transaction()
+
+    stats = aggregator._stats_engine.harvest_snapshot()
+    assert stats.sql_stats_table
+
+    loaded = load_stats_engine(dump_stats_engine(stats), configuration)
+
+    (slow_sql,) = loaded.sql_stats_table.values()
+    assert slow_sql.slow_sql_node.statement.database.dbapi2_module is dbapi2_module
+
+    # The data can be generated for sending to the data collector, with
+    # the same result as for the original stats engine.
+
+    assert loaded.slow_sql_data(None) == stats.slow_sql_data(None)
+    assert loaded.transaction_trace_data(None)
+    assert len(loaded.transaction_trace_data(None)) == len(stats.transaction_trace_data(None))
+
+
+@pytest.fixture
+def server(aggregator, tmpdir):
+    server = AggregatorServer(str(tmpdir.join("aggregator.sock")), agent=FakeAgent(aggregator))
+    server.start()
+    yield server
+    server.stop()
+
+
+def connect_worker(server):
+    connect = override_generic_settings(
+        settings, {"aggregator.enabled": True, "aggregator.socket_path": server.path}
+    )
+
+    worker = Application(APP_NAME)
+    connect(worker.connect_to_data_collector)(None)
+
+    return worker
+
+
+def test_worker_harvest_forwarded(aggregator, server):
+    worker = connect_worker(server)
+
+    assert server.agent.activated == [APP_NAME]
+    assert isinstance(worker._active_session, AggregatorSession)
+    assert worker.configuration.agent_run_id == aggregator.configuration.agent_run_id
+
+    worker._stats_engine.custom_events.add(create_custom_event("Custom", {"a": 1}))
+    worker.record_custom_metric("Custom/Worker", 1.0)
+
+    @transient_function_wrapper("newrelic.core.agent_protocol", "AgentProtocol.send")
+    def no_requests_sent(wrapped, instance, args, kwargs):
+        assert False, "The worker sent a request to the data collector."
+
+    no_requests_sent(worker.harvest)()
+
+    # The data has been handed over to the aggregator, to be reported by
+    # it with its own harvest.
+
+    assert worker._stats_engine.custom_events.num_samples == 0
+
+    stats = aggregator._stats_engine
+    assert stats.custom_events.num_samples == 1
+    assert ("Custom/Worker", "") in stats.stats_table
+    assert ("Instance/Reporting", "") in stats.stats_table
+
+
+def test_worker_harvest_retried(aggregator, server):
+    worker = connect_worker(server)
+    server.stop()
+
+    worker._stats_engine.custom_events.add(create_custom_event("Custom", {"a": 1}))
+    worker.harvest()
+
+    # The aggregator could not be reached, so the data is kept to be
+    # handed over with the next harvest.
+
+    assert worker._stats_engine.custom_events.num_samples == 1
+    assert aggregator._stats_engine.custom_events.num_samples == 0
+
+
+def test_client_unavailable(tmpdir):
+    client = AggregatorClient(str(tmpdir.join("missing.sock")), timeout=1.0)
+
+    with pytest.raises(RetryDataForRequest):
+        client.connect(APP_NAME, [])
+
+
+def test_client_restart_on_new_session(aggregator, server):
+    client = AggregatorClient(server.path, timeout=5.0)
+    configuration = client.connect(APP_NAME, [])
+
+    stats = StatsEngine()
+    stats.reset_stats(configuration)
+
+    with pytest.raises(ForceAgentRestart):
+        client.send_stats_engine(APP_NAME, "stale-run-id", stats, 0)
+
+    client.send_stats_engine(APP_NAME, configuration.agent_run_id, stats, 0)
+
+
+def test_server_creates_private_directory(aggregator, tmpdir):
+    path = str(tmpdir.join("sockets", "aggregator.sock"))
+
+    server = AggregatorServer(path, agent=FakeAgent(aggregator))
+    server.start()
+
+    try:
+        assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+        assert AggregatorClient(path, timeout=5.0).connect(APP_NAME, [])
+    finally:
+        server.stop()
+
+
+def test_server_rejects_insecure_directory(aggregator, tmpdir):
+    tmpdir.chmod(0o755)
+
+    server = AggregatorServer(str(tmpdir.join("aggregator.sock")), agent=FakeAgent(aggregator))
+
+    with pytest.raises(RuntimeError):
+        server.start()
+
+
+def test_client_rejects_insecure_directory(aggregator, server, tmpdir):
+    # Another user able to access the directory could have replaced the
+    # socket, so nothing is sent to or received from it.
+
+    tmpdir.chmod(0o755)
+
+    with pytest.raises(RetryDataForRequest):
+        AggregatorClient(server.path, timeout=5.0).connect(APP_NAME, [])
+
+    assert server.agent.activated == []
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_PEERCRED"), reason="Peer credentials are not supported")
+def test_peer_running_as_another_user(monkeypatch):
+    uid = os.getuid()
+    sock, peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        _check_peer(sock)
+
+        monkeypatch.setattr(os, "getuid", lambda: uid + 1)
+
+        with pytest.raises(RuntimeError):
+            _check_peer(sock)
+    finally:
+        sock.close()
+        peer.close()
@@ -0,0 +1,119 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import random
+
+import pytest
+
+from newrelic.common.bounded_cache import BoundedCache
+from newrelic.core.attribute_filter import (
+    DST_ALL,
+    DST_BROWSER_MONITORING,
+    DST_ERROR_COLLECTOR,
+    DST_NONE,
+    DST_SPAN_EVENTS,
+    DST_TRANSACTION_EVENTS,
+    DST_TRANSACTION_SEGMENTS,
+    DST_TRANSACTION_TRACER,
+    AttributeFilter,
+)
+
+DESTINATIONS = {
+    "transaction_events": DST_TRANSACTION_EVENTS,
+    "transaction_tracer": DST_TRANSACTION_TRACER,
+    "error_collector": DST_ERROR_COLLECTOR,
+    "browser_monitoring": DST_BROWSER_MONITORING,
+    "span_events": DST_SPAN_EVENTS,
+    "transaction_segments": DST_TRANSACTION_SEGMENTS,
+}
+
+NAMES = ["", "a", "ab", "abc", "abd", "b", "ba", "request.id", "request.headers.host"]
+
+
+def default_settings(**overrides):
+    settings = {"attributes.enabled": True}
+    for destination in DESTINATIONS:
+        settings["%s.attributes.enabled" % destination] = True
+    settings.update(overrides)
+    return settings
+
+
+def apply_rules_in_order(attribute_filter, name, default_destinations):
+    # Reference implementation which applies every matching rule in turn.
+
+    destinations = attribute_filter.enabled_destinations & default_destinations
+
+    for rule in attribute_filter.rules:
+        if rule.name_match(name):
+            if rule.is_include:
+                destinations |= rule.destinations & attribute_filter.enabled_destinations
+            else:
+                destinations &= ~rule.destinations
+
+    return destinations
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_compiled_rules_match_rule_scan(seed):
+    rng = random.Random(seed)
+    patterns = [name + wildcard for name in NAMES for wildcard in ("", "*")]
+
+    settings = default_settings()
+    settings["browser_monitoring.attributes.enabled"] = rng.random() < 0.5
+    for prefix in ["attributes"] + ["%s.attributes" % d for d in DESTINATIONS]:
+        settings["%s.include" % prefix] = rng.sample(patterns, rng.randint(0, 4))
+        settings["%s.exclude" % prefix] = rng.sample(patterns, rng.randint(0, 4))
+
+    attribute_filter = AttributeFilter(settings)
+
+    for name, default_destinations in itertools.product(NAMES + ["abcd", "c"], (DST_ALL, DST_NONE, 0x5)):
+        expected = apply_rules_in_order(attribute_filter, name, default_destinations)
+        assert attribute_filter.apply(name, default_destinations) == expected, (name, attribute_filter)
+
+
+def test_attribute_filter_cache_is_bounded():
+    attribute_filter = AttributeFilter(default_settings(**{"attributes.filter_cache_size": 10}))
+
+    for i in range(100):
+        assert attribute_filter.apply("request.id.%d" % i, DST_ALL) == DST_ALL
+
+    assert len(attribute_filter.cache) <= 10
+
+
+def test_bounded_cache_keeps_recently_used_entries():
+    cache = BoundedCache(4)
+
+    cache["a"] = 1
+    cache["b"] = 2
+    cache["c"] = 3
+
+    # Looking up "a" keeps it in the cache, while "b" is evicted.
+
+    assert cache.get("a") == 1
+    cache["d"] = 4
+    cache["e"] = 5
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert len(cache) <= 4
+
+
+def test_bounded_cache_disabled():
+    cache = BoundedCache(0)
+    cache["a"] = 1
+
+    assert "a" not in cache
+    assert len(cache) == 0
@@ -0,0 +1,98 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.connect_cache import ConnectCache, connect_cache, interpreter_key
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return ConnectCache(str(tmpdir.join("cache")))
+
+
+def test_connect_cache_get_set(cache):
+    assert cache.get("name", ["key", 1]) is None
+    assert cache.get("name", ["key", 1], {}) == {}
+
+    cache.set("name", ["key", 1], {"a": [1, 2]})
+
+    assert cache.get("name", ["key", 1]) == {"a": [1, 2]}
+    assert cache.get("name", ["key", 2]) is None
+    assert cache.get("other", ["key", 1]) is None
+
+
+def test_connect_cache_keeps_latest_key(cache):
+    cache.set("name", "first", 1)
+    cache.set("other", "first", 2)
+    cache.set("name", "second", 3)
+
+    assert cache.get("name", "first") is None
+    assert cache.get("name", "second") == 3
+    assert cache.get("other", "first") == 2
+
+    assert len(os.listdir(cache.directory)) == 2
+
+
+def test_connect_cache_invalid_entry(cache):
+    cache.set("name", "key", 1)
+
+    (entry,) = os.listdir(cache.directory)
+    with open(os.path.join(cache.directory, entry), "w") as fp:
+        fp.write('{"key": "ke')
+
+    assert cache.get("name", "key") is None
+
+
+def test_connect_cache_unwritable_directory(tmpdir):
+    path = tmpdir.join("file")
+    path.write("")
+
+    cache = ConnectCache(str(path))
+    cache.set("name", "key", 1)
+
+    assert cache.get("name", "key") is None
+
+
+@pytest.mark.parametrize("enabled", (True, False))
+def test_connect_cache_settings(enabled, tmpdir):
+    settings = finalize_application_settings(
+        {"connect_cache.enabled": enabled, "connect_cache.directory": str(tmpdir)}
+    )
+
+    cache = connect_cache(settings)
+
+    if enabled:
+        assert cache.directory == str(tmpdir)
+    else:
+        assert cache is None
+
+
+def test_interpreter_key_changes_on_install(monkeypatch, tmpdir):
+    monkeypatch.setattr("sys.path", [str(tmpdir)])
+
+    key = interpreter_key()
+    assert interpreter_key() == key
+
+    # Installing a package adds an entry to the directory it is installed
+    # in, updating the modification time of the directory.
+
+    mtime = os.stat(str(tmpdir)).st_mtime
+    tmpdir.mkdir("package-1.0.dist-info")
+    os.utime(str(tmpdir), (mtime + 1, mtime + 1))
+
+    assert interpreter_key() != key
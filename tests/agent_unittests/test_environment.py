@@ -16,6 +16,7 @@ import sys
 
 import pytest
 
+from newrelic.core.config import global_settings
 from newrelic.core.environment import environment_settings
 
 
@@ -141,3 +142,44 @@ def test_uvicorn_dispatcher(monkeypatch, loaded_modules, dispatcher, dispatcher_
     assert actual_dispatcher == dispatcher
     assert actual_dispatcher_version == dispatcher_version
     assert actual_worker_version == worker_version
+
+
+def plugin_list():
+    for key, plugin_list in environment_settings():
+        if key == "Plugin List":
+            return plugin_list
+
+    assert False, "'Plugin List' not found"
+
+
+@pytest.fixture
+def connect_cache(monkeypatch, tmpdir):
+    settings = global_settings()
+    monkeypatch.setattr(settings.connect_cache, "enabled", True)
+    monkeypatch.setattr(settings.connect_cache, "directory", str(tmpdir))
+
+
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="importlib.metadata is not available")
+def test_plugin_versions_cached(connect_cache, monkeypatch):
+    import importlib.metadata
+
+    get_version = importlib.metadata.version
+    looked_up = []
+
+    def version(name):
+        looked_up.append(name)
+        return get_version(name)
+
+    monkeypatch.setattr(importlib.metadata, "version", version)
+
+    plugins = plugin_list()
+    assert "pytest (%s)" % (pytest.__version__) in plugins
+    assert "pytest" in looked_up
+
+    # The versions of the packages, including of those for which no
+    # version could be found, are not looked up again.
+
+    del looked_up[:]
+
+    assert plugin_list() == plugins
+    assert looked_up == []
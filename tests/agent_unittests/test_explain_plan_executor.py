@@ -0,0 +1,278 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import types
+
+import pytest
+
+from newrelic.core.database_utils import (
+    ExplainPlanExecutor,
+    explain_plan,
+    sql_statement,
+)
+
+CONNECT_PARAMS = ((), {"database": "test"})
+
+
+class FakeCursor(object):
+    def __init__(self, module):
+        self.module = module
+        self.description = None
+        self.query = None
+
+    def execute(self, query, *args, **kwargs):
+        module = self.module
+
+        with module.lock:
+            module.executed.append(query)
+            module.running += 1
+            module.max_running = max(module.max_running, module.running)
+            module.changed.notify_all()
+
+        try:
+            if module.execute_hook:
+                module.execute_hook()
+        finally:
+            with module.lock:
+                module.running -= 1
+
+        self.description = [("plan",)]
+        self.query = query
+
+    def fetchall(self):
+        return [(self.query,)]
+
+
+class FakeConnection(object):
+    def __init__(self, module):
+        self.module = module
+        self.closed = False
+        self.rollbacks = 0
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self.module)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def fake_dbapi2_module():
+    module = types.ModuleType("fake_dbapi2")
+
+    module._nr_database_product = "Fake"
+    module._nr_explain_query = "EXPLAIN"
+    module._nr_explain_stmts = ("select",)
+    module.NotSupportedError = NotImplementedError
+
+    module.lock = threading.Lock()
+    module.changed = threading.Condition(module.lock)
+    module.executed = []
+    module.connections = []
+    module.running = 0
+    module.max_running = 0
+    module.execute_hook = None
+
+    def connect(*args, **kwargs):
+        connection = FakeConnection(module)
+        module.connections.append(connection)
+        return connection
+
+    module.connect = connect
+
+    return module
+
+
+@pytest.fixture
+def dbapi2_module():
+    return fake_dbapi2_module()
+
+
+@pytest.fixture
+def executor():
+    executor = ExplainPlanExecutor(2, timeout=5.0, cache_ttl=300.0)
+    yield executor
+    executor.shutdown(timeout=5.0)
+
+
+def run_explain_plan(connections, dbapi2_module, sql):
+    statement = sql_statement(sql, dbapi2_module)
+    return explain_plan(connections, statement, CONNECT_PARAMS, None, None, None, "raw")
+
+
+def test_explain_plan_executor_runs_plan(executor, dbapi2_module):
+    plan = run_explain_plan(executor, dbapi2_module, "SELECT * FROM users WHERE id = 1")
+
+    assert plan == (["plan"], [("EXPLAIN SELECT * FROM users WHERE id = 1",)])
+    assert executor.stats() == (1, 0)
+
+
+def test_explain_plan_executor_not_explainable(executor, dbapi2_module):
+    assert run_explain_plan(executor, dbapi2_module, "DELETE FROM users") is None
+
+    statement = sql_statement("SELECT 1", dbapi2_module)
+    assert executor.submit(statement, None, None, None, None, "raw") is None
+
+    assert dbapi2_module.executed == []
+    assert executor.stats() == (0, 0)
+
+
+def test_explain_plan_executor_caches_by_normalized_sql(executor, dbapi2_module):
+    first = run_explain_plan(executor, dbapi2_module, "SELECT * FROM users WHERE id = 1")
+    second = run_explain_plan(executor, dbapi2_module, "SELECT * FROM users WHERE id = 2")
+
+    assert second == first
+    assert len(dbapi2_module.executed) == 1
+    assert executor.stats() == (1, 0)
+
+
+def test_explain_plan_executor_cache_expires(dbapi2_module):
+    executor = ExplainPlanExecutor(1, cache_ttl=0.0)
+
+    try:
+        run_explain_plan(executor, dbapi2_module, "SELECT * FROM users")
+        run_explain_plan(executor, dbapi2_module, "SELECT * FROM users")
+    finally:
+        executor.shutdown(timeout=5.0)
+
+    assert len(dbapi2_module.executed) == 2
+
+
+def test_explain_plan_executor_keeps_connections(dbapi2_module):
+    executor = ExplainPlanExecutor(1, cache_ttl=0.0)
+
+    try:
+        run_explain_plan(executor, dbapi2_module, "SELECT * FROM users")
+        run_explain_plan(executor, dbapi2_module, "SELECT * FROM groups")
+
+        # The one connection is reused and kept open between plans.
+
+        assert len(dbapi2_module.connections) == 1
+        assert not dbapi2_module.connections[0].closed
+    finally:
+        executor.shutdown(timeout=5.0)
+
+    assert dbapi2_module.connections[0].closed
+
+
+def test_explain_plan_executor_rolls_back_after_plan(dbapi2_module):
+    executor = ExplainPlanExecutor(1, cache_ttl=0.0)
+
+    try:
+        run_explain_plan(executor, dbapi2_module, "SELECT * FROM users")
+        run_explain_plan(executor, dbapi2_module, "SELECT * FROM groups")
+
+        # The connection isn't left idle within a transaction.
+
+        (connection,) = dbapi2_module.connections
+        assert connection.rollbacks == 2
+        assert not connection.closed
+    finally:
+        executor.shutdown(timeout=5.0)
+
+
+def test_explain_plan_executor_discards_failed_connection(dbapi2_module):
+    executor = ExplainPlanExecutor(1, cache_ttl=0.0)
+
+    def fail():
+        raise RuntimeError("current transaction is aborted")
+
+    try:
+        dbapi2_module.execute_hook = fail
+        assert run_explain_plan(executor, dbapi2_module, "SELECT * FROM users") is None
+
+        dbapi2_module.execute_hook = None
+        assert run_explain_plan(executor, dbapi2_module, "SELECT * FROM users")
+
+        # The connection the explain plan failed on is closed, and a new
+        # connection made for the next one.
+
+        assert len(dbapi2_module.connections) == 2
+        assert dbapi2_module.connections[0].closed
+        assert not dbapi2_module.connections[1].closed
+    finally:
+        executor.shutdown(timeout=5.0)
+
+
+def test_explain_plan_executor_closes_idle_connections(dbapi2_module):
+    executor = ExplainPlanExecutor(1, cache_ttl=0.0, idle_timeout=0.05)
+
+    try:
+        run_explain_plan(executor, dbapi2_module, "SELECT * FROM users")
+
+        (connection,) = dbapi2_module.connections
+        for _ in range(500):
+            if connection.closed:
+                break
+            threading.Event().wait(0.01)
+
+        assert connection.closed
+
+        # A new connection is made for the next explain plan.
+
+        assert run_explain_plan(executor, dbapi2_module, "SELECT * FROM users")
+        assert len(dbapi2_module.connections) == 2
+    finally:
+        executor.shutdown(timeout=5.0)
+
+
+def test_explain_plan_executor_runs_in_parallel(executor, dbapi2_module):
+    def wait_for_other_worker():
+        with dbapi2_module.lock:
+            while dbapi2_module.max_running < 2:
+                if not dbapi2_module.changed.wait(5.0):
+                    break
+
+    dbapi2_module.execute_hook = wait_for_other_worker
+
+    statements = [sql_statement("SELECT * FROM table_%d" % i, dbapi2_module) for i in range(4)]
+
+    for statement in statements:
+        executor.submit(statement, CONNECT_PARAMS, None, None, None, "raw")
+
+    plans = [executor.explain_plan(statement, CONNECT_PARAMS, None, None, None, "raw") for statement in statements]
+
+    assert all(plans)
+    assert dbapi2_module.max_running == 2
+    assert executor.stats() == (4, 0)
+
+
+def test_explain_plan_executor_timeout(dbapi2_module):
+    executor = ExplainPlanExecutor(1, timeout=0.05)
+    release = threading.Event()
+
+    dbapi2_module.execute_hook = lambda: release.wait(5.0)
+
+    try:
+        assert run_explain_plan(executor, dbapi2_module, "SELECT * FROM users") is None
+        assert executor.stats() == (1, 1)
+
+        # Once the slow explain plan completes its result is cached and
+        # used next time without it being run again.
+
+        release.set()
+
+        for _ in range(500):
+            plan = run_explain_plan(executor, dbapi2_module, "SELECT * FROM users")
+            if plan is not None:
+                break
+            threading.Event().wait(0.01)
+
+        assert plan == (["plan"], [("EXPLAIN SELECT * FROM users",)])
+        assert len(dbapi2_module.executed) == 1
+    finally:
+        executor.shutdown(timeout=5.0)
@@ -14,6 +14,7 @@
 
 import random
 import tempfile
+import threading
 import time
 
 import pytest
@@ -28,13 +29,17 @@ from newrelic.common.object_wrapper import function_wrapper, transient_function_
 from newrelic.core.application import Application
 from newrelic.core.config import finalize_application_settings, global_settings
 from newrelic.core.custom_event import create_custom_event
+from newrelic.core.database_utils import SQLStatementCache, sql_statement
 from newrelic.core.error_node import ErrorNode
 from newrelic.core.function_node import FunctionNode
 from newrelic.core.log_event_node import LogEventNode
 from newrelic.core.root_node import RootNode
-from newrelic.core.stats_engine import CustomMetrics, SampledDataSet
+from newrelic.core.stats_engine import CustomMetrics, FoldedTimeMetrics, SampledDataSet
 from newrelic.core.transaction_node import TransactionNode
-from newrelic.network.exceptions import RetryDataForRequest
+from newrelic.network.exceptions import (
+    PayloadTooLargeForRequest,
+    RetryDataForRequest,
+)
 
 settings = global_settings()
 
@@ -127,6 +132,7 @@ def transaction_node(request):
         apdex_t=0.5,
         suppress_apdex=False,
         custom_metrics=CustomMetrics(),
+        folded_metrics=FoldedTimeMetrics(),
         guid="4485b89db608aece",
         cpu_time=0.0,
         suppress_transaction_trace=False,
@@ -472,6 +478,129 @@ def test_transaction_count(transaction_node):
     assert app._transaction_count == 0
 
 
+def _validate_forty_transaction_events(payload):
+    _, sampling_info, events = payload
+    assert sampling_info["events_seen"] == 40
+    assert len(list(events)) == 40
+
+
+@validate_transaction_event_payloads([_validate_forty_transaction_events])
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "feature_flag": set(),
+        "collect_custom_events": False,
+        "application_logging.forwarding.enabled": False,
+        "stats_engine.shards": 4,
+    },
+)
+def test_transaction_count_stats_engine_shards(transaction_node):
+    app = Application("Python Agent Test (Harvest Loop)")
+    app.connect_to_data_collector(None)
+
+    assert len(app._stats_shards) == 4
+
+    def record_transactions():
+        for _ in range(5):
+            app.record_transaction(transaction_node)
+
+    threads = [threading.Thread(target=record_transactions) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Transactions are only merged into the shards until harvest
+    assert app._transaction_count == 0
+    assert sum(shard.transaction_count for shard in app._stats_shards) == 40
+
+    app.harvest()
+
+    assert app._transaction_count == 0
+    assert sum(shard.transaction_count for shard in app._stats_shards) == 0
+
+
+@validate_metric_payload(
+    metrics=[
+        ("Supportability/Python/RecordQueue/Seen", 2),
+        ("Supportability/Python/RecordQueue/Dropped", 0),
+    ],
+    endpoints_called=[],
+)
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "feature_flag": set(),
+        "collect_custom_events": False,
+        "application_logging.forwarding.enabled": False,
+        "record_queue.enabled": True,
+    },
+)
+def test_transaction_count_record_queue(transaction_node):
+    app = Application("Python Agent Test (Harvest Loop)")
+    app.connect_to_data_collector(None)
+
+    app.record_transaction(transaction_node)
+    app.record_transaction(transaction_node)
+
+    # Transactions are recorded from the aggregator thread
+    assert app._record_queue.flush(timeout=5.0)
+    assert app._transaction_count == 2
+
+    app.harvest(shutdown=True)
+
+    assert app._transaction_count == 0
+    assert app._record_queue is None
+
+
+@validate_metric_payload(
+    metrics=[
+        ("Supportability/Python/SQLStatementCache/Hits", 2),
+        ("Supportability/Python/SQLStatementCache/Misses", 2),
+    ],
+    endpoints_called=[],
+)
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "feature_flag": set(),
+    },
+)
+def test_sql_statement_cache_metrics(monkeypatch):
+    monkeypatch.setattr("newrelic.core.database_utils._sql_statements", SQLStatementCache(10, 100))
+
+    app = Application("Python Agent Test (Harvest Loop)")
+    app.connect_to_data_collector(None)
+
+    statement = sql_statement("SELECT * FROM foo WHERE id = 1", None)
+    assert sql_statement("SELECT * FROM foo WHERE id = 1", None) is statement
+    assert sql_statement("SELECT * FROM foo WHERE id = 1", None) is statement
+    assert sql_statement("SELECT * FROM bar WHERE id = 1", None) is not statement
+
+    app.harvest()
+
+
+def test_sql_statement_cache_limits():
+    cache = SQLStatementCache(10, 100)
+
+    for i in range(100):
+        cache.get("SELECT * FROM foo WHERE id = %d" % i, None)
+
+    assert len(cache) <= 10
+
+    long_sql = "SELECT * FROM foo WHERE id IN (%s)" % ",".join(["1"] * 100)
+    assert cache.get(long_sql, None) is not cache.get(long_sql, None)
+
+    assert cache.stats() == (0, 102)
+    assert cache.stats() == (0, 0)
+
+
 @override_generic_settings(
     settings,
     {
@@ -540,6 +669,56 @@ def test_reservoir_sizes(transaction_node):
     assert app._stats_engine.span_events.num_samples == 102
 
 
+@pytest.mark.parametrize("reservoir_priority, expect_created", ((2.0, False), (0.5, True)))
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "distributed_tracing.enabled": True,
+        "span_events.enabled": True,
+        "event_harvest_config.harvest_limits.analytic_event_data": 1,
+        "event_harvest_config.harvest_limits.span_event_data": 1,
+    },
+)
+def test_full_reservoir_skips_creating_events(transaction_node, monkeypatch, reservoir_priority, expect_created):
+    app = Application("Python Agent Test (Harvest Loop)")
+    app.connect_to_data_collector(None)
+
+    stats_engine = app._stats_engine
+    stats_engine.transaction_events.add("sample", priority=reservoir_priority)
+    stats_engine.span_events.add("sample", priority=reservoir_priority)
+
+    created = []
+
+    def wrap_event_method(name):
+        wrapped = getattr(TransactionNode, name)
+
+        def _wrapper(*args, **kwargs):
+            created.append(name)
+            return wrapped(*args, **kwargs)
+
+        monkeypatch.setattr(TransactionNode, name, _wrapper)
+
+    wrap_event_method("transaction_event")
+    wrap_event_method("span_events")
+
+    app.record_transaction(transaction_node)
+
+    if expect_created:
+        assert created == ["transaction_event", "span_events"]
+        assert list(stats_engine.transaction_events) != ["sample"]
+    else:
+        assert created == []
+        assert list(stats_engine.transaction_events) == ["sample"]
+        assert list(stats_engine.span_events) == ["sample"]
+
+    # Events which were never created are still counted as seen. Add 1
+    # for the root span.
+    assert stats_engine.transaction_events.num_seen == 2
+    assert stats_engine.span_events.num_seen == 1 + 102
+
+
 @pytest.mark.parametrize(
     "harvest_name, event_name",
     [
@@ -983,3 +1162,239 @@ def test_get_agent_commands_raises():
     app.connect_to_data_collector(None)
     with pytest.raises(RetryDataForRequest):
         app.process_agent_commands()
+
+
+@failing_endpoint("span_event_data")
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "distributed_tracing.enabled": True,
+        "agent_limits.data_collector_connections": 4,
+    },
+)
+def test_failed_endpoint_retried_alone():
+    endpoints_called = []
+
+    @validate_metric_payload(
+        metrics=[
+            ("Supportability/Python/Harvest/Exception/newrelic.network.exceptions:RetryDataForRequest", 1),
+            ("Supportability/Events/Customer/Sent", 1),
+            ("Supportability/SpanEvent/TotalEventsSent", None),
+        ],
+        endpoints_called=endpoints_called,
+    )
+    def _test():
+        app = Application("Python Agent Test (Harvest Loop)")
+        app.connect_to_data_collector(None)
+
+        app._stats_engine.span_events.add("span event")
+        app._stats_engine.custom_events.add("custom event")
+        app.harvest()
+
+        # Only the span events which failed to be sent are kept for the
+        # next harvest, with the metric data still being sent.
+
+        assert app._stats_engine.span_events.num_samples == 1
+        assert app._stats_engine.custom_events.num_samples == 0
+
+    _test()
+
+    assert "custom_event_data" in endpoints_called
+    assert "metric_data" in endpoints_called
+
+
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "distributed_tracing.enabled": True,
+        "agent_limits.data_collector_connections": 4,
+    },
+)
+def test_harvest_requests_sent_concurrently():
+    lock = threading.Condition()
+    state = {"in_flight": 0, "max_in_flight": 0}
+
+    @transient_function_wrapper("newrelic.core.agent_protocol", "AgentProtocol.send")
+    def send_request_wrapper(wrapped, instance, args, kwargs):
+        with lock:
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            lock.notify_all()
+
+            # Hold on to the request until another is in flight, or it
+            # is evident requests are being sent one at a time.
+
+            deadline = time.time() + 5.0
+            while state["max_in_flight"] < 2 and time.time() < deadline:
+                lock.wait(deadline - time.time())
+
+        try:
+            return wrapped(*args, **kwargs)
+        finally:
+            with lock:
+                state["in_flight"] -= 1
+
+    app = Application("Python Agent Test (Harvest Loop)")
+    app.connect_to_data_collector(None)
+
+    app._stats_engine.span_events.add("span event")
+    app._stats_engine.custom_events.add("custom event")
+
+    send_request_wrapper(app.harvest)()
+
+    assert state["max_in_flight"] == 2
+    assert app._stats_engine.span_events.num_samples == 0
+    assert app._stats_engine.custom_events.num_samples == 0
+
+
+def payload_size_limit(endpoint, max_events, oversized_event=None, failing_event=None):
+    sent = []
+
+    @transient_function_wrapper("newrelic.core.agent_protocol", "AgentProtocol.send")
+    def send_request_wrapper(wrapped, instance, args, kwargs):
+        def _bind_params(method, payload=(), *args, **kwargs):
+            return method, payload
+
+        method, payload = _bind_params(*args, **kwargs)
+
+        if method == endpoint:
+            _, sampling_info, samples = payload
+            samples = list(samples)
+
+            if len(samples) > max_events or oversized_event in samples:
+                raise PayloadTooLargeForRequest()
+
+            if failing_event in samples:
+                raise RetryDataForRequest()
+
+            sent.append((sampling_info, samples))
+
+        return wrapped(*args, **kwargs)
+
+    return sent, send_request_wrapper
+
+
+@pytest.mark.parametrize(
+    "endpoint,events",
+    (
+        ("analytic_event_data", "transaction_events"),
+        ("custom_event_data", "custom_events"),
+        ("span_event_data", "span_events"),
+    ),
+)
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "distributed_tracing.enabled": True,
+    },
+)
+def test_oversized_event_payloads_split(endpoint, events):
+    sent, send_request_wrapper = payload_size_limit(endpoint, max_events=2)
+
+    @validate_metric_payload(
+        metrics=[
+            ("Supportability/Python/Collector/PayloadSplit/%s" % endpoint, 2),
+        ]
+    )
+    @send_request_wrapper
+    def _test():
+        app = Application("Python Agent Test (Harvest Loop)")
+        app.connect_to_data_collector(None)
+
+        sample_set = getattr(app._stats_engine, events)
+        for i in range(5):
+            sample_set.add("event %d" % i)
+
+        reservoir_size = sample_set.capacity
+
+        app.harvest()
+
+        return reservoir_size
+
+    reservoir_size = _test()
+
+    # The five events are split in two and the larger half split again,
+    # with the counts in the sampling info being split between the parts.
+
+    assert [samples for _, samples in sent] == [
+        ["event 0", "event 1"],
+        ["event 2"],
+        ["event 3", "event 4"],
+    ]
+    assert sum(info["events_seen"] for info, _ in sent) == 5
+    assert sum(info["reservoir_size"] for info, _ in sent) == reservoir_size
+
+
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+    },
+)
+def test_oversized_event_dropped():
+    sent, send_request_wrapper = payload_size_limit("custom_event_data", max_events=10, oversized_event="event 1")
+
+    @send_request_wrapper
+    def _test():
+        app = Application("Python Agent Test (Harvest Loop)")
+        app.connect_to_data_collector(None)
+
+        for i in range(3):
+            app._stats_engine.custom_events.add("event %d" % i)
+
+        app.harvest()
+
+        assert app._stats_engine.custom_events.num_samples == 0
+
+    _test()
+
+    assert [samples for _, samples in sent] == [["event 0"], ["event 2"]]
+
+
+@pytest.mark.parametrize(
+    "endpoint,events",
+    (
+        ("analytic_event_data", "transaction_events"),
+        ("custom_event_data", "custom_events"),
+        ("span_event_data", "span_events"),
+    ),
+)
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "distributed_tracing.enabled": True,
+    },
+)
+def test_split_event_payload_partially_retried(endpoint, events):
+    sent, send_request_wrapper = payload_size_limit(endpoint, max_events=2, failing_event="event 3")
+
+    @send_request_wrapper
+    def _test():
+        app = Application("Python Agent Test (Harvest Loop)")
+        app.connect_to_data_collector(None)
+
+        for i in range(5):
+            getattr(app._stats_engine, events).add("event %d" % i)
+
+        app.harvest()
+
+        return getattr(app._stats_engine, events)
+
+    sample_set = _test()
+
+    # Only the part of the events which failed to be sent is kept for the
+    # next harvest, rather than the events which were accepted being sent
+    # again.
+
+    assert [samples for _, samples in sent] == [["event 0", "event 1"], ["event 2"]]
+    assert list(sample_set) == ["event 3", "event 4"]
+    assert sample_set.num_seen == 2
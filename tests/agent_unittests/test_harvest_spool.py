@@ -0,0 +1,302 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import io
+import os
+import time
+
+import pytest
+
+try:
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from urllib.parse import parse_qs, urlparse
+
+from testing_support.mock_external_http_server import MockExternalHTTPServer
+
+from newrelic.common.agent_http import DeveloperModeClient, InsecureHttpClient
+from newrelic.common.encoding_utils import json_decode, json_encode
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.data_collector import Session
+from newrelic.core.harvest_spool import HarvestSpool
+from newrelic.network.exceptions import RetryDataForRequest
+
+MAX_SIZE = 64 * 1024
+SEGMENT_SIZE = 1024
+MAX_AGE = 3600.0
+
+
+@pytest.fixture
+def spool(tmpdir):
+    return HarvestSpool(str(tmpdir.join("spool")), MAX_SIZE, SEGMENT_SIZE, MAX_AGE)
+
+
+def replay_all(spool, limit=None):
+    sent = []
+    spool.replay(lambda method, payload: sent.append((method, payload)), limit)
+    return sent
+
+
+def test_spool_replay(spool):
+    assert spool.write("metric_data", ["RUN", 1.0, 2.0, []])
+    assert spool.write("analytic_event_data", ["RUN", {"events_seen": 1}, [{"a": 1}]])
+
+    assert replay_all(spool) == [
+        ("metric_data", ["RUN", 1.0, 2.0, []]),
+        ("analytic_event_data", ["RUN", {"events_seen": 1}, [{"a": 1}]]),
+    ]
+
+    # Requests are only replayed once.
+
+    assert replay_all(spool) == []
+    assert os.listdir(spool.directory) == []
+
+
+def test_spool_segments_closed_at_segment_size(spool):
+    payload = ["x" * 300]
+
+    for _ in range(10):
+        assert spool.write("error_data", payload)
+
+    spool.flush()
+
+    segments = spool.segments()
+    assert len(segments) > 1
+    assert all(os.path.getsize(path) <= SEGMENT_SIZE for path in segments)
+
+    assert replay_all(spool) == [("error_data", payload)] * 10
+
+
+def test_spool_pruned_to_max_size(tmpdir):
+    spool = HarvestSpool(str(tmpdir), 4 * SEGMENT_SIZE, SEGMENT_SIZE, MAX_AGE)
+
+    for i in range(40):
+        assert spool.write("error_data", [i, "x" * 200])
+
+    spool.flush()
+
+    assert sum(os.path.getsize(path) for path in spool.segments()) <= 4 * SEGMENT_SIZE
+
+    # The oldest requests are the ones discarded.
+
+    sent = [payload[0] for _, payload in replay_all(spool)]
+    assert sent == list(range(40 - len(sent), 40))
+
+
+def test_spool_oversized_request_not_written(tmpdir):
+    spool = HarvestSpool(str(tmpdir), SEGMENT_SIZE, SEGMENT_SIZE, MAX_AGE)
+
+    assert not spool.write("error_data", ["x" * SEGMENT_SIZE])
+    assert replay_all(spool) == []
+
+
+def test_spool_expired_segments_removed(spool):
+    spool.write("error_data", [1])
+    spool.flush()
+
+    expired = time.time() - 2 * MAX_AGE
+    for path in spool.segments():
+        os.utime(path, (expired, expired))
+
+    spool.write("error_data", [2])
+
+    assert replay_all(spool) == [("error_data", [2])]
+
+
+def test_spool_written_back_on_failure(spool):
+    for i in range(3):
+        spool.write("error_data", [i])
+
+    sent = []
+
+    def send(method, payload):
+        if payload == [1]:
+            raise RetryDataForRequest()
+        sent.append(payload)
+
+    with pytest.raises(RetryDataForRequest):
+        spool.replay(send)
+
+    assert sent == [[0]]
+    assert [payload for _, payload in replay_all(spool)] == [[1], [2]]
+
+
+def test_spool_replay_limit(spool):
+    for i in range(5):
+        spool.write("error_data", [i])
+
+    assert [payload for _, payload in replay_all(spool, limit=2)] == [[0], [1]]
+    assert [payload for _, payload in replay_all(spool)] == [[2], [3], [4]]
+
+
+def test_spool_unsent_requests_keep_their_age(spool):
+    spool.write("error_data", [1])
+    spool.write("error_data", [2])
+    spool.flush()
+
+    (path,) = spool.segments()
+    written = time.time() - MAX_AGE / 2
+    os.utime(path, (written, written))
+
+    # A newer segment must still be replayed after the requests left
+    # over from the older one.
+
+    spool.write("error_data", [3])
+
+    def send(method, payload):
+        raise RetryDataForRequest()
+
+    with pytest.raises(RetryDataForRequest):
+        spool.replay(send)
+
+    assert spool.segments()[0] == path
+    assert os.path.getmtime(path) == pytest.approx(written)
+
+    assert [payload for _, payload in replay_all(spool, limit=1)] == [[1]]
+    assert spool.segments()[0] == path
+    assert os.path.getmtime(path) == pytest.approx(written)
+
+    # Once the segment expires the requests left in it are discarded.
+
+    expired = time.time() - 2 * MAX_AGE
+    os.utime(path, (expired, expired))
+
+    assert [payload for _, payload in replay_all(spool)] == [[3]]
+
+
+def test_spool_truncated_record_ignored(spool):
+    spool.write("error_data", [1])
+    spool.write("error_data", [2])
+    spool.flush()
+
+    # Simulate the process having been killed part way through writing
+    # the last record.
+
+    (path,) = spool.segments()
+    with open(path, "rb+") as fp:
+        fp.truncate(os.path.getsize(path) - 3)
+
+    assert replay_all(spool) == [("error_data", [1])]
+
+
+def test_spool_segment_claimed_by_another_process(spool):
+    spool.write("error_data", [1])
+    spool.flush()
+
+    (path,) = spool.segments()
+    os.rename(path, path + ".1.replay")
+
+    assert replay_all(spool) == []
+
+
+class FakeCollector(MockExternalHTTPServer):
+
+    """Data collector which records the requests made to it, and which
+    responds with a 503 for requests for data while it is down.
+
+    """
+
+    def __init__(self):
+        collector = self
+        self.down = False
+        self.run_ids = iter(range(1000, 2000))
+        self.requests = []
+
+        def handler(self):
+            params = parse_qs(urlparse(self.path).query)
+            method = params["method"][0]
+
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+
+            if method in ("preconnect", "connect", "agent_settings"):
+                status, response = 200, DeveloperModeClient.RESPONSES[method]
+                if method == "preconnect":
+                    response = {"redirect_host": "localhost"}
+                elif method == "connect":
+                    response = dict(response, agent_run_id=str(next(collector.run_ids)))
+            elif collector.down:
+                status, response = 503, None
+            else:
+                status, response = 200, None
+                collector.requests.append((method, json_decode(body.decode("utf-8"))))
+
+            self.send_response(status)
+            self.end_headers()
+            self.wfile.write(json_encode({"return_value": response}).encode("utf-8"))
+
+        super(FakeCollector, self).__init__(handler=handler)
+
+
+class FakeCollectorSession(Session):
+    CLIENT = InsecureHttpClient
+
+
+@pytest.fixture
+def collector():
+    with FakeCollector() as collector:
+        yield collector
+
+
+def connect_session(collector, directory):
+    settings = finalize_application_settings(
+        {
+            "host": "localhost",
+            "port": collector.port,
+            "spool.enabled": True,
+            "spool.directory": directory,
+            "utilization.detect_aws": False,
+            "utilization.detect_azure": False,
+            "utilization.detect_docker": False,
+            "utilization.detect_gcp": False,
+            "utilization.detect_kubernetes": False,
+            "utilization.detect_pcf": False,
+        }
+    )
+    return FakeCollectorSession("Python Agent Test (harvest spool)", [], {}, settings)
+
+
+def test_spool_replayed_to_collector(collector, tmpdir):
+    session = connect_session(collector, str(tmpdir))
+
+    collector.down = True
+
+    session.send_errors([["error"]])
+    session.send_metric_data(1.0, 2.0, [])
+    session.close_connection()
+
+    assert collector.requests == []
+
+    # While the data collector is down, replay is backed off.
+
+    assert session.replay_spool() == 0
+    assert session.replay_spool() == 0
+
+    collector.down = False
+
+    # A session for a later process replays the spooled requests, under
+    # its own run ID.
+
+    session = connect_session(collector, str(tmpdir))
+    run_id = session.agent_run_id
+
+    assert session.replay_spool() == 2
+    assert collector.requests == [
+        ("error_data", [run_id, [["error"]]]),
+        ("metric_data", [run_id, 1.0, 2.0, []]),
+    ]
+
+    assert session.replay_spool() == 0
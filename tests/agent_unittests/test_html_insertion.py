@@ -0,0 +1,118 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.api.html_insertion import HTMLInsertionScanner, insert_html_snippet
+
+SNIPPET = b"<!--RUM-->"
+
+_test_html_insertion = [
+    (
+        b'<html><head><meta charset="utf-8"><title>T</title></head><body>x</body></html>',
+        b'<html><head><meta charset="utf-8"><!--RUM--><title>T</title></head><body>x</body></html>',
+    ),
+    (
+        b'<html><HEAD><meta http-equiv="X-UA-Compatible" content="IE=edge">'
+        b'<meta charset="utf-8"></head><body></body></html>',
+        b'<html><HEAD><meta http-equiv="X-UA-Compatible" content="IE=edge">'
+        b'<meta charset="utf-8"><!--RUM--></head><body></body></html>',
+    ),
+    (
+        b'<html><head><meta charset="utf-8"><meta http-equiv="x-ua-compatible" content="IE=edge">'
+        b"</head><body></body></html>",
+        b'<html><head><meta charset="utf-8"><meta http-equiv="x-ua-compatible" content="IE=edge">'
+        b"<!--RUM--></head><body></body></html>",
+    ),
+    (
+        b"<html><head><title>T</title></head><body></body></html>",
+        b"<html><head><!--RUM--><title>T</title></head><body></body></html>",
+    ),
+    (
+        b"<html><BODY class='x'>text</BODY></html>",
+        b"<html><!--RUM--><BODY class='x'>text</BODY></html>",
+    ),
+    (
+        b"<html><head><meta http-equiv=\"Content-Disposition\" content='attachment; filename=a.html'>"
+        b"</head><body></body></html>",
+        b"<html><head><meta http-equiv=\"Content-Disposition\" content='attachment; filename=a.html'>"
+        b"</head><body></body></html>",
+    ),
+    (
+        b"<html><head></head><body><head><meta charset='utf-8'></body></html>",
+        b"<html><head><!--RUM--></head><body><head><meta charset='utf-8'></body></html>",
+    ),
+    (
+        b"<html><head></head><p>no body element</p></html>",
+        None,
+    ),
+]
+
+
+def scan_in_chunks(data, size, search_limit=64 * 1024):
+    scanner = HTMLInsertionScanner(search_limit)
+
+    for start in range(0, len(data), size):
+        if scanner.feed(data[start : start + size]):
+            return scanner.insert(data, SNIPPET)
+
+    return None
+
+
+@pytest.mark.parametrize("data,expected", _test_html_insertion)
+def test_html_insertion(data, expected):
+    assert insert_html_snippet(data, lambda: SNIPPET) == expected
+
+
+@pytest.mark.parametrize("data,expected", _test_html_insertion)
+@pytest.mark.parametrize("size", (1, 2, 3, 7, 16))
+def test_html_insertion_chunked(data, expected, size):
+    # The same insertion point must be found however the data is split
+    # up, including where tags are split across chunks.
+
+    assert scan_in_chunks(data, size) == expected
+
+
+def test_html_insertion_empty_text():
+    data = b"<html><head></head><body></body></html>"
+
+    assert insert_html_snippet(data, lambda: b"") == data
+
+
+def test_html_insertion_body_past_search_limit():
+    data = b"<html><head></head>" + b" " * 100 + b"<body></body></html>"
+
+    assert insert_html_snippet(data, lambda: SNIPPET, search_limit=50) == data
+    assert scan_in_chunks(data, 8, search_limit=50) is None
+
+
+def test_html_insertion_body_straddling_search_limit():
+    data = b"<html><head></head><body class='long'></body></html>"
+    limit = data.index(b"<body") + 3
+
+    assert insert_html_snippet(data, lambda: SNIPPET, search_limit=limit) == data
+    assert scan_in_chunks(data, 4, search_limit=limit) is None
+
+
+def test_html_insertion_scanner_stops_at_body():
+    scanner = HTMLInsertionScanner()
+
+    assert not scanner.feed(b"<html><head></head><bo")
+    assert scanner.feed(b"dy>")
+    assert scanner.body == len(b"<html><head></head>")
+
+    # Once the body element is found, no more data is scanned.
+
+    assert scanner.feed(b"<meta charset='utf-8'>")
+    assert scanner.insertion_index() == len(b"<html><head>")
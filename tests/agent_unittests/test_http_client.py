@@ -32,7 +32,7 @@ from newrelic.common.agent_http import (
     InsecureHttpClient,
     ServerlessModeClient,
 )
-from newrelic.common.encoding_utils import ensure_str
+from newrelic.common.encoding_utils import ensure_str, json_encode, json_encode_chunks
 from newrelic.common.object_names import callable_name
 from newrelic.core.internal_metrics import InternalTraceContext
 from newrelic.core.stats_engine import CustomMetrics
@@ -357,6 +357,68 @@ def test_http_payload_compression(server, client_cls, method, threshold):
     assert sent_payload == payload
 
 
+@pytest.mark.parametrize(
+    "obj",
+    (
+        [],
+        (1, "two", 3.0, None, True),
+        ["run_id", {"reservoir_size": 10, "events_seen": 2}, [[{"a": 1}, {}, {"b": "c"}]] * 50],
+        (x for x in range(1000)),
+        [b"latin-1 \xe9", u"unicode \u2603", {"nested": [[1, [2, [3, [4]]]]]}],
+    ),
+)
+def test_json_encode_chunks(obj):
+    if not isinstance(obj, (list, tuple)):
+        obj = list(obj)
+        chunks = list(json_encode_chunks(iter(obj), chunk_size=64))
+    else:
+        chunks = list(json_encode_chunks(obj, chunk_size=64))
+
+    assert all(isinstance(chunk, bytes) for chunk in chunks)
+    assert b"".join(chunks) == json_encode(obj).encode("utf-8")
+
+
+@pytest.mark.parametrize("method", ("gzip", "deflate"))
+@pytest.mark.parametrize("threshold", (0, 100, 1000))
+def test_http_chunked_payload_compression(server, method, threshold):
+    payload = [b"*" * 20] * 10
+    full_payload = b"".join(payload)
+
+    internal_metrics = CustomMetrics()
+
+    with ApplicationModeClient(
+        "localhost",
+        server.port,
+        disable_certificate_validation=True,
+        compression_method=method,
+        compression_threshold=threshold,
+    ) as client:
+        with InternalTraceContext(internal_metrics):
+            status, data = client.send_request(payload=iter(payload), params={"method": "method1"})
+
+    assert status == 200
+    headers = dict(
+        header.split(b":", 1) for header in data.split(b"\n")[1:] if header.startswith(b"content-")
+    )
+    sent_payload = data[-int(headers[b"content-length"]):]
+
+    internal_metrics = dict(internal_metrics.metrics())
+    assert internal_metrics["Supportability/Python/Collector/method1/Output/Bytes"][:2] == [1, len(full_payload)]
+
+    if threshold < len(full_payload):
+        expected_content_encoding = method.encode("utf-8")
+        assert internal_metrics["Supportability/Python/Collector/method1/ZLIB/Bytes"][:2] == [1, len(sent_payload)]
+        decompressor = zlib.decompressobj(31 if method == "gzip" else 15)
+        sent_payload = decompressor.decompress(sent_payload)
+        sent_payload += decompressor.flush()
+    else:
+        expected_content_encoding = b"Identity"
+        assert "Supportability/Python/Collector/method1/ZLIB/Bytes" not in internal_metrics
+
+    assert headers[b"content-encoding"].strip() == expected_content_encoding
+    assert sent_payload == full_payload
+
+
 def test_cert_path(server):
     with HttpClient("localhost", server.port, ca_bundle_path=SERVER_CERT) as client:
         status, data = client.send_request()
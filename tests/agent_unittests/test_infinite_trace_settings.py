@@ -24,6 +24,9 @@ INI_FILE_INFINITE_TRACING = b"""
 infinite_tracing.trace_observer_host = y
 infinite_tracing.trace_observer_port = 1234
 infinite_tracing.span_queue_size = 2000
+infinite_tracing.batching = true
+infinite_tracing.batch_size = 50
+infinite_tracing.batch_linger = 0.01
 """
 
 
@@ -80,3 +83,41 @@ def test_infinite_tracing_span_queue_size(ini, env, expected_size, global_settin
 
     settings = global_settings()
     assert settings.infinite_tracing.span_queue_size == expected_size
+
+
+# Tests for loading Infinite Tracing span batching settings
+# and testing values precedence
+@pytest.mark.parametrize(
+    "ini,env,expected_batching,expected_size,expected_linger",
+    (
+        (INI_FILE_EMPTY, {}, False, 100, 0.0),
+        (
+            INI_FILE_EMPTY,
+            {
+                "NEW_RELIC_INFINITE_TRACING_BATCHING": "true",
+                "NEW_RELIC_INFINITE_TRACING_BATCH_SIZE": "200",
+                "NEW_RELIC_INFINITE_TRACING_BATCH_LINGER": "0.5",
+            },
+            True,
+            200,
+            0.5,
+        ),
+        (
+            INI_FILE_INFINITE_TRACING,
+            {
+                "NEW_RELIC_INFINITE_TRACING_BATCHING": "false",
+                "NEW_RELIC_INFINITE_TRACING_BATCH_SIZE": "200",
+                "NEW_RELIC_INFINITE_TRACING_BATCH_LINGER": "0.5",
+            },
+            True,
+            50,
+            0.01,
+        ),
+    ),
+)
+def test_infinite_tracing_batching(ini, env, expected_batching, expected_size, expected_linger, global_settings):
+
+    settings = global_settings()
+    assert settings.infinite_tracing.batching is expected_batching
+    assert settings.infinite_tracing.batch_size == expected_size
+    assert settings.infinite_tracing.batch_linger == expected_linger
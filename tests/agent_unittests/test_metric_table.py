@@ -0,0 +1,155 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+import newrelic.core.stats_engine as stats_engine_module
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.metric import ApdexMetric, TimeMetric
+from newrelic.core.stats_engine import MetricTable, StatsEngine
+
+
+def create_stats_engine(columnar):
+    settings = finalize_application_settings({"stats_engine.columnar_metrics": columnar})
+    stats = StatsEngine()
+    stats.reset_stats(settings)
+    return stats
+
+
+def record_metrics(stats, offset=0):
+    for i in range(100):
+        duration = ((i + offset) % 7) * 0.25
+        stats.record_time_metric(TimeMetric(name="Function/%d" % (i % 80), scope="", duration=duration, exclusive=None))
+        stats.record_time_metric(
+            TimeMetric(name="Function/%d" % (i % 30), scope="WebTransaction/Foo", duration=duration, exclusive=0.1)
+        )
+        stats.record_apdex_metric(
+            ApdexMetric(
+                name="Apdex/%d" % (i % 5),
+                satisfying=(i + offset) % 2,
+                tolerating=((i + offset) % 3 == 0) and 1 or 0,
+                frustrating=0,
+                apdex_t=0.5 + (i % 3) * 0.1,
+            )
+        )
+        stats.record_custom_metric("Custom/Value/%d" % (i % 10), float(i + offset))
+        stats.record_custom_metric("Custom/Count/%d" % (i % 4), {"count": i + offset})
+
+
+def metric_data(stats, normalizer=None):
+    return sorted(
+        ((key["name"], key["scope"]), list(value)) for key, value in stats.metric_data(normalizer)
+    )
+
+
+def assert_metric_data_equal(expected, actual):
+    assert [key for key, _ in expected] == [key for key, _ in actual]
+    for (key, expected_values), (_, actual_values) in zip(expected, actual):
+        assert actual_values == pytest.approx(expected_values), key
+        assert [type(v) for v in actual_values[:3]] == [type(v) for v in expected_values[:3]], key
+
+
+def test_columnar_metrics_setting():
+    assert isinstance(create_stats_engine(True).stats_table, MetricTable)
+    assert isinstance(create_stats_engine(False).stats_table, dict)
+
+
+def test_metric_table_record():
+    expected = create_stats_engine(False)
+    actual = create_stats_engine(True)
+
+    record_metrics(expected)
+    record_metrics(actual)
+
+    assert actual.metrics_count() == expected.metrics_count()
+    assert_metric_data_equal(metric_data(expected), metric_data(actual))
+
+
+@pytest.mark.parametrize("use_numpy", (False, True))
+def test_metric_table_merge(use_numpy, monkeypatch):
+    if use_numpy:
+        pytest.importorskip("numpy")
+        monkeypatch.setattr(stats_engine_module, "NUMPY_MERGE_THRESHOLD", 0)
+    else:
+        monkeypatch.setattr(stats_engine_module, "NUMPY_MERGE_THRESHOLD", float("inf"))
+
+    expected = create_stats_engine(False)
+    actual = create_stats_engine(True)
+
+    for stats in (expected, actual):
+        record_metrics(stats)
+
+        for offset in range(1, 4):
+            workarea = stats.create_workarea()
+            record_metrics(workarea, offset)
+            workarea.record_time_metric(TimeMetric(name="New/%d" % offset, scope="", duration=1.0, exclusive=None))
+            stats.merge_metric_stats(workarea)
+
+    assert_metric_data_equal(metric_data(expected), metric_data(actual))
+
+
+def test_metric_table_metric_data_normalizer():
+    expected = create_stats_engine(False)
+    actual = create_stats_engine(True)
+
+    record_metrics(expected)
+    record_metrics(actual)
+
+    def normalizer(name):
+        return name.rstrip("0123456789"), True
+
+    assert_metric_data_equal(metric_data(expected, normalizer), metric_data(actual, normalizer))
+
+
+def test_metric_table_rollback():
+    expected = create_stats_engine(False)
+    actual = create_stats_engine(True)
+
+    for stats in (expected, actual):
+        record_metrics(stats)
+        snapshot = stats.harvest_snapshot()
+        record_metrics(stats, 1)
+        stats.rollback(snapshot)
+
+    assert_metric_data_equal(metric_data(expected), metric_data(actual))
+
+
+def test_metric_table_row_view():
+    table = MetricTable()
+    table[("Function/foo", "")] = stats_engine_module.TimeStats(1, 2.0, 1.0, 2.0, 2.0, 4.0)
+
+    row = table[("Function/foo", "")]
+    row.merge_time_metric(TimeMetric(name="Function/foo", scope="", duration=1.0, exclusive=0.5))
+
+    assert row.call_count == 2
+    assert isinstance(row.call_count, int)
+    assert row.total_call_time == 3.0
+    assert row.total_exclusive_call_time == 1.5
+    assert row.min_call_time == 1.0
+    assert row.max_call_time == 2.0
+    assert row.sum_of_squares == 5.0
+
+    assert ("Function/foo", "") in table
+    assert table.get(("Function/bar", "")) is None
+
+    key, stats = table.items()[0]
+    assert isinstance(stats, stats_engine_module.TimeStats)
+    assert stats == [2, 3.0, 1.5, 1.0, 2.0, 5.0]
+
+    # The stats engine iterates over the table with six.iteritems(), which
+    # relies on iteritems() on Python 2.
+
+    assert list(table.iteritems()) == table.items()
+    assert list(table.iterkeys()) == table.keys()
+    assert list(table.itervalues()) == table.values()
@@ -0,0 +1,165 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+
+from newrelic.core.record_queue import TransactionRecordQueue
+
+
+class FakeNode(object):
+    def __init__(self, name, priority=0.5):
+        self.name = name
+        self.priority = priority
+
+
+def test_record_queue_records_nodes():
+    recorded = []
+
+    queue = TransactionRecordQueue("test", recorded.append, 10)
+    queue.start()
+
+    nodes = [FakeNode(i) for i in range(5)]
+    for node in nodes:
+        assert queue.put(node)
+
+    assert queue.flush(timeout=5.0)
+    assert recorded == nodes
+
+    queue.shutdown(timeout=5.0)
+    assert not queue.is_alive()
+
+
+def test_record_queue_put_after_shutdown():
+    recorded = []
+
+    queue = TransactionRecordQueue("test", recorded.append, 10)
+    queue.start()
+    queue.shutdown(timeout=5.0)
+
+    assert not queue.put(FakeNode("late"))
+    assert recorded == []
+
+
+def test_record_queue_drop_policy():
+    queue = TransactionRecordQueue("test", None, 2, "drop")
+
+    assert queue.put(FakeNode("a"))
+    assert queue.put(FakeNode("b"))
+    assert not queue.put(FakeNode("c"))
+
+    assert [node.name for _, node in queue._queue] == ["a", "b"]
+    assert queue.stats() == (3, 1, 2)
+
+    # Counts are reset after stats are retrieved, with the depth
+    # starting from the current length of the queue.
+    assert queue.stats() == (0, 0, 2)
+
+
+def test_record_queue_sample_policy():
+    queue = TransactionRecordQueue("test", None, 3, "sample")
+
+    assert queue.put(FakeNode("a", priority=0.5))
+    assert queue.put(FakeNode("b", priority=0.1))
+    assert queue.put(FakeNode("c", priority=0.9))
+
+    # Lower priority than any node on the queue so it is discarded.
+    assert not queue.put(FakeNode("d", priority=0.05))
+
+    # A sampled transaction displaces the lowest priority node rather
+    # than the oldest.
+    assert queue.put(FakeNode("e", priority=1.5))
+
+    assert [node.name for _, node in queue._queue] == ["a", "c", "e"]
+    assert queue.stats() == (5, 2, 3)
+
+
+def test_record_queue_sample_policy_without_priority():
+    queue = TransactionRecordQueue("test", None, 1, "sample")
+
+    # Nodes have no priority when distributed tracing is disabled. They
+    # are given a random one so that sampling still works.
+    assert queue.put(FakeNode("a", priority=None))
+    assert 0.0 <= queue._queue[0][0] < 1.0
+
+    assert queue.put(FakeNode("c", priority=1.5))
+
+    assert [node.name for _, node in queue._queue] == ["c"]
+
+
+def test_record_queue_block_policy():
+    recorded = []
+    release = threading.Event()
+
+    def record(node):
+        release.wait(5.0)
+        recorded.append(node.name)
+
+    queue = TransactionRecordQueue("test", record, 1, "block")
+    queue.start()
+
+    assert queue.put(FakeNode("a"))
+
+    # Wait for the aggregator thread to take "a" off the queue where it
+    # will then block in record() until released.
+    for _ in range(500):
+        if not len(queue):
+            break
+        threading.Event().wait(0.01)
+
+    assert queue.put(FakeNode("b"))
+
+    result = []
+    producer = threading.Thread(target=lambda: result.append(queue.put(FakeNode("c"))))
+    producer.start()
+
+    producer.join(0.1)
+    assert producer.is_alive()
+
+    release.set()
+    producer.join(5.0)
+
+    assert result == [True]
+
+    assert queue.flush(timeout=5.0)
+    assert recorded == ["a", "b", "c"]
+    assert queue.stats()[1] == 0
+
+    queue.shutdown(timeout=5.0)
+
+
+def test_record_queue_record_failure():
+    recorded = []
+
+    def record(node):
+        if node.name == "bad":
+            raise ValueError(node.name)
+        recorded.append(node.name)
+
+    queue = TransactionRecordQueue("test", record, 10)
+    queue.start()
+
+    queue.put(FakeNode("bad"))
+    queue.put(FakeNode("good"))
+
+    assert queue.flush(timeout=5.0)
+    assert recorded == ["good"]
+
+    queue.shutdown(timeout=5.0)
+
+
+def test_record_queue_invalid_policy():
+    with pytest.raises(ValueError):
+        TransactionRecordQueue("test", None, 10, "unknown")
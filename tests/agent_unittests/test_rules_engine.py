@@ -0,0 +1,168 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from newrelic.core.rules_engine import RulesEngine
+
+EXPRESSIONS = (
+    (r"^[0-9]+$", "*"),
+    (r"[0-9]+", "N"),
+    (r"^/users/[^/]+", "/users/*"),
+    (r"\.(css|gif|png)$", r".\1"),
+    (r"^a$", "b/c"),
+    (r"b", "a"),
+    (r"/+", "/"),
+)
+
+NAMES = (
+    "",
+    "/",
+    "/users/123/orders/456",
+    "/users/alice/avatar.PNG",
+    "/a/b/c",
+    "a//b",
+    "/123/456/a",
+    b"/bytes/\xe9/789",
+)
+
+
+def normalize_in_order(rules, string):
+    # Reference implementation which applies each rule in turn, splitting
+    # the name on every segment rule.
+
+    if isinstance(string, bytes):
+        string = string.decode("Latin-1")
+
+    final_string = string
+    ignore = False
+    for rule in rules:
+        if rule.each_segment:
+            segments = final_string.split("/")
+            if segments and not segments[0]:
+                rule_segments = [""]
+                segments = segments[1:]
+            else:
+                rule_segments = []
+
+            matched = False
+            for segment in segments:
+                rule_segment, match_count = rule.apply(segment)
+                matched = matched or (match_count > 0)
+                rule_segments.append(rule_segment)
+
+            if matched:
+                final_string = "/".join(rule_segments)
+        else:
+            final_string, match_count = rule.apply(final_string)
+            matched = match_count > 0
+
+        if matched:
+            ignore = ignore or rule.ignore
+
+        if matched and rule.terminate_chain:
+            break
+
+    return final_string, bool(ignore)
+
+
+def make_rules(rng, each_segment):
+    rules = []
+    for order in range(rng.randint(1, 5)):
+        match_expression, replacement = rng.choice(EXPRESSIONS)
+        rules.append(
+            {
+                "match_expression": match_expression,
+                "replacement": replacement,
+                "ignore": rng.random() < 0.1,
+                "eval_order": order,
+                "terminate_chain": rng.random() < 0.3,
+                "each_segment": each_segment and rng.random() < 0.6,
+                "replace_all": rng.random() < 0.5,
+            }
+        )
+    return rules
+
+
+@pytest.mark.parametrize("each_segment", (False, True))
+@pytest.mark.parametrize("seed", range(25))
+def test_rules_engine_matches_rules_applied_in_order(seed, each_segment):
+    rng = random.Random(seed)
+    rules_engine = RulesEngine(make_rules(rng, each_segment))
+
+    for name in NAMES:
+        expected = normalize_in_order(rules_engine.rules, name)
+
+        # Second call is answered from the cache.
+        assert rules_engine.normalize(name) == expected
+        assert rules_engine.normalize(name) == expected
+
+
+def test_rules_engine_no_rules():
+    rules_engine = RulesEngine([])
+    assert rules_engine.normalize("/users/123") == ("/users/123", False)
+
+
+def rule(match_expression, replacement, eval_order):
+    return {
+        "match_expression": match_expression,
+        "replacement": replacement,
+        "ignore": False,
+        "eval_order": eval_order,
+        "terminate_chain": False,
+        "each_segment": False,
+        "replace_all": False,
+    }
+
+
+@pytest.mark.parametrize(
+    "rules,name,expected",
+    (
+        # Combining the expressions renumbers their groups, so a back
+        # reference to a numbered group would refer to the group of
+        # another expression.
+        ([rule(r"(x)y", "X", 0), rule(r"/(a)\1", "/DUP", 1)], "/aa/b", ("/DUP/b", False)),
+        ([rule(r"(x)y", "X", 0), rule(r"/(a)(?(1)a|b)", "/DUP", 1)], "/aa/b", ("/DUP/b", False)),
+        # Expressions which can't be combined, here as they define the
+        # same named group, disable the prefilter rather than failing.
+        ([rule(r"(?P<c>[a-z])(?P=c)", "X", 0), rule(r"/(?P<c>z)", "/y", 1)], "/aabb", ("/Xbb", False)),
+    ),
+)
+def test_rules_engine_unfusable_expressions(rules, name, expected):
+    rules_engine = RulesEngine(rules)
+    assert rules_engine.normalize(name) == expected
+
+
+def test_rules_engine_cache_is_bounded():
+    rules_engine = RulesEngine(
+        [
+            {
+                "match_expression": r"[0-9]+",
+                "replacement": "*",
+                "ignore": False,
+                "eval_order": 0,
+                "terminate_chain": True,
+                "each_segment": False,
+                "replace_all": True,
+            }
+        ],
+        cache_size=10,
+    )
+
+    for i in range(100):
+        assert rules_engine.normalize("/request/%d" % i) == ("/request/*", False)
+
+    assert len(rules_engine._RulesEngine__cache) <= 10
@@ -0,0 +1,113 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+from collections import namedtuple
+
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.stats_engine import SlowSqlStats, SlowSqlTable, StatsEngine
+
+FakeSlowSqlNode = namedtuple("FakeSlowSqlNode", ["identifier", "duration"])
+
+
+def stats_with_max(max_call_time):
+    stats = SlowSqlStats()
+    stats.merge_slow_sql_node(FakeSlowSqlNode(None, max_call_time))
+    return stats
+
+
+def create_stats_engine(slow_sql_data):
+    settings = finalize_application_settings(
+        {"slow_sql.enabled": True, "agent_limits.slow_sql_data": slow_sql_data}
+    )
+    stats_engine = StatsEngine()
+    stats_engine.reset_stats(settings)
+    return stats_engine
+
+
+def test_slow_sql_table_admits_until_full():
+    table = SlowSqlTable(2)
+
+    assert table.admit(1.0)
+    table["a"] = stats_with_max(1.0)
+    assert table.admit(0.5)
+    table["b"] = stats_with_max(0.5)
+
+    # Full, so a faster statement is rejected and a slower one evicts
+    # the fastest held.
+
+    assert not table.admit(0.1)
+    assert sorted(table) == ["a", "b"]
+
+    assert table.admit(2.0)
+    assert sorted(table) == ["a"]
+
+
+def test_slow_sql_table_zero_maximum():
+    table = SlowSqlTable(0)
+    assert not table.admit(1.0)
+
+
+def test_slow_sql_table_threshold_tracks_updates():
+    table = SlowSqlTable(2)
+    table["a"] = stats_with_max(1.0)
+    table["b"] = stats_with_max(2.0)
+
+    assert not table.admit(0.5)
+
+    # The fastest entry gets slower, so a statement which would have
+    # displaced it before no longer does.
+
+    table["a"].merge_slow_sql_node(FakeSlowSqlNode("a", 3.0))
+
+    assert not table.admit(1.5)
+    assert sorted(table) == ["a", "b"]
+
+    assert table.admit(2.5)
+    assert sorted(table) == ["a"]
+
+
+def test_record_slow_sql_node_keeps_slowest():
+    stats_engine = create_stats_engine(3)
+
+    durations = list(range(1, 21))
+    random.shuffle(durations)
+
+    for duration in durations:
+        stats_engine.record_slow_sql_node(FakeSlowSqlNode("sql-%d" % duration, float(duration)))
+
+    # Repeat calls for a statement which is held are merged in.
+
+    stats_engine.record_slow_sql_node(FakeSlowSqlNode("sql-20", 1.0))
+
+    table = stats_engine.sql_stats_table
+
+    assert sorted(table) == ["sql-18", "sql-19", "sql-20"]
+    assert table["sql-20"].call_count == 2
+    assert table["sql-20"].max_call_time == 20.0
+
+
+def test_merge_keeps_slowest():
+    stats_engine = create_stats_engine(2)
+
+    for duration in (1.0, 2.0):
+        stats_engine.record_slow_sql_node(FakeSlowSqlNode("sql-%s" % duration, duration))
+
+    workarea = stats_engine.create_workarea()
+    workarea.record_slow_sql_node(FakeSlowSqlNode("sql-3.0", 3.0))
+    workarea.record_slow_sql_node(FakeSlowSqlNode("sql-0.5", 0.5))
+
+    stats_engine.merge(workarea)
+
+    assert sorted(stats_engine.sql_stats_table) == ["sql-2.0", "sql-3.0"]
@@ -0,0 +1,122 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import random
+import re
+
+import pytest
+
+from newrelic.core.database_utils import _obfuscate_sql
+
+# The obfuscator substitutes quoted strings and literals in a single pass.
+# These tests check it against the original implementation, which first
+# substituted quoted strings and then literals, over the cross agent test
+# vectors plus a corpus of large and randomly generated statements.
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), os.pardir, "cross_agent", "fixtures", "sql_obfuscation", "sql_obfuscation.json"
+)
+
+_single_quotes_p = r"'(?:[^']|'')*?(?:\\'.*|'(?!'))"
+_double_quotes_p = r'"(?:[^"]|"")*?(?:\\".*|"(?!"))'
+_dollar_quotes_p = r"(\$(?!\d)[^$]*?\$).*?(?:\1|$)"
+_oracle_quotes_p = r"q'\[.*?(?:\]'|$)|q'\{.*?(?:\}'|$)|" r"q'\<.*?(?:\>'|$)|q'\(.*?(?:\)'|$)"
+
+_all_literals_re = re.compile(
+    "("
+    + ")|(".join(
+        [
+            r"\{?(?:[0-9a-f]\-?){32}\}?",
+            r"0x[0-9a-f]+",
+            r"(?<!:)-?\b(?:[0-9]+\.)?[0-9]+(e[+-]?[0-9]+)?",
+            r"\b(?:true|false|null)\b",
+        ]
+    )
+    + ")",
+    re.IGNORECASE,
+)
+
+QUOTING_STYLES = {
+    "single": (re.compile(_single_quotes_p), re.compile(r"'")),
+    "single+double": (re.compile(_single_quotes_p + "|" + _double_quotes_p), re.compile(r"'|\"")),
+    "single+dollar": (re.compile(_single_quotes_p + "|" + _dollar_quotes_p), re.compile(r"'|\$(?!\?)")),
+    "single+oracle": (re.compile(_single_quotes_p + "|" + _oracle_quotes_p), re.compile(r"'")),
+}
+
+
+class DummyDB(object):
+    def __init__(self, quoting_style):
+        self.quoting_style = quoting_style
+
+
+def obfuscate_in_two_passes(sql, quoting_style):
+    quotes_re, quotes_cleanup_re = QUOTING_STYLES[quoting_style]
+
+    sql = quotes_re.sub("?", sql)
+    sql = _all_literals_re.sub("?", sql)
+
+    if quotes_cleanup_re.search(sql):
+        sql = "?"
+
+    return sql
+
+
+def load_cross_agent_sql():
+    with open(FIXTURE) as fh:
+        return [test["sql"] for test in json.load(fh)]
+
+
+def large_statements():
+    rows = range(2000)
+    return [
+        "SELECT * FROM t WHERE id IN (%s)" % ",".join(str(i) for i in rows),
+        "INSERT INTO t (a, b, c, d) VALUES %s" % ",".join("(%d, 'name %d', \"x\", -1.5e3)" % (i, i) for i in rows),
+        "SELECT * FROM t WHERE h IN (%s)" % ",".join("'%032x'" % i for i in rows),
+        "SELECT * FROM t WHERE h IN (%s)" % ",".join("{%032x}" % i for i in rows),
+        "UPDATE t SET flag = TRUE, other = null WHERE a = 0x%s" % ("ab" * 2000),
+    ]
+
+
+def random_statements(count=5000, seed=0):
+    tokens = list("aAbeEfFxXqQtTnN0123456789-+.:{}$'\"\\()[]<> ,\n_") + [
+        "true",
+        "FALSE",
+        "null",
+        "0x1f",
+        "1e5",
+        "$a$",
+        "q'[",
+        "q'(",
+        "''",
+        "--",
+        "/*",
+        "deadbeef" * 4,
+        "0123-4567-89ab-cdef-",
+    ]
+    rng = random.Random(seed)
+    return ["".join(rng.choice(tokens) for _ in range(rng.randint(0, 30))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("quoting_style", sorted(QUOTING_STYLES))
+@pytest.mark.parametrize(
+    "corpus",
+    (load_cross_agent_sql, large_statements, random_statements),
+)
+def test_obfuscate_sql_matches_two_pass_obfuscation(corpus, quoting_style):
+    database = DummyDB(quoting_style)
+
+    for sql in corpus():
+        assert _obfuscate_sql(sql, database) == obfuscate_in_two_passes(sql, quoting_style), sql
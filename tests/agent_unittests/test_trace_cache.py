@@ -0,0 +1,158 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from newrelic.core.trace_cache import TraceCache
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+pytestmark = pytest.mark.skipif(contextvars is None, reason="Context variables are not available.")
+
+
+class FakeTrace(object):
+    def __init__(self, cache, parent=None):
+        self.parent = parent
+        self.root = parent.root if parent else self
+        self.exited = False
+        self.thread_id = cache.current_thread_id()
+
+    def has_outstanding_children(self):
+        return False
+
+
+@pytest.fixture
+def cache():
+    cache = TraceCache()
+    assert cache.enable_context_variables()
+    return cache
+
+
+def test_context_variables_follow_trace_stack(cache):
+    root = FakeTrace(cache)
+    cache.save_trace(root)
+    assert cache.current_trace() is root
+
+    child = FakeTrace(cache, parent=root)
+    cache.save_trace(child)
+    assert cache.current_trace() is child
+
+    cache.pop_current(child)
+    assert cache.current_trace() is root
+
+    cache.complete_root(root)
+    assert cache.current_trace() is None
+
+
+def test_context_variables_not_shared_with_threads(cache):
+    root = FakeTrace(cache)
+    cache.save_trace(root)
+
+    traces = []
+    thread = threading.Thread(target=lambda: traces.append(cache.current_trace()))
+    thread.start()
+    thread.join()
+
+    assert traces == [None]
+    assert cache.current_trace() is root
+
+    cache.complete_root(root)
+
+
+def test_context_variables_not_shared_with_executor_threads(cache):
+    root = FakeTrace(cache)
+    cache.save_trace(root)
+
+    # Running a function in a copy of the context in another thread must
+    # not make the trace of this thread the current trace there.
+
+    context = contextvars.copy_context()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(context.run, cache.current_trace).result() is None
+
+    assert cache.current_trace() is root
+
+    cache.complete_root(root)
+
+
+@pytest.mark.skipif(not hasattr(asyncio, "to_thread"), reason="asyncio.to_thread() is not available.")
+def test_context_variables_not_shared_with_to_thread(cache):
+    traces = []
+
+    def work():
+        traces.append(cache.current_trace())
+
+        # A trace started in the other thread is its own root and is
+        # tracked by the context of that thread.
+
+        trace = FakeTrace(cache)
+        cache.save_trace(trace)
+        traces.append(cache.current_trace() is trace)
+        cache.complete_root(trace)
+
+    async def outer():
+        root = FakeTrace(cache)
+        cache.save_trace(root)
+
+        await asyncio.to_thread(work)
+
+        traces.append(cache.current_trace() is root)
+        cache.complete_root(root)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(outer())
+    finally:
+        loop.close()
+
+    assert traces == [None, True, True]
+
+
+def test_context_variables_set_current(cache):
+    root = FakeTrace(cache)
+    thread_id = cache.current_thread_id()
+
+    cache.set_current(thread_id, root)
+    assert cache.current_trace() is root
+    assert cache._cache[thread_id] is root
+
+    cache.set_current(thread_id, None)
+    assert cache.current_trace() is None
+    assert thread_id not in cache._cache
+
+
+def test_context_variables_ignore_exited_trace(cache):
+    root = FakeTrace(cache)
+    cache.save_trace(root)
+
+    root.exited = True
+    assert cache.current_trace() is None
+
+
+def test_enable_context_variables_with_active_traces():
+    cache = TraceCache()
+
+    root = FakeTrace(cache)
+    cache.save_trace(root)
+
+    assert not cache.enable_context_variables()
+    assert cache.current_trace() is root
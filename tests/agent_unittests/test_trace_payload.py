@@ -0,0 +1,55 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import zlib
+
+import pytest
+
+from newrelic.common.encoding_utils import json_encode
+from newrelic.core.stats_engine import _pack_trace_data
+from newrelic.core.string_table import StringTable
+from newrelic.core.trace_node import RootNode, TraceNode
+
+
+def make_trace(string_table, depth, fanout):
+    def make_node(level, index):
+        children = []
+        if level < depth:
+            children = [make_node(level + 1, i) for i in range(fanout)]
+        name = string_table.cache("Function/level_%d_%d" % (level, index))
+        return TraceNode(level, level + 1.0, name, {"index": index, "unicode": u"é"}, children, "label")
+
+    root = TraceNode(0, 10.0, "ROOT", {}, [make_node(0, 0)], "label")
+    trace = RootNode(0, {}, {}, root, {"attr": "value"})
+
+    return [trace, string_table.values()]
+
+
+@pytest.mark.parametrize("depth,fanout", ((0, 1), (3, 3), (6, 4)))
+def test_pack_trace_data(depth, fanout):
+    data = make_trace(StringTable(), depth, fanout)
+
+    pack_data = _pack_trace_data(data, zlib.Z_DEFAULT_COMPRESSION)
+
+    assert zlib.decompress(base64.standard_b64decode(pack_data)).decode("utf-8") == json_encode(data)
+
+
+def test_string_table():
+    string_table = StringTable()
+
+    assert string_table.cache("first") == "`0"
+    assert string_table.cache("second") == "`1"
+    assert string_table.cache("first") == "`0"
+    assert string_table.values() == ["first", "second"]